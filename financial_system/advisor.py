@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from cache import TTLCache
+import storage
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upstream configuration (GROQ_API_URL can point at groq_stub.py for local runs)
+GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+GROQ_API_URL = os.getenv('GROQ_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+GROQ_MODEL = os.getenv('GROQ_MODEL', 'gemma2-9b-it')
+GROQ_TIMEOUT = float(os.getenv('GROQ_TIMEOUT', '30'))
+
+# Background job and cache settings
+ADVICE_WORKERS = int(os.getenv('ADVICE_WORKERS', '4'))
+ADVICE_QUEUE_LIMIT = int(os.getenv('ADVICE_QUEUE_LIMIT', '100'))
+ADVICE_CACHE_TTL = int(os.getenv('ADVICE_CACHE_TTL', '900'))
+ADVICE_JOB_RETENTION_HOURS = int(os.getenv('ADVICE_JOB_RETENTION_HOURS', '24'))
+
+UNAVAILABLE_MESSAGE = "AI advice is currently unavailable. Please configure the API key."
+ERROR_MESSAGE = "I'm having trouble connecting to provide advice right now. Please try again in a moment."
+
+SYSTEM_PROMPT = 'You are a certified financial advisor. Provide specific, actionable advice based on the user transaction history. Break down complex concepts into simple terms. Always suggest concrete steps. Keep response under 500 characters.'
+
+ADVICE_PROMPT = """
+        {financial_context}
+
+        User Question: {user_query}
+
+        Please provide helpful, practical financial advice based on their situation.
+        Break down complex concepts into simple terms. Always suggest concrete steps.
+        Keep the response concise and actionable (500-700 characters).
+        """
+
+class AdviceQueueFull(Exception):
+    pass
+
+advice_cache = TTLCache(ttl_seconds=ADVICE_CACHE_TTL, max_entries=int(os.getenv('ADVICE_CACHE_SIZE', '1024')))
+
+_session = None
+_session_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=ADVICE_WORKERS, thread_name_prefix='advice')
+_queue_slots = threading.BoundedSemaphore(ADVICE_QUEUE_LIMIT)
+_last_purge = None
+
+def get_session():
+    # Shared keep-alive session so advice calls reuse TLS connections to the upstream
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(ADVICE_WORKERS * 2, 10))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def build_prompt(financial_context, user_query):
+    return ADVICE_PROMPT.format(financial_context=financial_context, user_query=user_query)
+
+def build_payload(prompt, stream=False):
+    payload = {
+        'messages': [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': prompt}
+        ],
+        'model': GROQ_MODEL,
+        'max_tokens': 500,
+        'temperature': 0.7,
+        'top_p': 0.9
+    }
+    if stream:
+        payload['stream'] = True
+    return payload
+
+def fetch_completion(prompt):
+    headers = {
+        'Authorization': f'Bearer {GROQ_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    with metrics.upstream('groq'):
+        response = get_session().post(GROQ_API_URL, headers=headers, json=build_payload(prompt), timeout=GROQ_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"Groq API error: {response.status_code}, {response.text}")
+        return response.json()['choices'][0]['message']['content']
+
+def stream_completion(prompt):
+    # Yields content deltas from an OpenAI-style streamed chat completion
+    headers = {
+        'Authorization': f'Bearer {GROQ_API_KEY}',
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream'
+    }
+    # Timed until the stream ends, so this includes the time the client takes to read it
+    with metrics.upstream('groq_stream', phase=False), get_session().post(
+            GROQ_API_URL, headers=headers, json=build_payload(prompt, stream=True),
+            timeout=GROQ_TIMEOUT, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Groq API error: {response.status_code}, {response.text}")
+
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                return
+            chunk = json.loads(data)
+            for choice in chunk.get('choices', []):
+                text = (choice.get('delta') or {}).get('content')
+                if text:
+                    yield text
+
+def stream_advice(financial_context, user_query):
+    # Yields ('token', text) events, then ('done', timings) or ('error', message)
+    started = time.perf_counter()
+    key = cache_key(financial_context, user_query)
+    advice = advice_cache.get(key)
+    if advice is not None:
+        yield 'token', advice
+        yield 'done', {'cached': True, 'ttfb_ms': 0.0, 'total_ms': (time.perf_counter() - started) * 1000}
+        return
+
+    if not GROQ_API_KEY:
+        yield 'token', UNAVAILABLE_MESSAGE
+        yield 'done', {'cached': False, 'ttfb_ms': None, 'total_ms': 0.0}
+        return
+
+    parts = []
+    ttfb_ms = None
+    try:
+        for text in stream_completion(build_prompt(financial_context, user_query)):
+            if ttfb_ms is None:
+                ttfb_ms = (time.perf_counter() - started) * 1000
+            parts.append(text)
+            yield 'token', text
+    except Exception as e:
+        logger.error(f"AI stream error: {e}")
+        yield 'error', ERROR_MESSAGE
+        return
+
+    total_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Advice stream finished: first token after {ttfb_ms or 0:.0f}ms, total {total_ms:.0f}ms")
+    if parts:
+        advice_cache.put(key, ''.join(parts))
+    yield 'done', {'cached': False, 'ttfb_ms': ttfb_ms, 'total_ms': total_ms}
+
+def normalize_query(user_query):
+    query = ' '.join(user_query.lower().split())
+    return re.sub(r'[\s?!.]+$', '', query)
+
+def cache_key(financial_context, user_query):
+    raw = f"{' '.join(financial_context.split())}\n{normalize_query(user_query)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def get_advice(financial_context, user_query):
+    # Only successful completions are cached; fallback messages are retried next time
+    key = cache_key(financial_context, user_query)
+    advice = advice_cache.get(key)
+    if advice is not None:
+        return advice
+
+    if not GROQ_API_KEY:
+        return UNAVAILABLE_MESSAGE
+    try:
+        advice = fetch_completion(build_prompt(financial_context, user_query))
+    except Exception as e:
+        logger.error(f"AI response error: {e}")
+        return ERROR_MESSAGE
+
+    advice_cache.put(key, advice)
+    return advice
+
+# Background jobs; state lives in the database so any worker can answer a poll
+def submit_advice_job(user_email, financial_context, user_query):
+    _maybe_purge_advice_jobs()
+    job_id = uuid.uuid4().hex
+    cached = advice_cache.get(cache_key(financial_context, user_query))
+    if cached is not None:
+        storage.create_advice_job(job_id, user_email, status='done', advice=cached)
+        return storage.get_advice_job(user_email, job_id)
+
+    if not _queue_slots.acquire(blocking=False):
+        raise AdviceQueueFull()
+
+    storage.create_advice_job(job_id, user_email)
+    try:
+        _executor.submit(_run_advice_job, job_id, financial_context, user_query)
+    except Exception:
+        _queue_slots.release()
+        storage.update_advice_job(job_id, 'failed', error='Could not schedule advice job')
+        raise
+    return storage.get_advice_job(user_email, job_id)
+
+def _run_advice_job(job_id, financial_context, user_query):
+    try:
+        storage.update_advice_job(job_id, 'running')
+        advice = get_advice(financial_context, user_query)
+        storage.update_advice_job(job_id, 'done', advice=advice)
+    except Exception as e:
+        logger.error(f"Advice job {job_id} failed: {e}")
+        try:
+            storage.update_advice_job(job_id, 'failed', error='Could not generate advice')
+        except Exception as update_error:
+            logger.error(f"Could not record failure for advice job {job_id}: {update_error}")
+    finally:
+        _queue_slots.release()
+
+def purge_advice_jobs():
+    cutoff = (datetime.now() - timedelta(hours=ADVICE_JOB_RETENTION_HOURS)).isoformat()
+    return storage.delete_advice_jobs_before(cutoff)
+
+def _maybe_purge_advice_jobs():
+    global _last_purge
+    now = datetime.now()
+    if _last_purge is not None and now - _last_purge < timedelta(hours=1):
+        return
+    _last_purge = now
+    try:
+        purge_advice_jobs()
+    except Exception as e:
+        logger.error(f"Advice job purge failed: {e}")
+
+def shutdown(wait=True):
+    _executor.shutdown(wait=wait)
@@ -0,0 +1,212 @@
+from datetime import datetime
+import numpy as np
+import money
+import storage
+import metrics
+
+# Report granularities and the largest series we are willing to build in one request
+GRANULARITIES = ('day', 'week', 'month', 'quarter', 'year')
+MAX_PERIODS = 20000
+
+INCOME, EXPENSE, OTHER = 0, 1, 2
+
+# A user's transactions as parallel arrays: one entry per transaction in every column
+class ColumnarTransactions:
+    def __init__(self, dates, amounts, type_codes, category_codes, categories):
+        self.dates = dates
+        self.amounts = amounts
+        self.type_codes = type_codes
+        self.category_codes = category_codes
+        self.categories = categories
+        self._period_indexes = {}
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def period_index(self, granularity):
+        # Calendar conversions dominate report time, so keep one index array per granularity
+        indexes = self._period_indexes.get(granularity)
+        if indexes is None:
+            indexes = self._period_indexes[granularity] = period_index(self.dates, granularity)
+        return indexes
+
+    @classmethod
+    @metrics.timed('aggregation')
+    def from_rows(cls, rows):
+        # rows: iterable of (date, type, amount in minor units, category)
+        dates, types, amounts, categories = [], [], [], []
+        for row in rows:
+            dates.append(row[0])
+            types.append(row[1])
+            amounts.append(row[2])
+            categories.append(row[3] or '')
+
+        # Dictionary-encode categories so group-bys are integer bincounts
+        names, category_codes = np.unique(np.array(categories, dtype=object), return_inverse=True)
+        type_lookup = {'income': INCOME, 'expense': EXPENSE}
+        return cls(
+            dates=_parse_dates(dates),
+            amounts=np.array(amounts, dtype=np.int64),
+            type_codes=np.array([type_lookup.get(t, OTHER) for t in types], dtype=np.int8),
+            category_codes=category_codes.astype(np.int32),
+            categories=[str(name) for name in names]
+        )
+
+def _parse_dates(values):
+    values = [str(v)[:10] if v else 'NaT' for v in values]
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        # Fall back to element-wise parsing so one malformed date does not sink the report
+        parsed = np.empty(len(values), dtype='datetime64[D]')
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = np.datetime64(value, 'D')
+            except ValueError:
+                parsed[i] = np.datetime64('NaT')
+        return parsed
+
+def get_columns(user_email, start_date=None):
+    # Archived years are only decoded for reports that reach back into them
+    version = storage.get_data_version(user_email)
+    archived_through = storage.archived_through(user_email)
+    include_archived = archived_through is not None and (start_date is None or start_date <= archived_through)
+    kind = 'columns_all' if include_archived else 'columns'
+    columns = storage.user_cache.get(user_email, kind, version)
+    if columns is None:
+        columns = ColumnarTransactions.from_rows(storage.fetch_transaction_columns(user_email, include_archived))
+        storage.user_cache.put(user_email, kind, version, columns)
+    return columns
+
+def period_index(days, granularity):
+    # Map datetime64[D] values to consecutive integers per period (weeks start on Monday)
+    if granularity == 'day':
+        return days.astype(np.int64)
+    if granularity == 'week':
+        return (days.astype(np.int64) + 3) // 7
+    if granularity == 'year':
+        return days.astype('datetime64[Y]').astype(np.int64)
+    months = days.astype('datetime64[M]').astype(np.int64)
+    if granularity == 'quarter':
+        return months // 3
+    return months
+
+def period_labels(indexes, granularity):
+    if granularity == 'day':
+        return list(np.datetime_as_string(indexes.astype('datetime64[D]')))
+    if granularity == 'week':
+        return list(np.datetime_as_string((indexes * 7 - 3).astype('datetime64[D]')))
+    if granularity == 'month':
+        return list(np.datetime_as_string(indexes.astype('datetime64[M]')))
+    if granularity == 'quarter':
+        return [f"{1970 + int(i) // 4}-Q{int(i) % 4 + 1}" for i in indexes]
+    return [str(1970 + int(i)) for i in indexes]
+
+def rolling_mean(values, window):
+    # Trailing mean over up to `window` periods; the first periods average what is available
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    return (cumulative[ends] - cumulative[starts]) / (ends - starts)
+
+def group_sum(keys, amounts, size):
+    # Per-key sums of minor units in int64. np.bincount would add them as float64, which stops
+    # being exact once a sum passes 2**53 (a few thousand of the largest amounts allowed).
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, keys, amounts)
+    return totals
+
+def major(total):
+    # A minor-unit sum back to the API's major units
+    return money.to_major(int(total))
+
+@metrics.timed('aggregation')
+def build_report(columns, granularity, start_date, end_date, window=None):
+    start = np.datetime64(start_date, 'D')
+    end = np.datetime64(end_date, 'D')
+    first = int(period_index(np.array([start]), granularity)[0])
+    last = int(period_index(np.array([end]), granularity)[0])
+    count = last - first + 1
+    if count > MAX_PERIODS:
+        raise ValueError(f'Requested range spans more than {MAX_PERIODS} periods')
+
+    # NaT is the smallest int64, so comparing day numbers also drops unparseable dates
+    days = columns.dates.view(np.int64)
+    in_range = (days >= start.astype(np.int64)) & (days <= end.astype(np.int64))
+    amounts = columns.amounts
+    type_codes = columns.type_codes
+    category_codes = columns.category_codes
+    slots = columns.period_index(granularity)
+    if not in_range.all():
+        amounts = amounts[in_range]
+        type_codes = type_codes[in_range]
+        category_codes = category_codes[in_range]
+        slots = slots[in_range]
+
+    # Fold the row type into the group key so each group-by is one pass without masking.
+    # Like the monthly trend, every non-income row counts as spending in the series.
+    flows = group_sum((slots - first) * 2 + (type_codes != INCOME), amounts, 2 * count).reshape(count, 2)
+    income = flows[:, 0]
+    expenses = flows[:, 1]
+
+    type_keys = category_codes.astype(np.int64) * 3 + type_codes
+    category_totals = group_sum(type_keys, amounts, 3 * len(columns.categories)).reshape(-1, 3)
+    category_counts = np.bincount(type_keys, minlength=3 * len(columns.categories)).reshape(-1, 3)
+
+    labels = period_labels(np.arange(first, last + 1), granularity)
+    series = []
+    for i, label in enumerate(labels):
+        series.append({
+            'period': label,
+            'income': major(income[i]),
+            'expenses': major(expenses[i]),
+            'net': major(income[i] - expenses[i])
+        })
+
+    if window:
+        income_avg = rolling_mean(income, window)
+        expenses_avg = rolling_mean(expenses, window)
+        for i, point in enumerate(series):
+            point['income_avg'] = float(income_avg[i]) / money.scale()
+            point['expenses_avg'] = float(expenses_avg[i]) / money.scale()
+
+    return {
+        'granularity': granularity,
+        'start': str(start),
+        'end': str(end),
+        'income': major(category_totals[:, INCOME].sum()),
+        'expenses': major(category_totals[:, EXPENSE].sum()),
+        'categories': {
+            columns.categories[i]: major(category_totals[i, EXPENSE])
+            for i in np.flatnonzero(category_counts[:, EXPENSE])
+        },
+        'series': series
+    }
+
+def default_start(end_date, granularity, periods):
+    # First day of the period `periods - 1` steps before the one containing end_date
+    end = np.datetime64(end_date, 'D')
+    first = period_index(np.array([end]), granularity)[0] - (periods - 1)
+    if granularity == 'day':
+        return str(np.datetime64(int(first), 'D'))
+    if granularity == 'week':
+        return str(np.datetime64(int(first) * 7 - 3, 'D'))
+    if granularity == 'month':
+        return str(np.datetime64(int(first), 'M').astype('datetime64[D]'))
+    if granularity == 'quarter':
+        return str(np.datetime64(int(first) * 3, 'M').astype('datetime64[D]'))
+    return str(np.datetime64(int(first), 'Y').astype('datetime64[D]'))
+
+def last_n_months(n, today=None):
+    # Calendar months ending with the current one, oldest first
+    today = today or datetime.now()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(n):
+        months.append(f"{year:04d}-{month:02d}")
+        month -= 1
+        if month == 0:
+            month = 12
+            year -= 1
+    months.reverse()
+    return months
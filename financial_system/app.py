@@ -1,18 +1,28 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for, make_response
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, make_response, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-import requests
 import os
 import json
+import base64
+import csv
+import io
 import hashlib
+import hmac
 import random
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 import re
 from authlib.integrations.flask_client import OAuth
 import logging
+import gzip
+import threading
+import atexit
+import click
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,11 +31,28 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Local modules read their settings from the environment at import time
+import money
+import storage
+import advisor
+import mailer
+import otp_store
+import analytics
+import sessions
+import passwords
+import recurring
+import search
+import categorizer
+import metrics
+import profiler
+
 app = Flask(__name__)
 CORS(app, supports_credentials=True, origins=["http://localhost:5000", "http://127.0.0.1:5000"])
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
+app.session_interface = sessions.create_session_interface()
+metrics.init_app(app)
 
 # Initialize OAuth
 oauth = OAuth(app)
@@ -41,47 +68,158 @@ google = oauth.register(
     client_kwargs={'scope': 'openid email profile'},
 )
 
-# Configuration
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-EMAIL_USER = os.getenv('EMAIL_USER')
-EMAIL_PASS = os.getenv('EMAIL_PASS')
+# Response compression for large JSON bodies; brotli is used when the package is installed
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+def preferred_encoding(size):
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
 
-# File paths for data storage
+@app.after_request
+def compress_response(response):
+    # Streams (exports, SSE) and already-encoded responses are passed through untouched
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+    
+    encoding = preferred_encoding(response.content_length or 0)
+    if encoding:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+# Legacy JSON data files (imported once into the database by migrate-json)
 DATA_DIR = 'data'
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 TRANSACTIONS_FILE = os.path.join(DATA_DIR, 'transactions.json')
 BUDGETS_FILE = os.path.join(DATA_DIR, 'budgets.json')
 OTP_FILE = os.path.join(DATA_DIR, 'otp_data.json')
 
-# Initialize data files and directory
+# Initialize the database, importing the legacy JSON files on first run
 def init_data_files():
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
     
-    for file_path in [USERS_FILE, TRANSACTIONS_FILE, BUDGETS_FILE, OTP_FILE]:
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as f:
-                json.dump({}, f)
+    storage.init_db()
+    if os.path.exists(USERS_FILE):
+        storage.migrate_from_json(USERS_FILE, TRANSACTIONS_FILE, BUDGETS_FILE, OTP_FILE, only_if_empty=True)
 
-def load_data(file_path):
-    try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading {file_path}: {e}")
-        return {}
+_started = False
+_startup_lock = threading.Lock()
 
-def save_data(file_path, data):
+# Entry point for WSGI servers (see wsgi.py): prepares the database and starts this
+# process's background workers once, however many times it is called
+def create_app():
+    global _started
+    with _startup_lock:
+        if not _started:
+            init_data_files()
+            # Resume delivery of any email still queued from before a restart
+            mailer.ensure_worker()
+            otp_store.ensure_sweeper()
+            recurring.ensure_scheduler()
+            storage.ensure_compactor()
+            atexit.register(shutdown_app)
+            _started = True
+    return app
+
+# Let queued emails and running advice jobs finish, then fold the WAL into the database file
+def shutdown_app():
+    global _started
+    with _startup_lock:
+        if not _started:
+            return
+        _started = False
+
+    mailer.stop_worker()
+    otp_store.stop_sweeper()
+    recurring.stop_scheduler()
+    storage.stop_compactor()
+    advisor.shutdown(wait=True)
+    passwords.shutdown(wait=True)
+    try:
+        metrics.flush()
+    except OSError as e:
+        logger.error(f"Metrics snapshot on shutdown failed: {e}")
     try:
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
-        return True
+        storage.checkpoint()
     except Exception as e:
-        logger.error(f"Error saving {file_path}: {e}")
-        return False
+        logger.error(f"WAL checkpoint on shutdown failed: {e}")
+    storage.close_db()
+
+@app.cli.command('migrate-json')
+def migrate_json_command():
+    counts = storage.migrate_from_json(USERS_FILE, TRANSACTIONS_FILE, BUDGETS_FILE, OTP_FILE)
+    click.echo(f"Imported {counts['users']} users, {counts['transactions']} transactions, "
+               f"{counts['budgets']} budgets and {counts['otp']} OTP entries into {storage.DB_FILE}; "
+               f"skipped {counts['skipped_users']} users imported earlier")
+
+@app.cli.command('compact-journal')
+@click.option('--retention-days', type=int, default=None, help='Keep events newer than this many days.')
+def compact_journal_command(retention_days):
+    removed = storage.compact_journal(retention_days)
+    click.echo(f"Removed {removed} journal events and checkpointed the WAL")
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+@app.cli.command('migrate-shards')
+def migrate_shards_command():
+    storage.init_db()
+    moved = storage.migrate_to_shards()
+    click.echo(f"Moved {moved} users from {storage.DB_FILE} into {storage.SHARD_COUNT} shards under {storage.SHARD_DIR}")
+
+@app.cli.command('check-shards')
+def check_shards_command():
+    results = storage.check_shards()
+    damaged = {shard: result for shard, result in results.items() if result != 'ok'}
+    for shard, result in damaged.items():
+        click.echo(f"{storage.shard_path(shard)}: {result}")
+    click.echo(f"Checked {len(results)} shards, {len(damaged)} damaged")
+
+@app.cli.command('run-recurring')
+def run_recurring_command():
+    # For deployments that prefer cron over the in-process scheduler
+    created = recurring.run_due()
+    click.echo(f"Created {created} recurring transactions and budgets")
+
+@app.cli.command('rebuild-search-index')
+@click.option('--email', default=None, help='Only reindex this user.')
+def rebuild_search_index_command(email):
+    rebuilt = storage.rebuild_search_index(email)
+    click.echo(f"Rebuilt the search index for {rebuilt} user(s)")
+
+@app.cli.command('archive-transactions')
+@click.option('--keep-years', type=int, default=None, help='Calendar years to keep live, this one included.')
+@click.option('--email', default=None, help='Only archive this user.')
+def archive_transactions_command(keep_years, email):
+    # Run from cron, e.g. early every January
+    before = storage.archive_cutoff(keep_years)
+    moved = storage.archive_transactions(before, email)
+    click.echo(f"Archived {moved} transactions dated before {before}")
+
+@app.cli.command('rebuild-aggregates')
+@click.option('--email', default=None, help='Only rebuild the totals for this user.')
+def rebuild_aggregates_command(email):
+    drifted = storage.rebuild_aggregates(email)
+    if drifted:
+        click.echo(f"Rebuilt aggregates; {len(drifted)} user(s) had drifted: {', '.join(drifted)}")
+    else:
+        click.echo('Rebuilt aggregates; all running totals matched the raw transactions')
+
+def busy_response():
+    response = jsonify({'success': False, 'message': 'Server is busy. Please try again shortly.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -90,39 +228,6 @@ def validate_email(email):
 def generate_otp():
     return str(random.randint(100000, 999999))
 
-def send_otp_email(email, otp):
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = email
-        msg['Subject'] = "Password Reset OTP - Financial Management System"
-        
-        body = f"""
-        Hello,
-        
-        Your OTP for password reset is: {otp}
-        
-        This OTP will expire in 10 minutes.
-        
-        If you didn't request this, please ignore this email.
-        
-        Best regards,
-        Financial Management System
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASS)
-        text = msg.as_string()
-        server.sendmail(EMAIL_USER, email, text)
-        server.quit()
-        return True
-    except Exception as e:
-        logger.error(f"Email sending failed: {e}")
-        return False
-
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -142,20 +247,21 @@ def google_authorize():
         
         # Create or retrieve user
         email = user_info['email']
-        users = load_data(USERS_FILE)
+        user = storage.get_user(email)
         
-        if email not in users:
-            users[email] = {
+        if user is None:
+            user = {
                 'name': user_info.get('name', 'Google User'),
                 'email': email,
                 'phone': 'Not provided',
                 'password': '',  # No password for Google users
                 'created_at': datetime.now().isoformat()
             }
-            save_data(USERS_FILE, users)
+            storage.create_user(user)
         
+        sessions.rotate(session)
         session['user_email'] = email
-        session['user_name'] = users[email]['name']
+        session['user_name'] = user['name']
         
         # Return script to close popup and redirect
         return '''
@@ -172,8 +278,6 @@ def google_authorize():
 def check_auth():
     if 'user_email' in session:
         email = session['user_email']
-        users = load_data(USERS_FILE)
-        user = users.get(email, {})
         return jsonify({
             'authenticated': True,
             'user': {
@@ -206,20 +310,20 @@ def register():
             return jsonify({'success': False, 'message': 'Invalid phone number'}), 400
         
         # Check if user exists
-        users = load_data(USERS_FILE)
-        if email in users:
+        if storage.get_user(email) is not None:
             return jsonify({'success': False, 'message': 'Email already registered'}), 400
         
         # Create user
-        users[email] = {
+        user = {
             'name': name,
             'email': email,
             'phone': phone,
-            'password': hash_password(password),
+            'password': passwords.hash_password(password),
             'created_at': datetime.now().isoformat()
         }
         
-        if save_data(USERS_FILE, users):
+        if storage.create_user(user):
+            sessions.rotate(session)
             session['user_email'] = email
             session['user_name'] = name
             
@@ -234,6 +338,8 @@ def register():
         else:
             return jsonify({'success': False, 'message': 'Failed to save user data'}), 500
         
+    except passwords.HasherBusy:
+        return busy_response()
     except Exception as e:
         logger.error(f"Registration error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -248,26 +354,34 @@ def login():
         if not email or not password:
             return jsonify({'success': False, 'message': 'Email and password required'}), 400
         
-        users = load_data(USERS_FILE)
+        user = storage.get_user(email)
         
-        if email not in users:
+        if user is None:
             return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
         
-        if users[email]['password'] != hash_password(password):
+        valid, upgraded_hash = passwords.verify_password(password, user['password'])
+        if not valid:
             return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
         
+        # Move legacy SHA-256 and outdated hashes to the current scheme while we have the password
+        if upgraded_hash:
+            storage.update_user_password(email, upgraded_hash)
+        
+        sessions.rotate(session)
         session['user_email'] = email
-        session['user_name'] = users[email]['name']
+        session['user_name'] = user['name']
         
         return jsonify({
             'success': True, 
             'message': 'Login successful',
             'user': {
-                'name': users[email]['name'],
+                'name': user['name'],
                 'email': email
             }
         })
         
+    except passwords.HasherBusy:
+        return busy_response()
     except Exception as e:
         logger.error(f"Login error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -284,34 +398,33 @@ def forgot_password():
         if not validate_email(email):
             return jsonify({'success': False, 'message': 'Invalid email format'}), 400
             
-        users = load_data(USERS_FILE)
+        user = storage.get_user(email)
         
-        if email not in users:
+        if user is None:
             return jsonify({'success': False, 'message': 'Email not found'}), 404
         
-        # Generate OTP
+        # Generate OTP, subject to the per-email resend limits
         otp = generate_otp()
-        otp_data = load_data(OTP_FILE)
-        
-        otp_data[email] = {
-            'otp': otp,
-            'expires_at': (datetime.now() + timedelta(minutes=10)).isoformat(),
-            'phone': users[email]['phone']
-        }
-        
-        if not save_data(OTP_FILE, otp_data):
-            return jsonify({'success': False, 'message': 'Failed to save OTP data'}), 500
-        
-        # Send OTP via email
-        if send_otp_email(email, otp):
-            return jsonify({
-                'success': True, 
-                'message': 'OTP sent to your email',
-                'phone': users[email]['phone'][-4:]  # Show last 4 digits
-            })
-        else:
+        retry_after = otp_store.issue(email, otp, user['phone'])
+        
+        if retry_after:
+            response = jsonify({'success': False, 'message': 'Too many OTP requests. Please try again later.'})
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response, 429
+        
+        # Queue the OTP email; the outbox worker delivers it in the background
+        try:
+            mailer.enqueue_otp_email(email, otp)
+        except Exception as e:
+            logger.error(f"Failed to queue OTP email: {e}")
             return jsonify({'success': False, 'message': 'Failed to send OTP'}), 500
         
+        return jsonify({
+            'success': True, 
+            'message': 'OTP sent to your email',
+            'phone': user['phone'][-4:]  # Show last 4 digits
+        })
+        
     except Exception as e:
         logger.error(f"Forgot password error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -330,35 +443,33 @@ def verify_otp():
         if len(new_password) < 6:
             return jsonify({'success': False, 'message': 'Password must be at least 6 characters'}), 400
         
-        otp_data = load_data(OTP_FILE)
+        otp_entry = storage.get_otp(email)
         
-        if email not in otp_data:
+        if otp_entry is None:
             return jsonify({'success': False, 'message': 'No OTP found for this email'}), 404
         
         # Check OTP expiry
-        expires_at = datetime.fromisoformat(otp_data[email]['expires_at'])
+        expires_at = datetime.fromisoformat(otp_entry['expires_at'])
         if datetime.now() > expires_at:
-            del otp_data[email]
-            save_data(OTP_FILE, otp_data)
+            storage.delete_otp(email)
             return jsonify({'success': False, 'message': 'OTP has expired'}), 400
         
         # Verify OTP
-        if otp_data[email]['otp'] != otp:
+        if otp_entry['otp'] != otp:
             return jsonify({'success': False, 'message': 'Invalid OTP'}), 400
         
         # Update password
-        users = load_data(USERS_FILE)
-        users[email]['password'] = hash_password(new_password)
-        
-        if not save_data(USERS_FILE, users):
+        if not storage.update_user_password(email, passwords.hash_password(new_password)):
             return jsonify({'success': False, 'message': 'Failed to update password'}), 500
         
-        # Clear OTP
-        del otp_data[email]
-        save_data(OTP_FILE, otp_data)
+        # Clear OTP and sign out every existing session for this account
+        storage.delete_otp(email)
+        app.session_interface.revoke_user(email)
         
         return jsonify({'success': True, 'message': 'Password reset successful'})
         
+    except passwords.HasherBusy:
+        return busy_response()
     except Exception as e:
         logger.error(f"OTP verification error: {e}")
         return jsonify({'success': False, 'message': 'Server error'}), 500
@@ -366,10 +477,9 @@ def verify_otp():
 @app.route('/api/logout', methods=['POST'])
 def logout():
     try:
+        # Clearing the session deletes it from the session store and expires the cookie
         session.clear()
-        response = make_response(jsonify({'success': True, 'message': 'Logged out successfully'}))
-        response.set_cookie('session', '', expires=0)
-        return response
+        return jsonify({'success': True, 'message': 'Logged out successfully'})
     except Exception as e:
         logger.error(f"Logout error: {e}")
         return jsonify({'success': False, 'message': 'Logout failed'}), 500
@@ -379,6 +489,104 @@ def require_login():
         return jsonify({'success': False, 'message': 'Please login first'}), 401
     return None
 
+def build_transaction(data):
+    if not isinstance(data, dict):
+        raise ValueError('Invalid transaction data')
+    
+    # Amounts are kept in the deployment's currency only
+    currency = data.get('currency')
+    if currency is not None and str(currency).upper() != money.CURRENCY:
+        raise ValueError('Unsupported currency')
+    
+    try:
+        amount = abs(money.to_minor(data.get('amount', 0)))
+    except ValueError as e:
+        raise ValueError('Amount is too large' if 'large' in str(e) else 'Invalid transaction data')
+    if amount <= 0:
+        raise ValueError('Invalid amount')
+
+    # Dates are sorted, paged and archived as text, so only zero-padded YYYY-MM-DD is accepted
+    date = data.get('date') or datetime.now().strftime('%Y-%m-%d')
+    try:
+        valid = datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d') == date
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise ValueError('date must be in YYYY-MM-DD format')
+
+    return {
+        'type': data.get('type'),
+        'amount': money.to_major(amount),
+        'category': data.get('category'),
+        'description': data.get('description'),
+        'date': date
+    }
+
+# Transaction listing parameters
+TRANSACTION_QUERY_PARAMS = ['start_date', 'end_date', 'type', 'category', 'min_amount', 'max_amount',
+                            'q', 'sort', 'limit', 'cursor']
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(sort, key):
+    raw = json.dumps([sort, key[0], key[1]], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, last_id = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort:
+        raise ValueError('Cursor does not match the requested sort order')
+    # The key goes straight into SQL parameters, so it must have the sort column's type;
+    # only date keys are text, amounts and search relevance scores are numbers
+    if sort in storage.TRANSACTION_SORTS and storage.TRANSACTION_SORTS[sort][0] == 'date':
+        valid_value = value is None or isinstance(value, str)
+    else:
+        valid_value = isinstance(value, (int, float)) and not isinstance(value, bool)
+    valid_id = isinstance(last_id, int) and not isinstance(last_id, bool) and -2 ** 63 <= last_id < 2 ** 63
+    if not valid_value or not valid_id:
+        raise ValueError('Invalid cursor')
+    return value, last_id
+
+def parse_transaction_query(args):
+    filters = {
+        'start_date': args.get('start_date'),
+        'end_date': args.get('end_date'),
+        'type': args.get('type'),
+        'category': args.get('category'),
+        'search': args.get('q', '').strip()
+    }
+    for key in ['start_date', 'end_date']:
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'{key} must be in YYYY-MM-DD format')
+    for key in ['min_amount', 'max_amount']:
+        filters[key] = None
+        if args.get(key):
+            try:
+                money.to_minor(args[key])
+                filters[key] = float(args[key])
+            except ValueError:
+                raise ValueError(f'{key} must be a number')
+
+    sort = args.get('sort', 'date_desc')
+    if sort not in storage.TRANSACTION_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(storage.TRANSACTION_SORTS)}")
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    after = decode_cursor(args['cursor'], sort) if args.get('cursor') else None
+    return filters, sort, limit, after
+
 @app.route('/api/transactions', methods=['GET', 'POST'])
 def handle_transactions():
     auth_check = require_login()
@@ -386,60 +594,273 @@ def handle_transactions():
         return auth_check
     
     user_email = session['user_email']
-    all_transactions = load_data(TRANSACTIONS_FILE)
-    user_transactions = all_transactions.get(user_email, [])
     
     if request.method == 'GET':
-        return jsonify(user_transactions)
+        # Without query parameters keep returning the full list for older clients
+        if not any(param in request.args for param in TRANSACTION_QUERY_PARAMS):
+            return jsonify(storage.get_transactions(user_email))
+        
+        try:
+            filters, sort, limit, after = parse_transaction_query(request.args)
+            page, next_key = storage.query_transactions(user_email, filters, sort, limit, after)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'transactions': page,
+            'next_cursor': encode_cursor(sort, next_key) if next_key else None
+        })
     
     data = request.get_json()
     try:
-        amount = abs(float(data.get('amount', 0)))
-        if amount <= 0:
-            return jsonify({'success': False, 'message': 'Invalid amount'}), 400
-        
-        transaction = {
-            'id': len(user_transactions) + 1,
-            'type': data.get('type'),
-            'amount': amount,
-            'category': data.get('category'),
-            'description': data.get('description'),
-            'date': data.get('date', datetime.now().strftime('%Y-%m-%d'))
-        }
-        
-        user_transactions.append(transaction)
-        all_transactions[user_email] = user_transactions
-        
-        if save_data(TRANSACTIONS_FILE, all_transactions):
-            return jsonify(transaction), 201
-        else:
-            return jsonify({'success': False, 'message': 'Failed to save transaction'}), 500
+        transaction = build_transaction(data)
+        if not transaction['category']:
+            transaction['category'] = categorizer.get_model(user_email).suggest(
+                transaction['description'], transaction['type'])
+        transaction = storage.add_transaction(user_email, transaction)
+        return jsonify(transaction), 201
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"Transaction error: {e}")
         return jsonify({'success': False, 'message': 'Invalid transaction data'}), 400
 
-@app.route('/api/transactions/<int:transaction_id>', methods=['DELETE'])
-def delete_transaction(transaction_id):
+# Ranked search over descriptions and categories, e.g. /api/transactions/search?q=cofee+sta
+@app.route('/api/transactions/search', methods=['GET'])
+def search_transactions():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': 'q is required'}), 400
+    
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be an integer'}), 400
+    try:
+        after = decode_cursor(request.args['cursor'], 'relevance') if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    try:
+        hits, total, next_key = search.search(session['user_email'], query, limit, after)
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({'success': False, 'message': 'Search failed'}), 500
+    
+    return jsonify({
+        'success': True,
+        'transactions': hits,
+        'total': total,
+        'next_cursor': encode_cursor('relevance', next_key) if next_key else None
+    })
+
+# Category suggestions learned from the user's own transactions, e.g.
+# /api/transactions/categorize?description=Tesco+Metro&type=expense
+@app.route('/api/transactions/categorize', methods=['GET'])
+def categorize_transaction():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    description = request.args.get('description', '').strip()
+    if not description:
+        return jsonify({'success': False, 'message': 'description is required'}), 400
+    
+    try:
+        model = categorizer.get_model(session['user_email'])
+        predictions = model.predict(description, request.args.get('type'))
+    except Exception as e:
+        logger.error(f"Categorize error: {e}")
+        return jsonify({'success': False, 'message': 'Could not suggest a category'}), 500
+    
+    return jsonify({
+        'success': True,
+        'suggestions': [{'category': category, 'confidence': confidence} for category, confidence in predictions],
+        'category': predictions[0][0] if predictions and predictions[0][1] >= categorizer.CATEGORIZER_MIN_CONFIDENCE else None
+    })
+
+# Bulk import/export
+IMPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 500
+MAX_REPORTED_IMPORT_ERRORS = 100
+EXPORT_FIELDS = ['id', 'type', 'amount', 'category', 'description', 'date']
+
+def detect_import_format(upload):
+    requested = request.args.get('format')
+    if requested:
+        return requested.lower()
+    
+    filename = (upload.filename or '').lower() if upload else ''
+    content_type = (upload.mimetype if upload else request.mimetype) or ''
+    if filename.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+def iter_import_rows(text_stream, import_format):
+    # Yields (row_number, data, error) without reading the whole upload into memory
+    if import_format == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row_number, row in enumerate(reader, start=1):
+            # Empty cells fall back to the same defaults as the JSON endpoint
+            yield row_number, {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}, None
+    else:
+        for row_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield row_number, json.loads(line), None
+            except ValueError:
+                yield row_number, None, 'Invalid JSON'
+
+@app.route('/api/transactions/import', methods=['POST'])
+def import_transactions():
     auth_check = require_login()
     if auth_check:
         return auth_check
     
     user_email = session['user_email']
-    all_transactions = load_data(TRANSACTIONS_FILE)
-    user_transactions = all_transactions.get(user_email, [])
+    upload = request.files.get('file')
+    import_format = detect_import_format(upload)
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'format must be csv or ndjson'}), 400
     
-    initial_count = len(user_transactions)
-    user_transactions = [t for t in user_transactions if t.get('id') != transaction_id]
+    raw_stream = upload.stream if upload else request.stream
+    text_stream = io.TextIOWrapper(raw_stream, encoding='utf-8-sig', newline='')
     
-    if len(user_transactions) == initial_count:
-        return jsonify({'success': False, 'message': 'Transaction not found'}), 404
+    imported = 0
+    failed = 0
+    categorized = 0
+    errors = []
+    batch = []
+    # Trained on first use, so imports that already carry categories never build a model
+    model = None
+    
+    def record_error(row_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+            errors.append({'row': row_number, 'message': message})
+    
+    try:
+        for row_number, data, error in iter_import_rows(text_stream, import_format):
+            if error:
+                record_error(row_number, error)
+                continue
+            try:
+                transaction = build_transaction(data)
+            except ValueError as e:
+                record_error(row_number, str(e))
+                continue
+            # Rows without a category get the model's guess when it is confident; the model is
+            # not refreshed mid-import, so its own guesses are never fed back into the batch
+            if not transaction['category']:
+                if model is None:
+                    model = categorizer.get_model(user_email)
+                transaction['category'] = model.suggest(transaction['description'], transaction['type'])
+                if transaction['category']:
+                    categorized += 1
+            batch.append(transaction)
+            
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += len(storage.add_transactions(user_email, batch))
+                batch = []
+        
+        imported += len(storage.add_transactions(user_email, batch))
+    except (UnicodeDecodeError, csv.Error) as e:
+        logger.error(f"Import parse error: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Could not parse the uploaded file',
+            'imported': imported,
+            'failed': failed,
+            'categorized': categorized,
+            'errors': errors
+        }), 400
+    except Exception as e:
+        logger.error(f"Import error: {e}")
+        return jsonify({
+            'success': False,
+            'message': 'Import failed',
+            'imported': imported,
+            'failed': failed,
+            'categorized': categorized,
+            'errors': errors
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'message': f'Imported {imported} transactions',
+        'imported': imported,
+        'failed': failed,
+        'categorized': categorized,
+        'errors': errors
+    })
+
+@app.route('/api/transactions/export', methods=['GET'])
+def export_transactions():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    user_email = session['user_email']
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'format must be csv or ndjson'}), 400
     
-    all_transactions[user_email] = user_transactions
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for count, transaction in enumerate(storage.iter_transactions(user_email, EXPORT_CHUNK_SIZE), start=1):
+            writer.writerow(transaction)
+            if count % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
     
-    if save_data(TRANSACTIONS_FILE, all_transactions):
-        return jsonify({'success': True, 'message': 'Transaction deleted successfully'}), 200
+    def generate_ndjson():
+        chunk = []
+        for transaction in storage.iter_transactions(user_email, EXPORT_CHUNK_SIZE):
+            chunk.append(json.dumps(transaction, separators=(',', ':')))
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+    
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
     else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=transactions.{export_format}'
+    return response
+
+@app.route('/api/transactions/<int:transaction_id>', methods=['DELETE'])
+def delete_transaction(transaction_id):
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    user_email = session['user_email']
+    
+    try:
+        deleted = storage.delete_transaction(user_email, transaction_id)
+    except Exception as e:
+        logger.error(f"Transaction delete error: {e}")
         return jsonify({'success': False, 'message': 'Failed to delete transaction'}), 500
+    
+    if not deleted:
+        return jsonify({'success': False, 'message': 'Transaction not found'}), 404
+    
+    return jsonify({'success': True, 'message': 'Transaction deleted successfully'}), 200
 
 @app.route('/api/budgets', methods=['GET', 'POST'])
 def handle_budgets():
@@ -448,36 +869,43 @@ def handle_budgets():
         return auth_check
     
     user_email = session['user_email']
-    all_budgets = load_data(BUDGETS_FILE)
-    user_budgets = all_budgets.get(user_email, [])
     
     if request.method == 'GET':
-        return jsonify(user_budgets)
+        return jsonify(storage.get_budgets(user_email))
     
     data = request.get_json()
     try:
-        limit = float(data.get('limit', 0))
+        try:
+            limit = money.to_minor(data.get('limit', 0))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid budget limit'}), 400
         if limit <= 0:
             return jsonify({'success': False, 'message': 'Invalid budget limit'}), 400
         
         budget = {
-            'id': len(user_budgets) + 1,
             'category': data.get('category'),
-            'limit': limit,
+            'limit': money.to_major(limit),
             'month': data.get('month', datetime.now().strftime('%Y-%m'))
         }
         
-        user_budgets.append(budget)
-        all_budgets[user_email] = user_budgets
-        
-        if save_data(BUDGETS_FILE, all_budgets):
-            return jsonify(budget), 201
-        else:
-            return jsonify({'success': False, 'message': 'Failed to save budget'}), 500
+        budget = storage.add_budget(user_email, budget)
+        return jsonify(budget), 201
     except Exception as e:
         logger.error(f"Budget error: {e}")
         return jsonify({'success': False, 'message': 'Invalid budget data'}), 400
 
+@app.route('/api/budgets/status', methods=['GET'])
+def get_budget_status():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    try:
+        return jsonify({'success': True, 'budgets': storage.get_budget_status(session['user_email'])})
+    except Exception as e:
+        logger.error(f"Budget status error: {e}")
+        return jsonify({'success': False, 'message': 'Error calculating budget status'}), 500
+
 @app.route('/api/budgets/<int:budget_id>', methods=['DELETE'])
 def delete_budget(budget_id):
     auth_check = require_login()
@@ -485,21 +913,137 @@ def delete_budget(budget_id):
         return auth_check
     
     user_email = session['user_email']
-    all_budgets = load_data(BUDGETS_FILE)
-    user_budgets = all_budgets.get(user_email, [])
     
-    initial_count = len(user_budgets)
-    user_budgets = [b for b in user_budgets if b.get('id') != budget_id]
+    try:
+        deleted = storage.delete_budget(user_email, budget_id)
+    except Exception as e:
+        logger.error(f"Budget delete error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to delete budget'}), 500
     
-    if len(user_budgets) == initial_count:
+    if not deleted:
         return jsonify({'success': False, 'message': 'Budget not found'}), 404
     
-    all_budgets[user_email] = user_budgets
+    return jsonify({'success': True, 'message': 'Budget deleted successfully'}), 200
+
+# Recurring transaction and budget templates, materialized by the recurring scheduler
+def build_recurring_rule(data):
+    if not isinstance(data, dict):
+        raise ValueError('Invalid recurring rule')
     
-    if save_data(BUDGETS_FILE, all_budgets):
-        return jsonify({'success': True, 'message': 'Budget deleted successfully'}), 200
+    frequency = data.get('frequency')
+    if frequency not in recurring.FREQUENCIES:
+        raise ValueError(f"frequency must be one of: {', '.join(recurring.FREQUENCIES)}")
+    if frequency == 'custom':
+        unit = data.get('unit')
+        if unit not in recurring.UNITS:
+            raise ValueError(f"unit must be one of: {', '.join(recurring.UNITS)}")
+        try:
+            interval = int(data.get('interval', 0))
+        except (TypeError, ValueError):
+            raise ValueError('interval must be an integer')
+        if not 1 <= interval <= recurring.MAX_INTERVAL:
+            raise ValueError(f'interval must be between 1 and {recurring.MAX_INTERVAL}')
     else:
-        return jsonify({'success': False, 'message': 'Failed to delete budget'}), 500
+        unit, interval = recurring.FREQUENCIES[frequency]
+    
+    # Normalized to YYYY-MM-DD, since the scheduler compares dates as strings
+    dates = {}
+    for key in ['start_date', 'end_date']:
+        dates[key] = None
+        if data.get(key):
+            try:
+                dates[key] = datetime.strptime(data[key], '%Y-%m-%d').strftime('%Y-%m-%d')
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be in YYYY-MM-DD format')
+    start_date = dates['start_date'] or datetime.now().strftime('%Y-%m-%d')
+    end_date = dates['end_date']
+    
+    kind = data.get('kind', 'transaction')
+    if kind == 'transaction':
+        template = build_transaction(data)
+        del template['date']
+    elif kind == 'budget':
+        if unit != 'month':
+            raise ValueError('Budget templates must repeat monthly')
+        try:
+            limit = money.to_minor(data.get('limit', 0))
+        except ValueError:
+            raise ValueError('Invalid budget limit')
+        if limit <= 0:
+            raise ValueError('Invalid budget limit')
+        template = {'category': data.get('category'), 'limit': money.to_major(limit), 'rollover': bool(data.get('rollover'))}
+        # A budget covers a whole month, so its occurrences fall on the first
+        start_date = start_date[:8] + '01'
+    else:
+        raise ValueError('kind must be transaction or budget')
+    
+    if end_date is not None and end_date < start_date:
+        raise ValueError('end_date must not be before start_date')
+    
+    return {
+        'kind': kind,
+        'template': template,
+        'frequency': frequency,
+        'unit': unit,
+        'interval': interval,
+        'start_date': start_date,
+        'end_date': end_date
+    }
+
+@app.route('/api/recurring', methods=['GET', 'POST'])
+def handle_recurring():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    user_email = session['user_email']
+    
+    if request.method == 'GET':
+        return jsonify({'success': True, 'rules': storage.get_recurring_rules(user_email)})
+    
+    try:
+        rule = storage.add_recurring_rule(user_email, build_recurring_rule(request.get_json()))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Recurring rule error: {e}")
+        return jsonify({'success': False, 'message': 'Invalid recurring rule'}), 400
+    
+    # Occurrences already due (e.g. a rule starting today) are created straight away
+    created = 0
+    if rule['start_date'] <= datetime.now().strftime('%Y-%m-%d'):
+        try:
+            created = recurring.materialize_user(user_email)
+        except Exception as e:
+            # The scheduler retries on its next pass
+            logger.error(f"Recurring materialize error: {e}")
+    
+    return jsonify({'success': True, 'rule': storage.get_recurring_rule(user_email, rule['id']), 'created': created}), 201
+
+@app.route('/api/recurring/<int:rule_id>', methods=['DELETE'])
+def delete_recurring(rule_id):
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    try:
+        deleted = storage.delete_recurring_rule(session['user_email'], rule_id)
+    except Exception as e:
+        logger.error(f"Recurring delete error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to delete recurring rule'}), 500
+    
+    if not deleted:
+        return jsonify({'success': False, 'message': 'Recurring rule not found'}), 404
+    
+    return jsonify({'success': True, 'message': 'Recurring rule deleted successfully'}), 200
+
+def build_summary(aggregates):
+    return {
+        'income': aggregates['income'],
+        'expenses': aggregates['expenses'],
+        'balance': aggregates['balance'],
+        'transaction_count': aggregates['transaction_count']
+    }
 
 @app.route('/api/summary', methods=['GET'])
 def get_summary():
@@ -508,25 +1052,43 @@ def get_summary():
         return auth_check
     
     user_email = session['user_email']
-    all_transactions = load_data(TRANSACTIONS_FILE)
-    user_transactions = all_transactions.get(user_email, [])
     
     try:
-        income = sum(t['amount'] for t in user_transactions if t['type'] == 'income')
-        expenses = sum(t['amount'] for t in user_transactions if t['type'] == 'expense')
-        balance = income - expenses
-        
-        return jsonify({
-            'success': True,
-            'income': income,
-            'expenses': expenses,
-            'balance': balance,
-            'transaction_count': len(user_transactions)
-        })
+        return jsonify(dict(build_summary(storage.get_aggregates(user_email)), success=True))
     except Exception as e:
         logger.error(f"Summary error: {e}")
         return jsonify({'success': False, 'message': 'Error calculating summary'}), 500
 
+@metrics.timed('aggregation')
+def build_financial_context(user_email):
+    aggregates = storage.get_aggregates(user_email)
+    
+    income = aggregates['income']
+    expenses = aggregates['expenses']
+    balance = aggregates['balance']
+    
+    # Create budget summary from the (category, month) spend index
+    budget_summary = {}
+    for budget in storage.get_budget_status(user_email):
+        key = f"{budget['category']}-{budget['month']}"
+        if key not in budget_summary:
+            budget_summary[key] = budget
+    
+    # Format budget summary as string
+    budget_text = "\n".join(
+        [f"{item['category']} ({item['month']}): Limit ${item['limit']:.2f}, Spent ${item['spent']:.2f}, Remaining ${item['remaining']:.2f}" 
+         for item in budget_summary.values()]
+    )
+    
+    return f"""User's Financial Summary:
+        - Total Income: ${income:.2f}
+        - Total Expenses: ${expenses:.2f}
+        - Current Balance: ${balance:.2f}
+        - Number of Transactions: {aggregates['transaction_count']}
+        
+        Budget Summary:
+        {budget_text if budget_text else 'No budgets created'}"""
+
 @app.route('/api/financial-advice', methods=['POST'])
 def get_financial_advice():
     auth_check = require_login()
@@ -540,64 +1102,8 @@ def get_financial_advice():
         if not user_query.strip():
             return jsonify({'success': False, 'message': 'Please enter a question'}), 400
         
-        # Get user's financial summary
         user_email = session['user_email']
-        all_transactions = load_data(TRANSACTIONS_FILE)
-        user_transactions = all_transactions.get(user_email, [])
-        
-        income = sum(t['amount'] for t in user_transactions if t['type'] == 'income')
-        expenses = sum(t['amount'] for t in user_transactions if t['type'] == 'expense')
-        balance = income - expenses
-        
-        # Get budget data
-        all_budgets = load_data(BUDGETS_FILE)
-        user_budgets = all_budgets.get(user_email, [])
-        
-        # Create budget summary
-        budget_summary = {}
-        for budget in user_budgets:
-            category = budget['category']
-            month = budget['month']
-            key = f"{category}-{month}"
-            
-            if key not in budget_summary:
-                spent = sum(t['amount'] for t in user_transactions 
-                           if t['type'] == 'expense' and 
-                           t['category'] == category and 
-                           t['date'].startswith(month))
-                
-                budget_summary[key] = {
-                    'category': category,
-                    'month': month,
-                    'limit': budget['limit'],
-                    'spent': spent,
-                    'remaining': budget['limit'] - spent
-                }
-        
-        # Format budget summary as string
-        budget_text = "\n".join(
-            [f"{item['category']} ({item['month']}): Limit ${item['limit']:.2f}, Spent ${item['spent']:.2f}, Remaining ${item['remaining']:.2f}" 
-             for item in budget_summary.values()]
-        )
-        
-        context = f"""
-        User's Financial Summary:
-        - Total Income: ${income:.2f}
-        - Total Expenses: ${expenses:.2f}
-        - Current Balance: ${balance:.2f}
-        - Number of Transactions: {len(user_transactions)}
-        
-        Budget Summary:
-        {budget_text if budget_text else 'No budgets created'}
-        
-        User Question: {user_query}
-        
-        Please provide helpful, practical financial advice based on their situation.
-        Break down complex concepts into simple terms. Always suggest concrete steps.
-        Keep the response concise and actionable (500-700 characters).
-        """
-        
-        advice = get_ai_response(context)
+        advice = advisor.get_advice(build_financial_context(user_email), user_query)
         
         return jsonify({
             'success': True,
@@ -611,103 +1117,387 @@ def get_financial_advice():
             'message': 'Sorry, I could not provide advice at the moment. Please try again later.'
         }), 500
 
-@app.route('/api/reports', methods=['GET'])
-def get_reports():
+def format_sse(event, data, event_id=None):
+    prefix = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# A stream holds a worker thread for the whole upstream call, so like /api/live it gets a
+# per-process cap. When every slot is taken the client falls back to the advice jobs endpoint.
+ADVICE_MAX_STREAMS = int(os.getenv('ADVICE_MAX_STREAMS', '2'))
+_advice_stream_slots = threading.BoundedSemaphore(ADVICE_MAX_STREAMS)
+
+@app.route('/api/financial-advice/stream', methods=['POST'])
+def stream_financial_advice():
     auth_check = require_login()
     if auth_check:
         return auth_check
     
-    user_email = session['user_email']
-    all_transactions = load_data(TRANSACTIONS_FILE)
-    user_transactions = all_transactions.get(user_email, [])
-    
-    try:
-        # Calculate category spending
-        categories = {}
-        for t in user_transactions:
-            if t['type'] == 'expense':
-                category = t['category']
-                categories[category] = categories.get(category, 0) + t['amount']
-        
-        # Calculate monthly trends
-        monthly_trend = {}
-        for t in user_transactions:
-            month = t['date'][:7]  # YYYY-MM format
-            if month not in monthly_trend:
-                monthly_trend[month] = {'income': 0, 'expenses': 0}
-            
-            if t['type'] == 'income':
-                monthly_trend[month]['income'] += t['amount']
+    data = request.get_json(silent=True) or {}
+    user_query = data.get('query', '')
+    
+    if not user_query.strip():
+        return jsonify({'success': False, 'message': 'Please enter a question'}), 400
+    
+    if not _advice_stream_slots.acquire(blocking=False):
+        return jsonify({
+            'success': False,
+            'message': 'The advisor is busy right now. Please try again in a moment.'
+        }), 503
+    
+    # Build the context before streaming starts; the generator runs after the view returns
+    try:
+        financial_context = build_financial_context(session['user_email'])
+    except BaseException:
+        _advice_stream_slots.release()
+        raise
+    
+    def generate():
+        for event, payload in advisor.stream_advice(financial_context, user_query):
+            if event == 'token':
+                yield format_sse('token', {'text': payload})
+            elif event == 'done':
+                yield format_sse('done', payload)
             else:
-                monthly_trend[month]['expenses'] += t['amount']
-        
-        # Get the last 6 months
-        last_6_months = []
-        current_date = datetime.now()
-        for i in range(6):
-            month = current_date - timedelta(days=30*i)
-            month_str = month.strftime('%Y-%m')
-            last_6_months.append(month_str)
-        last_6_months.reverse()
-        
-        # Fill missing months
-        complete_monthly_trend = {}
-        for month in last_6_months:
-            complete_monthly_trend[month] = monthly_trend.get(month, {'income': 0, 'expenses': 0})
+                yield format_sse('error', {'message': payload})
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(_advice_stream_slots.release)
+    return response
+
+@app.route('/api/financial-advice/jobs', methods=['POST'])
+def create_advice_job():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    try:
+        data = request.get_json()
+        user_query = data.get('query', '')
+        
+        if not user_query.strip():
+            return jsonify({'success': False, 'message': 'Please enter a question'}), 400
         
+        user_email = session['user_email']
+        job = advisor.submit_advice_job(user_email, build_financial_context(user_email), user_query)
+        # Cached answers complete immediately; everything else is polled until done
+        return jsonify(dict(job, success=True)), 200 if job['status'] == 'done' else 202
+        
+    except advisor.AdviceQueueFull:
         return jsonify({
-            'success': True,
-            'income': sum(t['amount'] for t in user_transactions if t['type'] == 'income'),
-            'expenses': sum(t['amount'] for t in user_transactions if t['type'] == 'expense'),
-            'categories': categories,
-            'monthly_trend': complete_monthly_trend
-        })
+            'success': False,
+            'message': 'The advisor is busy right now. Please try again in a moment.'
+        }), 503
+    except Exception as e:
+        logger.error(f"Advice job error: {e}")
+        return jsonify({
+            'success': False, 
+            'message': 'Sorry, I could not provide advice at the moment. Please try again later.'
+        }), 500
+
+@app.route('/api/financial-advice/jobs/<job_id>', methods=['GET'])
+def get_advice_job(job_id):
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    job = storage.get_advice_job(session['user_email'], job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Advice job not found'}), 404
+    
+    return jsonify(dict(job, success=True))
+
+# Report parameters for the columnar engine
+REPORT_QUERY_PARAMS = ['granularity', 'start', 'end', 'periods', 'window']
+DEFAULT_REPORT_PERIODS = 12
+
+def parse_report_query(args):
+    granularity = args.get('granularity', 'month')
+    if granularity not in analytics.GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(analytics.GRANULARITIES)}")
+    
+    for key in ['start', 'end']:
+        if args.get(key):
+            try:
+                datetime.strptime(args[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'{key} must be in YYYY-MM-DD format')
+    
+    try:
+        periods = int(args.get('periods', DEFAULT_REPORT_PERIODS))
+        window = int(args['window']) if args.get('window') else None
+    except ValueError:
+        raise ValueError('periods and window must be integers')
+    if periods < 1 or (window is not None and window < 1):
+        raise ValueError('periods and window must be positive')
+    # Checked before default_start, which cannot step back more periods than fit in a C long
+    if periods > analytics.MAX_PERIODS or (window is not None and window > analytics.MAX_PERIODS):
+        raise ValueError(f'periods and window must be at most {analytics.MAX_PERIODS}')
+    
+    end_date = args.get('end') or datetime.now().strftime('%Y-%m-%d')
+    start_date = args.get('start') or analytics.default_start(end_date, granularity, periods)
+    if start_date > end_date:
+        raise ValueError('start must not be after end')
+    return granularity, start_date, end_date, window
+
+def build_monthly_report(aggregates):
+    # Category spending and monthly trends come from the running totals
+    monthly_trend = aggregates['monthly']
+    
+    # Fill missing months over the last 6 calendar months
+    complete_monthly_trend = {}
+    for month in analytics.last_n_months(6):
+        complete_monthly_trend[month] = monthly_trend.get(month, {'income': 0, 'expenses': 0})
+    
+    return {
+        'income': aggregates['income'],
+        'expenses': aggregates['expenses'],
+        'categories': aggregates['categories'],
+        'monthly_trend': complete_monthly_trend
+    }
+
+@app.route('/api/reports', methods=['GET'])
+def get_reports():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    user_email = session['user_email']
+    
+    if any(param in request.args for param in REPORT_QUERY_PARAMS):
+        try:
+            granularity, start_date, end_date, window = parse_report_query(request.args)
+            report = analytics.build_report(analytics.get_columns(user_email, start_date), granularity, start_date, end_date, window)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Reports error: {e}")
+            return jsonify({'success': False, 'message': 'Error generating reports'}), 500
+        return jsonify(dict(report, success=True))
+    
+    try:
+        return jsonify(dict(build_monthly_report(storage.get_aggregates(user_email)), success=True))
     except Exception as e:
         logger.error(f"Reports error: {e}")
         return jsonify({'success': False, 'message': 'Error generating reports'}), 500
 
-def get_ai_response(prompt):
+# Everything the main screen needs in one response, revalidated by the user's data version
+def dashboard_etag(user_email, version, limit):
+    # The monthly trend window moves with the calendar, so the current month is part of the tag
+    owner = hashlib.sha256(user_email.encode()).hexdigest()[:16]
+    return f"{owner}-{version}-{limit}-{datetime.now().strftime('%Y-%m')}"
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    user_email = session['user_email']
+    
     try:
-        if not GROQ_API_KEY:
-            return "AI advice is currently unavailable. Please configure the API key."
-        
-        headers = {
-            'Authorization': f'Bearer {GROQ_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'messages': [
-                {
-                    'role': 'system', 
-                    'content': 'You are a certified financial advisor. Provide specific, actionable advice based on the user transaction history. Break down complex concepts into simple terms. Always suggest concrete steps. Keep response under 500 characters.'
-                },
-                {'role': 'user', 'content': prompt}
-            ],
-            'model': 'gemma2-9b-it',
-            'max_tokens': 500,
-            'temperature': 0.7,
-            'top_p': 0.9
-        }
-        
-        response = requests.post(
-            'https://api.groq.com/openai/v1/chat/completions',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            logger.error(f"Groq API error: {response.status_code}, {response.text}")
-            return "I'm having trouble connecting to provide advice right now. Please try again in a moment."
-            
-    except Exception as e:
-        logger.error(f"AI response error: {e}")
-        return "I'm having trouble connecting to provide advice right now. Please try again in a moment."
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be an integer'}), 400
+    
+    # Read the version before the data, so a concurrent write can only make the tag stale, never wrong
+    version = storage.get_data_version(user_email)
+    etag = dashboard_etag(user_email, version, limit)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        try:
+            cached = storage.user_cache.get(user_email, 'dashboard', version)
+            if cached is None or cached['etag'] != etag:
+                aggregates = storage.get_aggregates(user_email)
+                page, next_key = storage.query_transactions(user_email, None, 'date_desc', limit)
+                body = json.dumps({
+                    'success': True,
+                    'version': version,
+                    'summary': build_summary(aggregates),
+                    'transactions': page,
+                    'next_cursor': encode_cursor('date_desc', next_key) if next_key else None,
+                    'budgets': storage.get_budget_status(user_email),
+                    'reports': build_monthly_report(aggregates)
+                }, separators=(',', ':')).encode()
+                cached = {'etag': etag, 'body': body, 'encoded': {}}
+                storage.user_cache.put(user_email, 'dashboard', version, cached)
+        except Exception as e:
+            logger.error(f"Dashboard error: {e}")
+            return jsonify({'success': False, 'message': 'Error loading dashboard'}), 500
+        
+        # Keep compressed variants with the cached body so repeat loads skip compression too
+        response = Response(cached['body'], mimetype='application/json')
+        encoding = preferred_encoding(len(cached['body']))
+        if encoding:
+            if encoding not in cached['encoded']:
+                cached['encoded'][encoding] = compress_body(cached['body'], encoding)
+            response.set_data(cached['encoded'][encoding])
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Live dashboard updates over SSE. Writes in this process wake the stream at once; writes made
+# by other workers are noticed by polling the user's data version. Streams end after
+# LIVE_STREAM_SECONDS so worker threads are recycled, and the browser resumes via Last-Event-ID.
+LIVE_POLL_SECONDS = float(os.getenv('LIVE_POLL_SECONDS', '1'))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv('LIVE_HEARTBEAT_SECONDS', '15'))
+LIVE_STREAM_SECONDS = float(os.getenv('LIVE_STREAM_SECONDS', '30'))
+LIVE_EVENT_BATCH = 500
+# An open stream holds one of the process's gthread threads (8 by default, see gunicorn.conf.py),
+# so at most LIVE_MAX_STREAMS are open at once and the rest of the threads stay free for API
+# requests. A tab that finds no free slot is told to reconnect later; until then the dashboard
+# reloads after each write, as it does without live updates.
+LIVE_MAX_STREAMS = int(os.getenv('LIVE_MAX_STREAMS', '4'))
+LIVE_BUSY_RETRY_MS = (5000, 15000)
+_live_slots = threading.BoundedSemaphore(LIVE_MAX_STREAMS)
+
+def live_delta(event):
+    delta = {'entity': event['entity'], 'event': event['event'], 'id': event['id']}
+    if event['event'] == 'add':
+        delta['record'] = event['record']
+    return delta
+
+def live_aggregates(user_email, version):
+    aggregates = storage.get_aggregates(user_email)
+    return {
+        'version': version,
+        'summary': build_summary(aggregates),
+        'budgets': storage.get_budget_status(user_email),
+        'reports': build_monthly_report(aggregates)
+    }
+
+@app.route('/api/live', methods=['GET'])
+def live_updates():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    if not _live_slots.acquire(blocking=False):
+        # Spread out the reconnects so a burst of tabs does not come back at the same moment
+        response = Response(f'retry: {random.randint(*LIVE_BUSY_RETRY_MS)}\n\n', mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    user_email = session['user_email']
+    user_session = session._get_current_object()
+    resume_from = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        after_seq = int(resume_from) if resume_from else None
+    except ValueError:
+        after_seq = None
+    
+    def generate():
+        seq = after_seq
+        version = None
+        if seq is None or storage.events_compacted_after(user_email, seq):
+            # Fresh connection, or the missed events were compacted away: the client reloads in full
+            if seq is not None:
+                yield format_sse('reset', {})
+            seq = storage.latest_event_seq(user_email)
+            version = storage.get_data_version(user_email)
+        ready = {'seq': seq} if version is None else {'seq': seq, 'version': version}
+        yield 'retry: 3000\n' + format_sse('ready', ready, event_id=seq)
+        
+        token = storage.change_feed.token(user_email)
+        deadline = time.monotonic() + LIVE_STREAM_SECONDS
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            current = storage.get_data_version(user_email)
+            if current != version:
+                if not app.session_interface.is_active(user_session):
+                    return
+                events = storage.get_events(user_email, seq, LIVE_EVENT_BATCH)
+                for event in events:
+                    yield format_sse('change', live_delta(event), event_id=event['seq'])
+                if events:
+                    seq = events[-1]['seq']
+                yield format_sse('aggregates', live_aggregates(user_email, current), event_id=seq)
+                last_sent = time.monotonic()
+                # A full batch means more events are waiting; come straight back for them
+                version = None if len(events) == LIVE_EVENT_BATCH else current
+                if version is None:
+                    continue
+            elif time.monotonic() - last_sent >= LIVE_HEARTBEAT_SECONDS:
+                if not app.session_interface.is_active(user_session):
+                    return
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            token = storage.change_feed.wait(user_email, token, LIVE_POLL_SECONDS)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Runs when the server closes the response, whether or not the stream was ever read
+    response.call_on_close(_live_slots.release)
+    return response
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    auth_check = require_login()
+    if auth_check:
+        return auth_check
+    
+    return jsonify({
+        'success': True,
+        'cache': storage.cache_stats(),
+        'advice_cache': advisor.advice_cache.stats()
+    })
+
+# Prometheus metrics and an on-demand profiler, both closed unless METRICS_TOKEN is set. Scrapers
+# send it as a bearer token, e.g. bearer_token in the Prometheus scrape config.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def metrics_token_valid():
+    supplied = request.headers.get('Authorization', '')
+    return bool(METRICS_TOKEN) and hmac.compare_digest(supplied.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+
+def cache_metrics():
+    samples = []
+    caches = (('user', storage.cache_stats()), ('advice', advisor.advice_cache.stats()),
+              ('categorizer', categorizer.cache_stats()))
+    for cache_name, stats in caches:
+        labels = {'cache': cache_name}
+        samples.append(('financial_cache_hits_total', stats['hits'], labels))
+        samples.append(('financial_cache_misses_total', stats['misses'], labels))
+        samples.append(('financial_cache_entries', stats.get('users', stats.get('entries', 0)), labels))
+        if 'evictions' in stats:
+            samples.append(('financial_cache_evictions_total', stats['evictions'], labels))
+    return samples
+
+metrics.register_collector(cache_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics_token_valid():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile', methods=['GET'])
+def get_profile():
+    # Samples the stacks of in-flight requests, e.g.
+    #   curl -H "Authorization: Bearer $METRICS_TOKEN" "localhost:5000/debug/profile?seconds=10" > stacks.txt
+    if not metrics_token_valid():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    try:
+        seconds = min(float(request.args.get('seconds', '5')), profiler.MAX_SECONDS)
+        hz = min(float(request.args.get('hz', '100')), profiler.MAX_HZ)
+    except ValueError:
+        return Response('seconds and hz must be numbers\n', status=400, mimetype='text/plain')
+    if seconds <= 0 or hz <= 0:
+        return Response('seconds and hz must be positive\n', status=400, mimetype='text/plain')
+    
+    stacks, samples = profiler.capture(seconds, hz, all_threads=request.args.get('all') == '1')
+    response = Response(profiler.format_collapsed(stacks), mimetype='text/plain')
+    response.headers['X-Profile-Samples'] = str(samples)
+    return response
 
+# Development server only; production runs gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
-    init_data_files()
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    create_app()
+    app.run(debug=os.getenv('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes'), port=int(os.getenv('PORT', '5000')))
\ No newline at end of file
@@ -0,0 +1,212 @@
+# API load test: logged-in users drive a weighted mix of endpoints and we report throughput and
+# latency percentiles per endpoint. Advice requests go to a local Groq stub, never the network.
+#
+#   python benchmarks/api.py --rows 10000 --seconds 10                      # Flask test client
+#   python benchmarks/api.py --mode http --threads 16                       # real HTTP, in-process server
+#   python benchmarks/api.py --mode http --url http://127.0.0.1:5000 --database /tmp/bench/financial.db
+#   python benchmarks/api.py --json run.json --baseline base.json --tolerance 0.25
+#
+# With --url the server must be started with the same DATABASE_PATH (and its own GROQ_API_URL);
+# the script exits non-zero when any endpoint's p95 regressed past the tolerance.
+import sys
+import time
+import random
+import argparse
+import threading
+import common
+
+TODAY = time.strftime('%Y-%m-%d')
+
+# (name, weight); a weight is the relative share of requests for that endpoint
+OPERATIONS = [
+    ('login', 1),
+    ('transactions_page', 10),
+    ('transactions_filtered', 4),
+    ('search', 3),
+    ('transaction_create', 6),
+    ('transaction_delete', 5),
+    ('summary', 10),
+    ('reports', 6),
+    ('reports_weekly', 4),
+    ('dashboard', 8),
+    ('budgets_status', 4),
+    ('advice', 1),
+]
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None):
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+class HTTPSession:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, payload=None):
+        response = self.session.request(method, self.base_url + path, json=payload, timeout=60)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+class VirtualUser:
+    def __init__(self, http, email, rng):
+        self.http = http
+        self.email = email
+        self.rng = rng
+        self.created_ids = []
+
+    def login(self):
+        return self.http.request('POST', '/api/login', {'email': self.email, 'password': common.BENCH_PASSWORD})
+
+    def run(self, name):
+        # Returns (status, body) for the request that stands for `name`
+        if name == 'login':
+            return self.login()
+        if name == 'transactions_page':
+            return self.http.request('GET', '/api/transactions?limit=50')
+        if name == 'transactions_filtered':
+            category = self.rng.choice(common.CATEGORIES)
+            return self.http.request('GET', f'/api/transactions?category={category}&sort=amount_desc&limit=50')
+        if name == 'search':
+            # Prefixes and a misspelling, like a user typing into a search box
+            term = self.rng.choice(common.CATEGORIES + ['purch', 'paymnt'])
+            return self.http.request('GET', f'/api/transactions/search?q={term[:self.rng.randint(3, len(term))]}&limit=20')
+        if name == 'transaction_create' or (name == 'transaction_delete' and not self.created_ids):
+            status, body = self.http.request('POST', '/api/transactions', {
+                'type': 'expense',
+                'amount': round(self.rng.uniform(1, 200), 2),
+                'category': self.rng.choice(common.CATEGORIES),
+                'description': 'Benchmark purchase',
+                'date': TODAY
+            })
+            if status == 201:
+                self.created_ids.append(body['id'])
+            if name == 'transaction_create':
+                return status, body
+        if name == 'transaction_delete':
+            # Only delete what this run created, so the seeded data stays the same between runs
+            return self.http.request('DELETE', f'/api/transactions/{self.created_ids.pop()}')
+        if name == 'summary':
+            return self.http.request('GET', '/api/summary')
+        if name == 'reports':
+            return self.http.request('GET', '/api/reports')
+        if name == 'reports_weekly':
+            return self.http.request('GET', '/api/reports?granularity=week&periods=26&window=4')
+        if name == 'dashboard':
+            return self.http.request('GET', '/api/dashboard')
+        if name == 'budgets_status':
+            return self.http.request('GET', '/api/budgets/status')
+        if name == 'advice':
+            category = self.rng.choice(common.CATEGORIES)
+            return self.http.request('POST', '/api/financial-advice', {'query': f'How can I spend less on {category}?'})
+        raise ValueError(f'Unknown operation: {name}')
+
+    def cleanup(self):
+        while self.created_ids:
+            self.http.request('DELETE', f'/api/transactions/{self.created_ids.pop()}')
+
+def start_local_server(app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+def run_load(make_session, emails, threads, seconds, warmup, seed_value):
+    recorder = common.LatencyRecorder()
+    names = [name for name, _ in OPERATIONS]
+    weights = [weight for _, weight in OPERATIONS]
+    logged_in = threading.Barrier(threads + 1)
+    go = threading.Event()
+    timing = {}
+
+    def worker(index):
+        rng = random.Random(seed_value + index)
+        user = VirtualUser(make_session(), emails[index % len(emails)], rng)
+        status, _ = user.login()
+        if status != 200:
+            print(f"Login failed for {user.email} with status {status}", file=sys.stderr)
+        logged_in.wait()
+        go.wait()
+        try:
+            while time.perf_counter() < timing['warm_until']:
+                user.run(rng.choices(names, weights)[0])
+            while time.perf_counter() < timing['deadline']:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                status, _ = user.run(name)
+                recorder.record(name, (time.perf_counter() - started) * 1000, ok=status < 400)
+        finally:
+            user.cleanup()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    # Every virtual user is logged in before the clock starts
+    logged_in.wait()
+    now = time.perf_counter()
+    timing['warm_until'] = now + warmup
+    timing['deadline'] = now + warmup + seconds
+    go.set()
+    for thread in workers:
+        thread.join()
+    return recorder.summary(seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the Flask API and report latency percentiles per endpoint')
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--url', help='benchmark an already running server instead of an in-process one (http mode)')
+    parser.add_argument('--database', help='reuse a database seeded by benchmarks/seed.py')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=10000, help='transactions to seed when the database is new')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--stub-delay', type=float, default=0.0, help='seconds the Groq stub waits per answer')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare p95 against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = common.setup(args.database, stub_delay=args.stub_delay)
+    import app as appmod
+    appmod.create_app()
+    server = None
+    try:
+        emails = common.existing_users()
+        if not emails:
+            emails, rate = common.seed(args.users, args.rows)
+            print(f"Seeded {args.rows} transactions for {len(emails)} users at {rate:.0f} rows/s")
+
+        if args.mode == 'client':
+            make_session = lambda: TestClientSession(appmod.app)
+        else:
+            base_url = args.url
+            if not base_url:
+                server, base_url = start_local_server(appmod.app)
+            make_session = lambda: HTTPSession(base_url)
+
+        results = run_load(make_session, emails, args.threads, args.seconds, args.warmup, args.seed)
+        common.print_table(results, f"{args.mode} mode, {args.threads} threads, {args.seconds:g}s, {len(emails)} users")
+        if args.json:
+            common.save_results(results, args.json)
+        if args.baseline:
+            regressions = common.compare_to_baseline(results, args.baseline, args.tolerance)
+            for line in regressions:
+                print(f"REGRESSION {line}")
+            if regressions:
+                sys.exit(1)
+    finally:
+        if server:
+            server.shutdown()
+        appmod.shutdown_app()
+        common.cleanup(workdir)
+
+if __name__ == '__main__':
+    main()
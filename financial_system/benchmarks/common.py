@@ -0,0 +1,146 @@
+# Shared setup for the benchmark scripts: a scratch data directory, the Groq stub, synthetic
+# data seeding and latency reporting. Call setup() before importing any app module, because
+# storage and advisor read their settings from the environment at import time.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+from datetime import date, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+BENCH_PASSWORD = 'bench-password'
+CATEGORIES = ['food', 'transport', 'entertainment', 'utilities', 'healthcare', 'shopping', 'education', 'other']
+INCOME_CATEGORIES = ['salary', 'freelance', 'investment']
+
+def setup(database=None, groq_stub=True, stub_delay=0.0):
+    # Returns the scratch directory; it is removed by cleanup() unless a database path was given
+    workdir = tempfile.mkdtemp(prefix='financial-bench-')
+    os.environ['DATABASE_PATH'] = os.path.abspath(database) if database else os.path.join(workdir, 'data', 'financial.db')
+    os.environ.setdefault('SESSION_BACKEND', 'sqlite')
+    if groq_stub:
+        os.environ['GROQ_STUB_DELAY'] = str(stub_delay)
+        import groq_stub
+        server = groq_stub.run('127.0.0.1', 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ['GROQ_API_URL'] = f"http://127.0.0.1:{server.server_address[1]}/openai/v1/chat/completions"
+        os.environ['GROQ_API_KEY'] = 'bench'
+    # Run from the scratch directory so init_data_files does not import the real data/*.json
+    os.chdir(workdir)
+    return workdir
+
+def cleanup(workdir):
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_email(index):
+    return f'bench{index:06d}@example.com'
+
+def synthetic_transactions(rng, count, days=730):
+    today = date.today()
+    for _ in range(count):
+        income = rng.random() < 0.15
+        yield {
+            'type': 'income' if income else 'expense',
+            'amount': round(rng.uniform(500, 5000) if income else rng.lognormvariate(3.5, 1.0), 2),
+            'category': rng.choice(INCOME_CATEGORIES if income else CATEGORIES),
+            'description': f"{'Payment' if income else 'Purchase'} #{rng.randint(1, 99999)}",
+            'date': (today - timedelta(days=rng.randrange(days))).isoformat()
+        }
+
+def seed(users, rows, budgets_per_user=4, batch_size=5000, seed_value=42):
+    # Spreads `rows` transactions over `users` accounts; returns the seeded emails and rows/sec
+    import storage
+    import passwords
+
+    storage.init_db()
+    rng = random.Random(seed_value)
+    password_hash = passwords.make_hash(BENCH_PASSWORD)
+    month = date.today().strftime('%Y-%m')
+    emails = [bench_email(i) for i in range(users)]
+
+    started = time.perf_counter()
+    for index, email in enumerate(emails):
+        created = storage.create_user({
+            'name': f'Bench User {index}',
+            'email': email,
+            'phone': '5550000000',
+            'password': password_hash,
+            'created_at': date.today().isoformat()
+        })
+        if not created:
+            # Already seeded by an earlier run against the same database
+            continue
+        share = rows // users + (1 if index < rows % users else 0)
+        pending = list(synthetic_transactions(rng, share))
+        for start in range(0, len(pending), batch_size):
+            storage.add_transactions(email, pending[start:start + batch_size])
+        for category in CATEGORIES[:budgets_per_user]:
+            storage.add_budget(email, {'category': category, 'limit': float(rng.randint(100, 1000)), 'month': month})
+    elapsed = time.perf_counter() - started
+    return emails, rows / elapsed if elapsed else 0.0
+
+def existing_users():
+    import storage
+    return [row[0] for row in storage.get_db().execute(
+        "SELECT email FROM users WHERE email LIKE 'bench%@example.com' ORDER BY email"
+    )]
+
+class LatencyRecorder:
+    def __init__(self):
+        self._samples = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed_ms, ok=True):
+        with self._lock:
+            self._samples.setdefault(name, []).append(elapsed_ms)
+            if not ok:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def summary(self, seconds):
+        return {name: summarize(samples, seconds, self._errors.get(name, 0))
+                for name, samples in sorted(self._samples.items())}
+
+def summarize(samples, seconds, errors=0):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'rps': len(samples) / seconds if seconds else 0.0,
+        'p50_ms': percentile(samples, 50),
+        'p95_ms': percentile(samples, 95),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': samples[-1] if samples else 0.0
+    }
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+def print_table(results, title):
+    print(f"\n{title}")
+    print(f"{'name':<28} {'count':>7} {'errors':>6} {'per sec':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, r in results.items():
+        print(f"{name:<28} {r['count']:>7} {r['errors']:>6} {r['rps']:>9.1f} {r['p50_ms']:>9.2f} "
+              f"{r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['max_ms']:>9.2f}")
+
+def compare_to_baseline(results, baseline_file, tolerance):
+    # Returns the names whose p95 grew by more than `tolerance` (0.25 = 25%) over the saved run
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, r in results.items():
+        before = baseline.get(name)
+        if before and before['p95_ms'] > 0 and r['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f}ms -> {r['p95_ms']:.2f}ms")
+    return regressions
+
+def save_results(results, output_file):
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,124 @@
+# Password hashing benchmark: raw hashes/sec per scheme and cost, then how a login burst
+# affects the latency of an ordinary endpoint for different hashing pool sizes.
+#
+#   python benchmarks/passwords.py --seconds 5 --pool-sizes 1,2,4 --login-threads 16
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+workdir = tempfile.mkdtemp(prefix='password-bench-')
+os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+
+import passwords
+
+COST_VARIANTS = [
+    ('scrypt', {'SCRYPT_N': 2 ** 14}),
+    ('scrypt', {'SCRYPT_N': 2 ** 15}),
+    ('pbkdf2', {'PBKDF2_ITERATIONS': 200000}),
+    ('pbkdf2', {'PBKDF2_ITERATIONS': 600000}),
+]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def bench_hashing(seconds, threads):
+    print(f"{'scheme':<10} {'cost':<22} {'ms/hash':>9} {'hashes/s (1 thread)':>20} {'hashes/s (' + str(threads) + ' threads)':>22}")
+    for scheme, settings in COST_VARIANTS:
+        saved = {name: getattr(passwords, name) for name in settings}
+        for name, value in settings.items():
+            setattr(passwords, name, value)
+        try:
+            single = _hash_rate(scheme, seconds, 1)
+            parallel = _hash_rate(scheme, seconds, threads)
+        finally:
+            for name, value in saved.items():
+                setattr(passwords, name, value)
+        cost = ', '.join(f"{name}={value}" for name, value in settings.items())
+        print(f"{scheme:<10} {cost:<22} {1000 / single:>9.1f} {single:>20.1f} {parallel:>22.1f}")
+
+def _hash_rate(scheme, seconds, threads):
+    deadline = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def worker(index):
+        while time.perf_counter() < deadline:
+            passwords.make_hash('correct horse battery staple', scheme)
+            counts[index] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+def bench_login_burst(seconds, pool_sizes, login_threads):
+    # Run the app from the scratch directory so it does not pick up the real data/ files
+    os.chdir(workdir)
+    import app as appmod
+    appmod.init_data_files()
+    client = appmod.app.test_client()
+    client.post('/api/register', json={'email': 'bench@example.com', 'password': 'secret1', 'name': 'Bench', 'phone': '1234567890'})
+    for i in range(200):
+        client.post('/api/transactions', json={'type': 'expense', 'amount': i + 1, 'category': 'food', 'description': f'item {i}', 'date': '2026-01-15'})
+
+    print(f"\n{'pool':>5} {'logins/s':>9} {'503s':>6} {'login p95 ms':>13} {'probe p50 ms':>13} {'probe p95 ms':>13} {'probe p99 ms':>13}")
+    for pool_size in pool_sizes:
+        passwords._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='password')
+        deadline = time.perf_counter() + seconds
+        login_times, probe_times, rejected = [], [], [0]
+
+        def login_worker():
+            login_client = appmod.app.test_client()
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = login_client.post('/api/login', json={'email': 'bench@example.com', 'password': 'secret1'})
+                if response.status_code == 503:
+                    rejected[0] += 1
+                else:
+                    login_times.append((time.perf_counter() - started) * 1000)
+
+        def probe_worker():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                client.get('/api/transactions?limit=50')
+                probe_times.append((time.perf_counter() - started) * 1000)
+                time.sleep(0.005)
+
+        workers = [threading.Thread(target=login_worker) for _ in range(login_threads)]
+        workers.append(threading.Thread(target=probe_worker))
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        passwords._executor.shutdown()
+
+        print(f"{pool_size:>5} {len(login_times) / seconds:>9.1f} {rejected[0]:>6} {percentile(login_times, 95):>13.1f} "
+              f"{percentile(probe_times, 50):>13.2f} {percentile(probe_times, 95):>13.2f} {percentile(probe_times, 99):>13.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark password hashing cost and its effect on request latency')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--pool-sizes', default='1,2,4')
+    parser.add_argument('--login-threads', type=int, default=16)
+    args = parser.parse_args()
+
+    try:
+        bench_hashing(args.seconds, args.threads)
+        bench_login_burst(args.seconds, [int(size) for size in args.pool_sizes.split(',')], args.login_threads)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Seed a reusable benchmark database, so large runs do not pay for seeding every time:
+#
+#   python benchmarks/seed.py --database /tmp/bench/financial.db --users 100 --rows 1000000
+#   python benchmarks/api.py --database /tmp/bench/financial.db
+import os
+import argparse
+import common
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed users, transactions and budgets for the benchmarks')
+    parser.add_argument('--database', required=True, help='DATABASE_PATH to create or extend')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rows', type=int, default=100000, help='transactions spread across all users')
+    parser.add_argument('--budgets-per-user', type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = common.setup(args.database, groq_stub=False)
+    try:
+        import storage
+        emails, rate = common.seed(args.users, args.rows, args.budgets_per_user)
+        storage.checkpoint()
+        print(f"Seeded {args.rows} transactions for {len(emails)} users at {rate:.0f} rows/s into {os.environ['DATABASE_PATH']}")
+    finally:
+        common.cleanup(workdir)
+
+if __name__ == '__main__':
+    main()
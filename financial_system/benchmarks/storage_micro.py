@@ -0,0 +1,120 @@
+# Micro-benchmarks for the data layer: the storage functions behind each endpoint, timed
+# directly with the per-user cache cold (invalidated before every call) and warm.
+#
+#   python benchmarks/storage_micro.py --rows 100000 --iterations 50
+#   python benchmarks/storage_micro.py --database /tmp/bench/financial.db --json micro.json
+import sys
+import time
+import random
+import argparse
+from datetime import date, timedelta
+import common
+
+def build_cases(email, rng):
+    import storage
+    import analytics
+
+    today = date.today()
+    two_years_ago = (today - timedelta(days=730)).isoformat()
+    ninety_days_ago = (today - timedelta(days=90)).isoformat()
+    added = []
+
+    def cold(fn):
+        def run():
+            storage.user_cache.invalidate(email)
+            return fn()
+        return run
+
+    def add_one():
+        added.append(storage.add_transaction(email, next(common.synthetic_transactions(rng, 1)))['id'])
+
+    def add_batch():
+        added.extend(t['id'] for t in storage.add_transactions(email, list(common.synthetic_transactions(rng, 100))))
+
+    def delete_one():
+        if not added:
+            add_one()
+        storage.delete_transaction(email, added.pop())
+
+    def cleanup():
+        while added:
+            storage.delete_transaction(email, added.pop())
+
+    cases = [
+        # get_transactions is the old load_data: the user's full list, cached by data version
+        ('get_transactions cold', cold(lambda: storage.get_transactions(email))),
+        ('get_transactions warm', lambda: storage.get_transactions(email)),
+        ('query_transactions page', lambda: storage.query_transactions(email, {}, 'date_desc', 50)),
+        ('query_transactions filter', lambda: storage.query_transactions(email, {'category': 'food'}, 'amount_desc', 50)),
+        ('get_aggregates cold', cold(lambda: storage.get_aggregates(email))),
+        ('get_aggregates warm', lambda: storage.get_aggregates(email)),
+        ('get_budget_status cold', cold(lambda: storage.get_budget_status(email))),
+        ('get_columns cold', cold(lambda: analytics.get_columns(email))),
+        ('build_report month/2y', lambda: analytics.build_report(analytics.get_columns(email, two_years_ago), 'month', two_years_ago, today.isoformat())),
+        ('build_report day/90d', lambda: analytics.build_report(analytics.get_columns(email, ninety_days_ago), 'day', ninety_days_ago, today.isoformat())),
+        # and these replace save_data: one row, a batch of 100, and a delete
+        ('add_transaction', add_one),
+        ('add_transactions x100', add_batch),
+        ('delete_transaction', delete_one),
+    ]
+    return cases, cleanup
+
+def run_cases(cases, iterations):
+    results = {}
+    for name, fn in cases:
+        fn()
+        samples = []
+        total_started = time.perf_counter()
+        for _ in range(iterations):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = common.summarize(samples, time.perf_counter() - total_started)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the storage and analytics functions behind the API')
+    parser.add_argument('--database', help='reuse a database seeded by benchmarks/seed.py')
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=100000, help='transactions to seed when the database is new')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare p95 against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = common.setup(args.database, groq_stub=False)
+    import storage
+    try:
+        storage.init_db()
+        emails = common.existing_users()
+        if not emails:
+            emails, rate = common.seed(args.users, args.rows)
+            print(f"Seeded {args.rows} transactions for {len(emails)} users at {rate:.0f} rows/s")
+
+        # Benchmark the user with the most rows, which is the one every optimisation is for
+        counts = {e: storage.get_shard_db(e).execute(
+            'SELECT COUNT(*) FROM transactions WHERE user_email = ?', (e,)).fetchone()[0] for e in emails}
+        email = max(emails, key=counts.get)
+        rows = counts[email]
+        cases, cleanup = build_cases(email, random.Random(7))
+        try:
+            results = run_cases(cases, args.iterations)
+        finally:
+            cleanup()
+
+        common.print_table(results, f"{email}: {rows} transactions, {args.iterations} iterations")
+        if args.json:
+            common.save_results(results, args.json)
+        if args.baseline:
+            regressions = common.compare_to_baseline(results, args.baseline, args.tolerance)
+            for line in regressions:
+                print(f"REGRESSION {line}")
+            if regressions:
+                sys.exit(1)
+    finally:
+        storage.close_db()
+        common.cleanup(workdir)
+
+if __name__ == '__main__':
+    main()
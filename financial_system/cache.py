@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded LRU of per-user data, validated against the user's data version
+class UserCache:
+    def __init__(self, max_users=256):
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_email, kind, version):
+        with self._lock:
+            entry = self._entries.get(user_email)
+            if entry is not None and entry['version'] == version and kind in entry['data']:
+                self._entries.move_to_end(user_email)
+                self.hits += 1
+                return entry['data'][kind]
+            self.misses += 1
+            return None
+
+    def put(self, user_email, kind, version, value):
+        with self._lock:
+            entry = self._entries.get(user_email)
+            if entry is None or entry['version'] != version:
+                entry = self._entries[user_email] = {'version': version, 'data': {}}
+            entry['data'][kind] = value
+            self._entries.move_to_end(user_email)
+
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_email):
+        with self._lock:
+            self._entries.pop(user_email, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'users': len(self._entries),
+                'max_users': self.max_users
+            }
+
+# Bounded cache whose entries expire after a fixed time-to-live
+class TTLCache:
+    def __init__(self, ttl_seconds=900, max_entries=1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
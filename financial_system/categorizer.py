@@ -0,0 +1,165 @@
+import os
+import math
+import threading
+from collections import OrderedDict
+import storage
+import metrics
+
+# Per-user multinomial naive Bayes over description words, word pairs and word stems, trained
+# from the user's own categorized transactions. Models live in memory only and follow new
+# labeled rows by replaying the transaction journal, so nothing is sent anywhere.
+CATEGORIZER_CACHE_SIZE = int(os.getenv('CATEGORIZER_CACHE_SIZE', '64'))
+# A category is filled in for the user only when the model is at least this sure of it
+CATEGORIZER_MIN_CONFIDENCE = float(os.getenv('CATEGORIZER_MIN_CONFIDENCE', '0.6'))
+# Categorized transactions needed before the model makes suggestions at all
+CATEGORIZER_MIN_EXAMPLES = int(os.getenv('CATEGORIZER_MIN_EXAMPLES', '10'))
+
+SMOOTHING = 0.5
+STEM_LENGTH = 4
+MAX_SUGGESTIONS = 3
+
+def features(description):
+    # Numbers (receipt ids, dates, amounts) say nothing about the category and are left out
+    words = [token for token in storage.search_tokens(description) if not token.isdigit()]
+    found = list(words)
+    found.extend(f'{a} {b}' for a, b in zip(words, words[1:]))
+    # Stems let "groceries" count as evidence for rows that said "grocery"
+    found.extend('~' + word[:STEM_LENGTH] for word in words if len(word) > STEM_LENGTH)
+    return found
+
+class CategoryModel:
+    def __init__(self, seq=0):
+        self.seq = seq
+        self.version = None
+        self.examples = 0
+        self.category_counts = {}
+        self.type_counts = {}
+        self.feature_totals = {}
+        self.feature_counts = {}
+        self.lock = threading.Lock()
+
+    def update(self, transaction_type, category, description, sign):
+        # sign is 1 to learn from a labeled transaction and -1 to forget it
+        if not category:
+            return
+        self.examples += sign
+        self._count(self.category_counts, category, sign)
+        self._count(self.type_counts.setdefault(transaction_type, {}), category, sign)
+        for feature in features(description):
+            self._count(self.feature_counts.setdefault(feature, {}), category, sign)
+            self._count(self.feature_totals, category, sign)
+            if not self.feature_counts[feature]:
+                del self.feature_counts[feature]
+
+    @staticmethod
+    def _count(counts, key, sign):
+        value = counts.get(key, 0) + sign
+        if value > 0:
+            counts[key] = value
+        else:
+            counts.pop(key, None)
+
+    def predict(self, description, transaction_type=None, limit=MAX_SUGGESTIONS):
+        # [(category, probability)], most likely first; empty until there is enough to go on
+        with self.lock:
+            return self._predict(description, transaction_type, limit)
+
+    def _predict(self, description, transaction_type, limit):
+        if self.examples < CATEGORIZER_MIN_EXAMPLES:
+            return []
+        # The type narrows the field: an expense is never filed under a category only seen on income
+        priors = self.type_counts.get(transaction_type) or self.category_counts
+        total = sum(priors.values())
+        vocabulary = len(self.feature_counts)
+        scores = {category: math.log(count / total) for category, count in priors.items()}
+        for feature in features(description):
+            counts = self.feature_counts.get(feature)
+            if counts is None:
+                continue
+            for category in scores:
+                scores[category] += math.log(
+                    (counts.get(category, 0) + SMOOTHING)
+                    / (self.feature_totals.get(category, 0) + SMOOTHING * vocabulary)
+                )
+        if not scores:
+            return []
+        best = max(scores.values())
+        weights = {category: math.exp(score - best) for category, score in scores.items()}
+        norm = sum(weights.values())
+        ranked = sorted(weights.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(category, round(weight / norm, 4)) for category, weight in ranked]
+
+    def suggest(self, description, transaction_type=None):
+        # The category to fill in, or None when the model is not confident enough
+        predictions = self.predict(description, transaction_type, limit=1)
+        if predictions and predictions[0][1] >= CATEGORIZER_MIN_CONFIDENCE:
+            return predictions[0][0]
+        return None
+
+_models = OrderedDict()
+_models_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'updates': 0}
+
+def _record(stat):
+    with _models_lock:
+        _stats[stat] += 1
+
+@metrics.timed('aggregation')
+def _train(user_email):
+    seq, rows = storage.labeled_transactions(user_email)
+    model = CategoryModel(seq)
+    for transaction_type, category, description in rows:
+        model.update(transaction_type, category, description, 1)
+    return model
+
+@metrics.timed('aggregation')
+def _catch_up(user_email, model):
+    # Apply transactions added or deleted since the model was built; False if the journal
+    # no longer reaches back that far and the model has to be trained again
+    if storage.events_compacted_after(user_email, model.seq):
+        return False
+    while True:
+        events = storage.get_events(user_email, model.seq)
+        for event in events:
+            record = event['record']
+            if event['entity'] == 'transaction' and record:
+                sign = 1 if event['event'] == 'add' else -1
+                model.update(record.get('type'), record.get('category'), record.get('description'), sign)
+            model.seq = event['seq']
+        if not events:
+            return True
+
+def get_model(user_email):
+    # The user's model, brought up to date with their latest writes
+    version = storage.get_data_version(user_email)
+    with _models_lock:
+        model = _models.get(user_email)
+        if model is not None:
+            _models.move_to_end(user_email)
+
+    if model is not None:
+        with model.lock:
+            if model.version == version:
+                _record('hits')
+                return model
+            if _catch_up(user_email, model):
+                model.version = version
+                _record('updates')
+                return model
+
+    _record('misses')
+    model = _train(user_email)
+    model.version = version
+    with _models_lock:
+        _models[user_email] = model
+        _models.move_to_end(user_email)
+        while len(_models) > CATEGORIZER_CACHE_SIZE:
+            _models.popitem(last=False)
+            _stats['evictions'] += 1
+    return model
+
+def cache_stats():
+    with _models_lock:
+        lookups = _stats['hits'] + _stats['updates'] + _stats['misses']
+        return dict(_stats, users=len(_models), max_users=CATEGORIZER_CACHE_SIZE,
+                    hit_rate=(_stats['hits'] + _stats['updates']) / lookups if lookups else 0.0)
@@ -0,0 +1,33 @@
+import threading
+from collections import OrderedDict
+
+# In-process wake-ups for live update streams. Writes made by other worker processes are
+# picked up by the streams' periodic data-version check instead.
+class ChangeFeed:
+    def __init__(self, max_users=10000):
+        # user -> process-wide sequence number of their latest write, most recent last. Tokens
+        # are never reused, so evicting a user can only cause a spurious wake-up, which the
+        # stream's data-version check absorbs.
+        self._counters = OrderedDict()
+        self._sequence = 0
+        self._max_users = max_users
+        self._condition = threading.Condition()
+
+    def token(self, user_email):
+        with self._condition:
+            return self._counters.get(user_email, 0)
+
+    def publish(self, user_email):
+        with self._condition:
+            self._sequence += 1
+            self._counters[user_email] = self._sequence
+            self._counters.move_to_end(user_email)
+            while len(self._counters) > self._max_users:
+                self._counters.popitem(last=False)
+            self._condition.notify_all()
+
+    def wait(self, user_email, token, timeout):
+        # Returns the new token once the user's data changes, or the old one after the timeout
+        with self._condition:
+            self._condition.wait_for(lambda: self._counters.get(user_email, 0) != token, timeout)
+            return self._counters.get(user_email, 0)
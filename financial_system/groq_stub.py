@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import argparse
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Groq chat-completions API, for tests and benchmarks.
+# Run it and point the app at it:
+#   python groq_stub.py --port 8089
+#   GROQ_API_URL=http://127.0.0.1:8089/openai/v1/chat/completions GROQ_API_KEY=stub python app.py
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STUB_DELAY = float(os.getenv('GROQ_STUB_DELAY', '0'))
+STUB_TOKEN_DELAY = float(os.getenv('GROQ_STUB_TOKEN_DELAY', '0'))
+
+def build_advice(prompt):
+    question = ''
+    for line in prompt.splitlines():
+        if line.strip().startswith('User Question:'):
+            question = line.split(':', 1)[1].strip()
+    return (f"Stub advice for: {question or 'your question'}. Track your spending weekly, "
+            f"set a monthly budget per category and move 10% of income into savings first.")
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+            return
+
+        prompt = ''
+        for message in payload.get('messages', []):
+            if message.get('role') == 'user':
+                prompt = message.get('content', '')
+
+        if STUB_DELAY:
+            time.sleep(STUB_DELAY)
+
+        if payload.get('stream'):
+            self._send_stream(payload, build_advice(prompt))
+            return
+
+        self._send_json(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': build_advice(prompt)},
+                'finish_reason': 'stop'
+            }]
+        })
+
+    def _send_stream(self, payload, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        words = content.split(' ')
+        for index, word in enumerate(words):
+            chunk = {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': payload.get('model', 'stub'),
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': word if index == 0 else ' ' + word},
+                    'finish_reason': None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            if STUB_TOKEN_DELAY:
+                time.sleep(STUB_TOKEN_DELAY)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def run(host='127.0.0.1', port=8089):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    logger.info(f"Groq stub listening on http://{host}:{server.server_address[1]}/openai/v1/chat/completions")
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stub of the Groq chat-completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+    try:
+        run(args.host, args.port).serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,27 @@
+import multiprocessing
+import os
+
+# Run from this directory with:  gunicorn -c gunicorn.conf.py wsgi:app
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.getenv('BIND', '0.0.0.0:5000')
+
+# Processes spread CPU-bound work (reports, imports) across cores; threads keep slow
+# Groq calls and SSE streams from tying up a whole process. Live and advice streams may take at
+# most LIVE_MAX_STREAMS + ADVICE_MAX_STREAMS of the threads (see app.py), so raise them together.
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# Every worker opens its own SQLite connections and background threads after the fork;
+# WAL mode and BEGIN IMMEDIATE writes keep concurrent processes consistent
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+def worker_exit(server, worker):
+    from app import shutdown_app
+    shutdown_app()
@@ -0,0 +1,165 @@
+import os
+import time
+import smtplib
+import logging
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import storage
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# SMTP configuration; point SMTP_HOST/SMTP_PORT at a local debugging server for tests, e.g.
+#   python -m aiosmtpd -n -l localhost:1025  with SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false
+EMAIL_USER = os.getenv('EMAIL_USER')
+EMAIL_PASS = os.getenv('EMAIL_PASS')
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes')
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '30'))
+SMTP_IDLE_SECONDS = float(os.getenv('SMTP_IDLE_SECONDS', '60'))
+
+# Outbox worker settings
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', '5'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_BACKOFF_SECONDS', '5'))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', '600'))
+OUTBOX_LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE_SECONDS', '120'))
+
+OTP_SUBJECT = "Password Reset OTP - Financial Management System"
+
+OTP_BODY = """
+        Hello,
+
+        Your OTP for password reset is: {otp}
+
+        This OTP will expire in 10 minutes.
+
+        If you didn't request this, please ignore this email.
+
+        Best regards,
+        Financial Management System
+        """
+
+def enqueue_otp_email(email, otp):
+    message_id = storage.enqueue_email(email, OTP_SUBJECT, OTP_BODY.format(otp=otp))
+    ensure_worker()
+    _wakeup.set()
+    return message_id
+
+def build_message(recipient, subject, body):
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_USER
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
+
+def backoff_seconds(attempts):
+    return min(OUTBOX_BACKOFF_SECONDS * (2 ** (attempts - 1)), OUTBOX_MAX_BACKOFF_SECONDS)
+
+# Reuses one authenticated SMTP connection across messages and reconnects when it goes stale
+class SMTPConnection:
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+
+    def _open(self):
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if EMAIL_USER and EMAIL_PASS:
+            server.login(EMAIL_USER, EMAIL_PASS)
+        self._server = server
+
+    def _alive(self):
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < SMTP_IDLE_SECONDS:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, recipient, message):
+        with metrics.upstream('smtp'):
+            if not self._alive():
+                self.close()
+                self._open()
+            try:
+                self._server.sendmail(EMAIL_USER, recipient, message)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped an idle connection; retry once on a fresh one
+                self.close()
+                self._open()
+                self._server.sendmail(EMAIL_USER, recipient, message)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+def drain_outbox(connection, limit=OUTBOX_BATCH_SIZE):
+    # Send every due message claimed by this worker; returns how many were sent
+    sent = 0
+    for message in storage.claim_outbox_messages(limit, OUTBOX_LEASE_SECONDS):
+        try:
+            connection.send(message['recipient'], build_message(message['recipient'], message['subject'], message['body']))
+        except Exception as e:
+            connection.close()
+            attempts = message['attempts'] + 1
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"Giving up on email {message['id']} to {message['recipient']} after {attempts} attempts: {e}")
+                storage.fail_outbox_message(message['id'], attempts, str(e))
+            else:
+                delay = backoff_seconds(attempts)
+                logger.warning(f"Email {message['id']} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                storage.retry_outbox_message(message['id'], attempts, delay, str(e))
+            continue
+        storage.complete_outbox_message(message['id'])
+        sent += 1
+    return sent
+
+_worker = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+_stopping = threading.Event()
+
+def _run_worker():
+    connection = SMTPConnection()
+    try:
+        while not _stopping.is_set():
+            try:
+                while drain_outbox(connection) and not _stopping.is_set():
+                    pass
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+            _wakeup.wait(OUTBOX_POLL_SECONDS)
+            _wakeup.clear()
+    finally:
+        connection.close()
+
+def ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _stopping.clear()
+            _worker = threading.Thread(target=_run_worker, name='email-outbox', daemon=True)
+            _worker.start()
+
+def stop_worker(timeout=10):
+    _stopping.set()
+    _wakeup.set()
+    if _worker is not None:
+        _worker.join(timeout)
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Under gunicorn every worker keeps its own counters. With METRICS_DIR set, each worker writes a
+# snapshot there every METRICS_FLUSH_SECONDS and /metrics serves the sum over all workers.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+# Requests slower than this are logged with their time breakdown (0 disables the log)
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '0'))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# name: (type, help)
+FAMILIES = {
+    'financial_http_requests_total': ('counter', 'Requests handled, by route, method and status'),
+    'financial_http_request_duration_seconds': ('histogram', 'Time to produce a response, by route'),
+    'financial_http_request_phase_seconds_total': ('counter', 'Time spent per phase; "background" covers worker threads'),
+    'financial_http_requests_in_flight': ('gauge', 'Requests currently being handled'),
+    'financial_http_request_bytes_total': ('counter', 'Request body bytes read, by route'),
+    'financial_http_response_bytes_total': ('counter', 'Response body bytes written after compression, by route'),
+    'financial_upstream_requests_total': ('counter', 'Calls to Groq and SMTP, by outcome'),
+    'financial_upstream_request_duration_seconds': ('histogram', 'Duration of calls to Groq and SMTP'),
+    'financial_cache_hits_total': ('counter', 'Cache lookups that found a usable entry'),
+    'financial_cache_misses_total': ('counter', 'Cache lookups that did not'),
+    'financial_cache_evictions_total': ('counter', 'Entries pushed out of a full cache'),
+    'financial_cache_entries': ('gauge', 'Entries currently held'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_collectors = []
+_local = threading.local()
+_active = {}
+_last_flush = 0.0
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def add_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # One count per bucket plus +Inf, then the sum
+            histogram = _histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(DURATION_BUCKETS)] += 1
+        histogram[-1] += seconds
+
+def register_collector(fn):
+    # fn() returns (name, value, labels) samples read at scrape time, e.g. cache statistics
+    _collectors.append(fn)
+
+# Per-thread phase timer. Phases nest (a read inside an aggregation); only the innermost
+# phase's clock runs, so the phases of a request add up to at most its duration.
+class PhaseTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.response = None
+        # (route, method, path, request bytes), filled in at teardown while the request is still known
+        self.request = None
+        self._stack = []
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.phases[outer[0]] = self.phases.get(outer[0], 0.0) + now - outer[1]
+        self._stack.append([phase, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        phase, started = self._stack.pop()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - started
+        if self._stack:
+            self._stack[-1][1] = now
+
+@contextmanager
+def timed(phase):
+    # Usable as `with metrics.timed('aggregation'):` or as a function decorator
+    timer = getattr(_local, 'timer', None)
+    owned = timer is None
+    if owned:
+        timer = _local.timer = PhaseTimer()
+    timer.enter(phase)
+    try:
+        yield
+    finally:
+        timer.exit()
+        if owned:
+            _local.timer = None
+            for name, seconds in timer.phases.items():
+                inc('financial_http_request_phase_seconds_total', seconds, route='background', phase=name)
+
+@contextmanager
+def upstream(service, phase=True):
+    # phase=False for calls that span generator yields, which must not hold the thread's timer
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        if phase:
+            with timed('upstream'):
+                yield
+        else:
+            yield
+        outcome = 'ok'
+    finally:
+        observe('financial_upstream_request_duration_seconds', time.perf_counter() - started, service=service)
+        inc('financial_upstream_requests_total', service=service, outcome=outcome)
+
+def active_threads():
+    # Thread ids currently handling a request, for the sampling profiler
+    with _lock:
+        return dict(_active)
+
+def _record_request(timer):
+    response = timer.response
+    route, method, path, request_bytes = timer.request
+    elapsed = time.perf_counter() - timer.started
+
+    inc('financial_http_requests_total', route=route, method=method, status=str(response.status_code))
+    observe('financial_http_request_duration_seconds', elapsed, route=route, method=method)
+    phases = dict(timer.phases, other=max(elapsed - sum(timer.phases.values()), 0.0))
+    for phase, seconds in phases.items():
+        inc('financial_http_request_phase_seconds_total', seconds, route=route, phase=phase)
+    inc('financial_http_request_bytes_total', request_bytes, route=route)
+    if not response.is_streamed:
+        inc('financial_http_response_bytes_total', response.content_length or 0, route=route)
+
+    # Streams (live updates, advice) are long by design; their duration is still in the histogram
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS and not response.is_streamed:
+        breakdown = ', '.join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in phases.items())
+        logger.warning(f"Slow request {method} {path}: {elapsed * 1000:.0f}ms ({breakdown})")
+
+def init_app(app):
+    from flask import request, g
+    from werkzeug.wsgi import ClosingIterator
+    wsgi_app = app.wsgi_app
+
+    def finish_request(timer, ident):
+        with _lock:
+            _active.pop(ident, None)
+        add_gauge('financial_http_requests_in_flight', -1)
+        if timer.request is not None and timer.response is not None:
+            _record_request(timer)
+        maybe_flush()
+
+    def timed_wsgi_app(environ, start_response):
+        # Start the clock before Flask opens the session, which already reads storage
+        timer = _local.timer = PhaseTimer()
+        ident = threading.get_ident()
+        with _lock:
+            _active[ident] = environ.get('PATH_INFO', '')
+        add_gauge('financial_http_requests_in_flight', 1)
+        try:
+            body = wsgi_app(environ, start_response)
+        except BaseException:
+            finish_request(timer, ident)
+            raise
+        finally:
+            _local.timer = None
+        # Flask tears the request down as soon as the view returns, before a streamed body has
+        # been produced, so the request is only counted as finished once the server closes the body
+        return ClosingIterator(body, lambda: finish_request(timer, ident))
+
+    app.wsgi_app = timed_wsgi_app
+
+    # Register before other after_request hooks so this one runs last and sees compressed sizes
+    @app.after_request
+    def add_server_timing(response):
+        timer = getattr(_local, 'timer', None)
+        if timer is None:
+            return response
+        timer.response = response
+        g.request_timer = timer
+        elapsed = time.perf_counter() - timer.started
+        response.headers['Server-Timing'] = ', '.join(
+            f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timer.phases.items()
+        ) + f", total;dur={elapsed * 1000:.2f}"
+        return response
+
+    # The request is gone by the time the body is closed, so note what the metrics need here
+    @app.teardown_request
+    def note_request(exc):
+        timer = g.pop('request_timer', None)
+        if timer is None:
+            return
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        timer.request = (route, request.method, request.path, request.content_length or 0)
+
+# Snapshots and the Prometheus text format
+def snapshot():
+    samples = []
+    for fn in _collectors:
+        try:
+            samples.extend(fn())
+        except Exception as e:
+            logger.error(f"Metrics collector failed: {e}")
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        gauges = [[name, list(labels), value] for (name, labels), value in _gauges.items()]
+        histograms = [[name, list(labels), list(values)] for (name, labels), values in _histograms.items()]
+    for name, value, labels in samples:
+        target = gauges if FAMILIES.get(name, ('gauge',))[0] == 'gauge' else counters
+        target.append([name, sorted(labels.items()), value])
+    return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+def _snapshot_path(pid=None):
+    return os.path.join(METRICS_DIR, f'metrics-{pid or os.getpid()}.json')
+
+def flush():
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    _last_flush = time.monotonic()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path()
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+def maybe_flush():
+    if METRICS_DIR and time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+        try:
+            flush()
+        except OSError as e:
+            logger.error(f"Could not write metrics snapshot: {e}")
+
+def _merge(snapshots):
+    counters, gauges, histograms = {}, {}, {}
+    for data in snapshots:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data['gauges']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            histograms[key] = list(values) if merged is None else [a + b for a, b in zip(merged, values)]
+    return counters, gauges, histograms
+
+def _collect():
+    if not METRICS_DIR:
+        return _merge([snapshot()])
+    flush()
+    snapshots = []
+    for filename in os.listdir(METRICS_DIR):
+        if filename.startswith('metrics-') and filename.endswith('.json'):
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # A worker may be replacing its file right now
+                continue
+    return _merge(snapshots)
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    counters, gauges, histograms = _collect()
+    families = {}
+    for (name, labels), value in sorted(list(counters.items()) + list(gauges.items())):
+        families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), values in sorted(histograms.items()):
+        lines = families.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, values):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+        cumulative += values[len(DURATION_BUCKETS)]
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    output = []
+    for name in sorted(families):
+        metric_type, help_text = FAMILIES.get(name, ('untyped', ''))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(families[name])
+    return '\n'.join(output) + '\n'
@@ -0,0 +1,48 @@
+import os
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP, ROUND_CEILING, ROUND_FLOOR
+
+# Amounts are stored and summed as integers in the currency's minor unit (cents for USD), so
+# totals are exact however many rows they cover. The API keeps sending and receiving plain
+# numbers in major units; conversion happens only at the storage boundary.
+# CURRENCY is fixed once data exists: stored amounts are counted in its minor unit.
+CURRENCY = os.getenv('CURRENCY', 'USD').upper()
+
+# ISO 4217 minor-unit digits for currencies that do not use two
+MINOR_DIGITS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0, 'PYG': 0,
+    'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+
+# Largest amount accepted, in minor units. A single amount is exact as a float64, but sums are
+# not (2**53 is about nine of these), so totals are always added up as integers: Python ints,
+# SQLite INTEGER and int64 in analytics, which is exact up to 9.2e18 minor units.
+MAX_MINOR = 10 ** 15
+
+def digits(currency=None):
+    return MINOR_DIGITS.get(currency or CURRENCY, 2)
+
+def scale(currency=None):
+    return 10 ** digits(currency)
+
+def to_minor(value, currency=None, rounding=ROUND_HALF_UP):
+    # Parses a number or numeric string in major units; by default halves round away from zero,
+    # while range filters round inward (ROUND_CEILING for a minimum, ROUND_FLOOR for a maximum)
+    if isinstance(value, bool):
+        raise ValueError('Invalid amount')
+    try:
+        # str() first so a float becomes the decimal it was written as (0.1, not 0.1000000000000000055...)
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError('Invalid amount')
+    if not amount.is_finite():
+        raise ValueError('Invalid amount')
+    amount *= scale(currency)
+    if abs(amount) > MAX_MINOR:
+        raise ValueError('Amount is too large')
+    return int(amount.quantize(Decimal(1), rounding=rounding))
+
+def to_major(minor, currency=None):
+    # The float nearest the exact decimal, which is what JSON clients have always received
+    places = digits(currency)
+    return float(minor) if places == 0 else minor / 10 ** places
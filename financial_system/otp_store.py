@@ -0,0 +1,56 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+import storage
+
+logger = logging.getLogger(__name__)
+
+# OTP lifetime, resend limits and sweeper cadence
+OTP_TTL_MINUTES = int(os.getenv('OTP_TTL_MINUTES', '10'))
+OTP_RATE_WINDOW_SECONDS = int(os.getenv('OTP_RATE_WINDOW_SECONDS', '900'))
+OTP_MAX_PER_WINDOW = int(os.getenv('OTP_MAX_PER_WINDOW', '3'))
+OTP_RESEND_SECONDS = int(os.getenv('OTP_RESEND_SECONDS', '60'))
+OTP_SWEEP_SECONDS = float(os.getenv('OTP_SWEEP_SECONDS', '60'))
+
+def issue(email, otp, phone):
+    # Returns the number of seconds the caller must wait, or 0 when the OTP was stored
+    otp_entry = {
+        'otp': otp,
+        'expires_at': (datetime.now() + timedelta(minutes=OTP_TTL_MINUTES)).isoformat(),
+        'phone': phone
+    }
+    ensure_sweeper()
+    return storage.issue_otp(email, otp_entry, OTP_RATE_WINDOW_SECONDS, OTP_MAX_PER_WINDOW, OTP_RESEND_SECONDS)
+
+def sweep():
+    expired = storage.sweep_expired_otps(OTP_RATE_WINDOW_SECONDS)
+    if expired:
+        logger.info(f"Swept {expired} expired OTPs")
+    return expired
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+_stopping = threading.Event()
+
+def _run_sweeper():
+    while not _stopping.wait(OTP_SWEEP_SECONDS):
+        try:
+            sweep()
+        except Exception as e:
+            logger.error(f"OTP sweep failed: {e}")
+
+def ensure_sweeper():
+    global _sweeper
+    if _sweeper is not None and _sweeper.is_alive():
+        return
+    with _sweeper_lock:
+        if _sweeper is None or not _sweeper.is_alive():
+            _stopping.clear()
+            _sweeper = threading.Thread(target=_run_sweeper, name='otp-sweeper', daemon=True)
+            _sweeper.start()
+
+def stop_sweeper(timeout=5):
+    _stopping.set()
+    if _sweeper is not None:
+        _sweeper.join(timeout)
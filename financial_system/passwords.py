@@ -0,0 +1,102 @@
+import os
+import hmac
+import base64
+import hashlib
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Stored hashes carry their scheme and cost, e.g.
+#   scrypt$16384$8$1$<salt>$<hash>   or   pbkdf2_sha256$600000$<salt>$<hash>
+# Bare 64-character hex strings are the legacy unsalted SHA-256 hashes.
+PASSWORD_SCHEME = os.getenv('PASSWORD_SCHEME', 'scrypt')
+SCRYPT_N = int(os.getenv('SCRYPT_N', '16384'))
+SCRYPT_R = int(os.getenv('SCRYPT_R', '8'))
+SCRYPT_P = int(os.getenv('SCRYPT_P', '1'))
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', '600000'))
+SALT_BYTES = 16
+
+# Hashing is CPU-bound; a small pool caps how many cores a login burst can take,
+# and requests beyond the queue limit are turned away instead of piling up
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_QUEUE_LIMIT = int(os.getenv('PASSWORD_QUEUE_LIMIT', '32'))
+
+class HasherBusy(Exception):
+    pass
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password')
+_queue_slots = threading.BoundedSemaphore(PASSWORD_QUEUE_LIMIT)
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover 128 * n * r bytes plus some headroom
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p + 1024 * 1024, dklen=32)
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+def make_hash(password, scheme=None):
+    scheme = scheme or PASSWORD_SCHEME
+    salt = secrets.token_bytes(SALT_BYTES)
+    if scheme == 'scrypt':
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    if scheme == 'pbkdf2':
+        digest = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+    raise ValueError(f"Unknown PASSWORD_SCHEME: {scheme}")
+
+def check_hash(password, stored):
+    if not stored:
+        # Accounts created through Google sign-in have no password
+        return False
+
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            expected = _unb64(parts[5])
+            return hmac.compare_digest(_scrypt(password, _unb64(parts[4]), n, r, p), expected)
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            expected = _unb64(parts[3])
+            return hmac.compare_digest(_pbkdf2(password, _unb64(parts[2]), int(parts[1])), expected)
+    except ValueError:
+        return False
+
+    if len(parts) == 1:
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    return False
+
+def needs_rehash(stored):
+    # True for legacy hashes and for hashes made with a different scheme or cost than configured
+    if PASSWORD_SCHEME == 'scrypt':
+        return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+    return not stored.startswith(f"pbkdf2_sha256${PBKDF2_ITERATIONS}$")
+
+def _verify(password, stored):
+    if not check_hash(password, stored):
+        return False, None
+    return True, make_hash(password) if needs_rehash(stored) else None
+
+def _run(fn, *args):
+    if not _queue_slots.acquire(blocking=False):
+        raise HasherBusy()
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _queue_slots.release()
+
+def hash_password(password):
+    return _run(make_hash, password)
+
+def verify_password(password, stored):
+    # Returns (valid, upgraded_hash); upgraded_hash is set when the stored hash should be replaced
+    return _run(_verify, password, stored)
+
+def shutdown(wait=True):
+    _executor.shutdown(wait=wait)
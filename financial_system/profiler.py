@@ -0,0 +1,43 @@
+import sys
+import time
+import threading
+from collections import Counter
+import metrics
+
+# On-demand sampling profiler: every 1/hz seconds it records the stack of each thread that is
+# handling a request, as "file:function;file:function" lines with a count (flamegraph.pl input)
+MAX_SECONDS = 60
+MAX_HZ = 1000
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}"
+
+def _fold(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+def capture(seconds, hz, all_threads=False):
+    # Runs in the calling thread, which is never sampled itself
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = Counter()
+    interval = 1.0 / hz
+    deadline = time.perf_counter() + seconds
+    samples = 0
+    while time.perf_counter() < deadline:
+        wanted = None if all_threads else metrics.active_threads()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (wanted is not None and ident not in wanted):
+                continue
+            stacks[f"{names.get(ident, ident)};{_fold(frame)}"] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def format_collapsed(stacks):
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,94 @@
+import os
+import random
+import logging
+import calendar
+import threading
+from datetime import date, datetime, timedelta
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Occurrences fall on whole days, so the scheduler sleeps until the next local midnight and
+# re-checks at least every RECURRING_POLL_SECONDS in case another worker fell behind
+RECURRING_POLL_SECONDS = float(os.getenv('RECURRING_POLL_SECONDS', '300'))
+# Occurrences created per rule in one pass; a rule that is further behind catches up over several passes
+RECURRING_MAX_CATCH_UP = int(os.getenv('RECURRING_MAX_CATCH_UP', '366'))
+
+# frequency: (unit, interval); 'custom' takes both from the request
+FREQUENCIES = {
+    'daily': ('day', 1),
+    'weekly': ('week', 1),
+    'monthly': ('month', 1),
+    'custom': None,
+}
+UNITS = ('day', 'week', 'month')
+MAX_INTERVAL = 366
+
+def occurrence_date(rule, n):
+    # Counted from start_date rather than the previous occurrence, so a rule starting on the
+    # 31st falls on the last day of shorter months and returns to the 31st afterwards
+    start = date.fromisoformat(rule['start_date'])
+    steps = n * rule['interval']
+    if rule['unit'] == 'day':
+        return (start + timedelta(days=steps)).isoformat()
+    if rule['unit'] == 'week':
+        return (start + timedelta(weeks=steps)).isoformat()
+    months = start.year * 12 + start.month - 1 + steps
+    year, month = divmod(months, 12)
+    day = min(start.day, calendar.monthrange(year, month + 1)[1])
+    return date(year, month + 1, day).isoformat()
+
+def materialize_user(user_email, today=None):
+    today = today or date.today().isoformat()
+    return storage.materialize_recurring(user_email, today, occurrence_date, RECURRING_MAX_CATCH_UP)
+
+def run_due(today=None):
+    # Materialize everything due for every user; returns the number of records created
+    today = today or date.today().isoformat()
+    created = 0
+    for user_email in storage.due_recurring_users(today):
+        try:
+            created += materialize_user(user_email, today)
+        except Exception as e:
+            logger.error(f"Recurring run failed for {user_email}: {e}")
+    if created:
+        logger.info(f"Created {created} recurring transactions and budgets")
+    return created
+
+def _seconds_until_next_run():
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    # A little jitter keeps every worker from contending for the same users right at midnight
+    return min((midnight - now).total_seconds() + random.uniform(1, 30), RECURRING_POLL_SECONDS)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_stopping = threading.Event()
+
+def _run_scheduler():
+    delay = 0
+    while not _stopping.wait(delay):
+        try:
+            created = run_due()
+            # Rules still behind after a capped pass are picked up straight away
+            pending = storage.next_recurring_due()
+            behind = created and pending is not None and pending <= date.today().isoformat()
+            delay = 1 if behind else _seconds_until_next_run()
+        except Exception as e:
+            logger.error(f"Recurring scheduler failed: {e}")
+            delay = RECURRING_POLL_SECONDS
+
+def ensure_scheduler():
+    global _scheduler
+    if _scheduler is not None and _scheduler.is_alive():
+        return
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _stopping.clear()
+            _scheduler = threading.Thread(target=_run_scheduler, name='recurring-scheduler', daemon=True)
+            _scheduler.start()
+
+def stop_scheduler(timeout=5):
+    _stopping.set()
+    if _scheduler is not None:
+        _scheduler.join(timeout)
@@ -0,0 +1,162 @@
+import struct
+from itertools import accumulate
+import money
+
+# Columnar encoding of a block of transaction rows, used for archive segments (segments.py
+# compresses the result). Each field is stored as one column, transformed so that zlib finds
+# the redundancy that row-wise JSON hides:
+#
+#   header        magic, row count, currency, each column's struct width code, whether
+#                 descriptions are dictionary-encoded, and the size of each dictionary
+#   lengths       int32 length in characters of every dictionary entry (NONE for null)
+#   columns       id (delta from the previous row), amount (minor units), type, category,
+#                 date (delta of its dictionary index), description (dictionary index, or
+#                 the length in characters when not dictionary-encoded); each column is
+#                 stored in the narrowest integer width that fits it, byte plane by byte
+#                 plane, so the mostly-zero high bytes of small numbers sit together
+#   text          the dictionary entries, then the descriptions that are stored inline, as UTF-8
+#
+# Dictionaries are sorted, so rows in date order give date deltas of 0 or 1.
+MAGIC = b'TXR2'
+HEADER = struct.Struct('<4sI8s6sB4I')
+# Null marker for a dictionary entry's or an inline description's length
+NONE = -1
+WIDTHS = (('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63))
+DICTIONARY_FIELDS = ('type', 'category', 'date', 'description')
+# JSON text may carry lone surrogates, which strict UTF-8 refuses
+ERRORS = 'surrogatepass'
+
+def _width(values):
+    low, high = (min(values), max(values)) if values else (0, 0)
+    for code, limit in WIDTHS:
+        if -limit <= low and high < limit:
+            return code
+    raise ValueError('Value out of range for a transaction block')
+
+def _pack(values, code):
+    # The column's little-endian values with byte i of every value stored together
+    raw = struct.pack(f'<{len(values)}{code}', *values)
+    size = struct.calcsize(code)
+    return b''.join(raw[i::size] for i in range(size))
+
+def _unpack(payload, offset, count, code):
+    size = struct.calcsize(code)
+    raw = bytearray(count * size)
+    for i in range(size):
+        raw[i::size] = payload[offset + i * count:offset + (i + 1) * count]
+    return struct.unpack(f'<{count}{code}', raw), offset + count * size
+
+def _dictionary(values):
+    # (sorted distinct values with None first, index of each value in it)
+    entries = sorted(set(values), key=lambda v: (v is not None, v or ''))
+    positions = {value: i for i, value in enumerate(entries)}
+    return entries, [positions[value] for value in values]
+
+def _deltas(values):
+    return [value - previous for previous, value in zip([0] + values, values)]
+
+def is_encoded(payload):
+    return isinstance(payload, bytes) and payload[:4] == MAGIC
+
+def encode(transactions, currency=None):
+    # transactions are API-shaped dicts with amounts in major units
+    currency = currency or money.CURRENCY
+    count = len(transactions)
+    # SQLite hands back TEXT columns as strings, so the block does too
+    fields = {
+        field: [None if t.get(field) is None else str(t[field]) for t in transactions]
+        for field in DICTIONARY_FIELDS
+    }
+    # Descriptions repeat for most people (the same shops and bills), but synthetic or
+    # receipt-numbered ones do not, and then a dictionary only adds an index per row
+    dictionary_descriptions = len(set(fields['description'])) * 2 <= count
+
+    dictionaries = []
+    indexes = {}
+    for field in DICTIONARY_FIELDS:
+        if field == 'description' and not dictionary_descriptions:
+            dictionaries.append([])
+            continue
+        entries, indexes[field] = _dictionary(fields[field])
+        dictionaries.append(entries)
+    if dictionary_descriptions:
+        descriptions, inline = indexes['description'], []
+    else:
+        inline = [d for d in fields['description'] if d is not None]
+        descriptions = [NONE if d is None else len(d) for d in fields['description']]
+
+    columns = [
+        _deltas([t['id'] for t in transactions]),
+        [money.to_minor(t['amount'], currency) for t in transactions],
+        indexes['type'],
+        indexes['category'],
+        _deltas(indexes['date']),
+        descriptions,
+    ]
+    codes = [_width(column) for column in columns]
+    entries = [entry for dictionary in dictionaries for entry in dictionary]
+    text = ''.join(entry for entry in entries if entry is not None) + ''.join(inline)
+    lengths = [NONE if entry is None else len(entry) for entry in entries]
+    return b''.join([
+        HEADER.pack(MAGIC, count, currency.encode(), ''.join(codes).encode(), dictionary_descriptions,
+                    *map(len, dictionaries)),
+        struct.pack(f'<{len(lengths)}i', *lengths),
+        *(_pack(column, code) for column, code in zip(columns, codes)),
+        text.encode('utf-8', ERRORS),
+    ])
+
+def _split(text, lengths, start=0):
+    # Consecutive slices of text with the given lengths, None where the length is NONE
+    pieces = []
+    for length in lengths:
+        if length == NONE:
+            pieces.append(None)
+        else:
+            pieces.append(text[start:start + length])
+            start += length
+    return pieces, start
+
+def columns(payload):
+    # {field: tuple of values}, amounts left in minor units, plus the block's currency
+    magic, count, currency, codes, dictionary_descriptions, *sizes = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError('Not an encoded transaction block')
+    offset = HEADER.size
+    lengths = struct.unpack_from(f'<{sum(sizes)}i', payload, offset)
+    offset += 4 * len(lengths)
+    values = []
+    for code in codes.decode():
+        column, offset = _unpack(payload, offset, count, code)
+        values.append(column)
+    ids, amounts, types, categories, dates, descriptions = values
+    text = payload[offset:].decode('utf-8', ERRORS)
+
+    entries, end = _split(text, lengths)
+    dictionaries = []
+    for size in sizes:
+        dictionaries.append(entries[:size])
+        entries = entries[size:]
+    if dictionary_descriptions:
+        descriptions = tuple(map(dictionaries[3].__getitem__, descriptions))
+    else:
+        descriptions = tuple(_split(text, descriptions, end)[0])
+    return {
+        'id': tuple(accumulate(ids)),
+        'amount': amounts,
+        'type': tuple(map(dictionaries[0].__getitem__, types)),
+        'category': tuple(map(dictionaries[1].__getitem__, categories)),
+        'date': tuple(map(dictionaries[2].__getitem__, accumulate(dates))),
+        'description': descriptions,
+        'currency': currency.rstrip(b'\0').decode()
+    }
+
+def decode(payload):
+    # API-shaped dicts with amounts in major units
+    data = columns(payload)
+    currency = data['currency']
+    amounts = [money.to_major(minor, currency) for minor in data['amount']]
+    return [
+        {'id': i, 'type': t, 'amount': a, 'category': c, 'description': d, 'date': day}
+        for i, t, a, c, d, day in zip(data['id'], data['type'], amounts, data['category'],
+                                      data['description'], data['date'])
+    ]
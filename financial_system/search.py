@@ -0,0 +1,108 @@
+import os
+import math
+import heapq
+import storage
+import metrics
+
+# Query terms match whole terms, then prefixes (search-as-you-type), then close misspellings
+SEARCH_MAX_EXPANSIONS = int(os.getenv('SEARCH_MAX_EXPANSIONS', '20'))
+MIN_PREFIX_LENGTH = 2
+MIN_TYPO_LENGTH = 4
+MAX_QUERY_TERMS = 8
+
+# Relative credit for how a query term matched an indexed term
+EXACT, PREFIX, ONE_EDIT, TWO_EDITS = 1.0, 0.8, 0.6, 0.4
+
+def edit_distance(a, b, limit):
+    # Optimal string alignment distance (adjacent swaps count once), or limit + 1 once it is exceeded
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def expand(user_email, token):
+    # [(term, credit)] for the indexed terms a query token stands for
+    matches = {}
+    if len(token) >= MIN_PREFIX_LENGTH:
+        for term, _ in storage.search_vocabulary(user_email, token, SEARCH_MAX_EXPANSIONS):
+            matches[term] = EXACT if term == token else PREFIX
+    elif storage.search_postings(user_email, token):
+        matches[token] = EXACT
+
+    if token not in matches and len(token) >= MIN_TYPO_LENGTH and token.isalpha():
+        # Typos are looked for among terms with the same first letter, which keeps the scan to
+        # a slice of the user's vocabulary; longer words may have two edits. Numbers (receipt
+        # and reference numbers) only ever match exactly or by prefix.
+        limit = 1 if len(token) < 8 else 2
+        candidates = []
+        for term, doc_count in storage.search_vocabulary(user_email, token[0]):
+            if term in matches:
+                continue
+            distance = edit_distance(token, term, limit)
+            if distance <= limit:
+                candidates.append((distance, -doc_count, term))
+        for distance, _, term in sorted(candidates)[:SEARCH_MAX_EXPANSIONS]:
+            matches[term] = ONE_EDIT if distance == 1 else TWO_EDITS
+    return list(matches.items())
+
+@metrics.timed('aggregation')
+def _score(user_email, tokens):
+    # {transaction_id: score}; a transaction scores a token by its best-matching expansion,
+    # and must match every token
+    total = max(storage.count_transactions(user_email), 1)
+    scores = None
+    for token in tokens:
+        token_scores = {}
+        for term, credit in expand(user_email, token):
+            postings = storage.search_postings(user_email, term)
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            # Weights are small counts, so score each distinct weight once
+            by_weight = {}
+            for transaction_id, weight in postings:
+                score = by_weight.get(weight)
+                if score is None:
+                    score = by_weight[weight] = round(credit * idf * weight / (weight + 1.0), 6)
+                if score > token_scores.get(transaction_id, 0.0):
+                    token_scores[transaction_id] = score
+        if scores is None:
+            scores = token_scores
+        else:
+            scores = {i: round(score + token_scores[i], 6) for i, score in scores.items() if i in token_scores}
+        if not scores:
+            break
+    return scores or {}
+
+def search(user_email, query, limit=50, after=None):
+    # Returns (hits, total, next_key); after is the (score, id) of the previous page's last hit.
+    # Hits are ordered best first, ties going to the newest transaction.
+    storage.ensure_search_index(user_email)
+    tokens = list(dict.fromkeys(storage.search_tokens(query)))[:MAX_QUERY_TERMS]
+    if not tokens:
+        return [], 0, None
+
+    scores = _score(user_email, tokens)
+    # Postings come in id order; walking newest first keeps equal scores from churning the heap
+    candidates = ((score, i) for i, score in reversed(scores.items()))
+    if after is not None:
+        after = (float(after[0]), int(after[1]))
+        candidates = (key for key in candidates if key < after)
+    # Only the page is sorted: O(n log limit) rather than sorting every match
+    page = heapq.nlargest(limit + 1, candidates)
+    next_key = page[limit - 1] if len(page) > limit else None
+    page = page[:limit]
+
+    transactions = storage.get_transactions_by_ids(user_email, [i for _, i in page])
+    score_by_id = {i: score for score, i in page}
+    hits = [dict(t, score=score_by_id[t['id']]) for t in transactions]
+    return hits, len(scores), next_key
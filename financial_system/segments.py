@@ -0,0 +1,43 @@
+import json
+import zlib
+import money
+import rowcodec
+
+# Archived transactions are kept one calendar year per segment: the year's rows as a single
+# compressed block (see rowcodec.py) in date order, so old years take neither index space nor
+# parse time until something actually asks for them
+COMPRESSION_LEVEL = 9
+
+def encode(transactions):
+    return zlib.compress(rowcodec.encode(transactions), COMPRESSION_LEVEL)
+
+def _legacy(raw):
+    # Segments written before amounts were fixed-point: JSON rows with major-unit amounts
+    return [dict(zip(('id', 'type', 'amount', 'category', 'description', 'date'), row)) for row in json.loads(raw)]
+
+def decode(payload):
+    raw = zlib.decompress(payload)
+    return rowcodec.decode(raw) if rowcodec.is_encoded(raw) else _legacy(raw)
+
+def columns(payload):
+    # (date, type, amount in minor units, category) rows without building a dict per transaction
+    raw = zlib.decompress(payload)
+    if not rowcodec.is_encoded(raw):
+        return [(t['date'], t['type'], money.to_minor(t['amount']), t['category']) for t in _legacy(raw)]
+    data = rowcodec.columns(raw)
+    return list(zip(data['date'], data['type'], data['amount'], data['category']))
+
+def summarize(transactions):
+    # Segment metadata that lets a query skip the segment without decoding it
+    dates = [t['date'] for t in transactions]
+    ids = [t['id'] for t in transactions]
+    amounts = [money.to_minor(t['amount']) for t in transactions]
+    return {
+        'row_count': len(transactions),
+        'first_date': min(dates),
+        'last_date': max(dates),
+        'min_id': min(ids),
+        'max_id': max(ids),
+        'min_amount_minor': min(amounts),
+        'max_amount_minor': max(amounts)
+    }
@@ -0,0 +1,181 @@
+import os
+import time
+import secrets
+import hashlib
+import logging
+import threading
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+import storage
+
+logger = logging.getLogger(__name__)
+
+# 'sqlite' shares sessions between gunicorn workers; 'memory' suits a single development process
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', str(7 * 24 * 3600)))
+# Sliding expiry is written back at most this often, so ordinary requests stay read-only
+SESSION_REFRESH_SECONDS = int(os.getenv('SESSION_REFRESH_SECONDS', '3600'))
+SESSION_PURGE_SECONDS = int(os.getenv('SESSION_PURGE_SECONDS', '3600'))
+
+# Session contents live server-side; the cookie only carries a random session id
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+        self.rotate = False
+
+class MemorySessionStore:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._sessions[key]
+                return None
+            return dict(entry[1]), entry[2]
+
+    def save(self, key, user_email, data, expires_at):
+        with self._lock:
+            self._sessions[key] = (user_email, dict(data), expires_at)
+
+    def touch(self, key, expires_at):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None:
+                self._sessions[key] = (entry[0], entry[1], expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def delete_user(self, user_email):
+        with self._lock:
+            keys = [key for key, entry in self._sessions.items() if entry[0] == user_email]
+            for key in keys:
+                del self._sessions[key]
+        return len(keys)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            keys = [key for key, entry in self._sessions.items() if entry[2] <= now]
+            for key in keys:
+                del self._sessions[key]
+        return len(keys)
+
+class SQLiteSessionStore:
+    def load(self, key):
+        return storage.load_session(key)
+
+    def save(self, key, user_email, data, expires_at):
+        storage.save_session(key, user_email, data, expires_at)
+
+    def touch(self, key, expires_at):
+        storage.touch_session(key, expires_at)
+
+    def delete(self, key):
+        storage.delete_session(key)
+
+    def delete_user(self, user_email):
+        return storage.delete_user_sessions(user_email)
+
+    def purge(self):
+        return storage.delete_expired_sessions()
+
+def _store_key(sid):
+    # Only a hash of the id is stored, so a copy of the session table cannot be replayed as cookies
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+        self._last_purge = 0.0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self.store.load(_store_key(sid))
+            if loaded is not None:
+                data, expires_at = loaded
+                return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # An emptied session (logout) is revoked server-side, not just forgotten by the browser
+        if not session:
+            if session.sid is not None:
+                self.store.delete(_store_key(session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        new_sid = session.sid is None or session.rotate
+        if new_sid:
+            if session.sid is not None:
+                self.store.delete(_store_key(session.sid))
+            session.sid = secrets.token_urlsafe(32)
+
+        if new_sid or session.modified:
+            session.expires_at = now + SESSION_TTL_SECONDS
+            self.store.save(_store_key(session.sid), session.get('user_email'), dict(session), session.expires_at)
+            self._maybe_purge(now)
+        elif now + SESSION_TTL_SECONDS - session.expires_at >= SESSION_REFRESH_SECONDS:
+            session.expires_at = now + SESSION_TTL_SECONDS
+            self.store.touch(_store_key(session.sid), session.expires_at)
+
+        if new_sid:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+            response.vary.add('Cookie')
+
+    def is_active(self, session):
+        # Long-lived responses re-check this so a logout or revocation also ends them
+        return session.sid is not None and self.store.load(_store_key(session.sid)) is not None
+
+    def revoke_user(self, user_email):
+        # Log the user out everywhere, e.g. after a password reset
+        return self.store.delete_user(user_email)
+
+    def _maybe_purge(self, now):
+        if now - self._last_purge < SESSION_PURGE_SECONDS:
+            return
+        self._last_purge = now
+        try:
+            removed = self.store.purge()
+            if removed:
+                logger.info(f"Purged {removed} expired sessions")
+        except Exception as e:
+            logger.error(f"Session purge failed: {e}")
+
+def rotate(session):
+    # Issue a fresh id at login so an id planted before authentication is useless afterwards
+    session.rotate = True
+
+def create_session_interface(backend=None):
+    backend = backend or SESSION_BACKEND
+    if backend == 'memory':
+        return ServerSessionInterface(MemorySessionStore())
+    if backend == 'sqlite':
+        return ServerSessionInterface(SQLiteSessionStore())
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
@@ -1,7 +1,14 @@
 // Global variables
 let currentUser = null;
 let transactions = [];
+let transactionsCursor = null;
 let budgets = [];
+let dashboardVersion = null;
+let liveSource = null;
+let liveConnected = false;
+let transactionsRenderPending = false;
+
+const TRANSACTION_PAGE_SIZE = 50;
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
@@ -56,6 +63,12 @@ function setupEventListeners() {
         transactionForm.addEventListener('submit', handleAddTransaction);
     }
     
+    // Suggest a category once the description is filled in
+    const descriptionInput = document.getElementById('transaction-description');
+    if (descriptionInput) {
+        descriptionInput.addEventListener('change', suggestTransactionCategory);
+    }
+    
     // Budget form
     const budgetForm = document.getElementById('budget-form');
     if (budgetForm) {
@@ -319,6 +332,7 @@ async function logout() {
         
         if (data.success) {
             currentUser = null;
+            stopLiveUpdates();
             transactions = [];
             budgets = [];
             showAuthContainer();
@@ -337,15 +351,13 @@ function googleSignIn() {
 // Check authentication status
 async function checkAuthStatus() {
     try {
-        const response = await fetch('/api/summary', {
-            credentials: 'include'
-        });
+        const response = await fetchDashboard();
         
         if (response.ok) {
             const data = await response.json();
-            if (data.income !== undefined) {
+            if (data.success) {
                 showMainApp();
-                loadUserData();
+                renderDashboard(data);
                 return;
             }
         }
@@ -372,21 +384,131 @@ function showAuthContainer() {
     showLogin();
 }
 
-// Load user data
+// Load user data: every panel comes from one dashboard request, which the browser
+// revalidates with its ETag so an unchanged dashboard costs a 304
+function fetchDashboard() {
+    return fetch(`/api/dashboard?limit=${TRANSACTION_PAGE_SIZE}`, {
+        credentials: 'include'
+    });
+}
+
 async function loadUserData() {
     try {
-        await Promise.all([
-            loadTransactions(),
-            loadBudgets(),
-            updateSummary(),
-            loadReports()
-        ]);
+        const response = await fetchDashboard();
+        if (response.ok) {
+            renderDashboard(await response.json());
+        }
     } catch (error) {
         showNotification('Failed to load user data', 'error');
     }
 }
 
+function renderDashboard(data) {
+    dashboardVersion = data.version;
+    transactions = data.transactions;
+    transactionsCursor = data.next_cursor;
+    displayTransactions();
+    budgets = data.budgets;
+    displayBudgets();
+    displaySummary(data.summary);
+    renderCharts(data.reports);
+    startLiveUpdates();
+}
+
+// Live updates: the server pushes changes made in this or any other tab, and the
+// dashboard is patched in place. Until the channel is open, mutations reload instead.
+function startLiveUpdates() {
+    if (!window.EventSource || liveSource) return;
+    
+    liveSource = new EventSource('/api/live', { withCredentials: true });
+    liveSource.addEventListener('ready', (e) => {
+        liveConnected = true;
+        // Anything written between the dashboard load and the stream opening needs a reload
+        const data = JSON.parse(e.data);
+        if (data.version !== undefined && data.version !== dashboardVersion) {
+            loadUserData();
+        }
+    });
+    liveSource.addEventListener('change', (e) => applyLiveChange(JSON.parse(e.data)));
+    liveSource.addEventListener('aggregates', (e) => applyLiveAggregates(JSON.parse(e.data)));
+    liveSource.addEventListener('reset', () => loadUserData());
+    // EventSource reconnects by itself and resumes from the last event id it saw
+    liveSource.onerror = () => {
+        liveConnected = false;
+    };
+}
+
+function stopLiveUpdates() {
+    if (liveSource) {
+        liveSource.close();
+        liveSource = null;
+    }
+    liveConnected = false;
+}
+
+function applyLiveChange(delta) {
+    // Budget rows are refreshed with their spend by the aggregates event that follows
+    if (delta.entity !== 'transaction') return;
+    
+    transactions = transactions.filter(t => t.id !== delta.id);
+    if (delta.event === 'add') {
+        const record = delta.record;
+        const isNewer = t => t.date > record.date || (t.date === record.date && t.id > record.id);
+        const oldest = transactions[transactions.length - 1];
+        // Rows older than the loaded pages are left for "Load more" to fetch
+        if (!transactionsCursor || !oldest || !isNewer(oldest)) {
+            const index = transactions.findIndex(t => !isNewer(t));
+            transactions.splice(index === -1 ? transactions.length : index, 0, record);
+        }
+    }
+    scheduleTransactionsRender();
+}
+
+function scheduleTransactionsRender() {
+    if (transactionsRenderPending) return;
+    transactionsRenderPending = true;
+    setTimeout(() => {
+        transactionsRenderPending = false;
+        displayTransactions();
+    }, 0);
+}
+
+function applyLiveAggregates(data) {
+    dashboardVersion = data.version;
+    budgets = data.budgets;
+    displayBudgets();
+    displaySummary(data.summary);
+    renderCharts(data.reports);
+}
+
 // Transaction handlers
+async function suggestTransactionCategory() {
+    const categorySelect = document.getElementById('transaction-category');
+    const description = document.getElementById('transaction-description').value.trim();
+    // Never override a category the user already picked
+    if (!description || categorySelect.value) {
+        return;
+    }
+    
+    const params = new URLSearchParams({
+        description,
+        type: document.getElementById('transaction-type').value
+    });
+    try {
+        const response = await fetch(`/api/transactions/categorize?${params}`, { credentials: 'include' });
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        const known = Array.from(categorySelect.options).some(option => option.value === data.category);
+        if (data.category && known && !categorySelect.value) {
+            categorySelect.value = data.category;
+        }
+    } catch (error) {
+        // Suggestions are optional; the user can still pick a category
+    }
+}
+
 async function handleAddTransaction(e) {
     e.preventDefault();
     
@@ -426,9 +548,9 @@ async function handleAddTransaction(e) {
             showNotification('Transaction added successfully!', 'success');
             document.getElementById('transaction-form').reset();
             document.getElementById('transaction-date').value = new Date().toISOString().split('T')[0];
-            await loadTransactions();
-            await updateSummary();
-            await loadReports();
+            if (!liveConnected) {
+                await loadUserData();
+            }
         } else {
             showNotification(data.message || 'Failed to add transaction', 'error');
         }
@@ -439,14 +561,22 @@ async function handleAddTransaction(e) {
     }
 }
 
-async function loadTransactions() {
+// Load the newest page of transactions, or append the next page when loadMore is set
+async function loadTransactions(loadMore = false) {
     try {
-        const response = await fetch('/api/transactions', {
+        const params = new URLSearchParams({ limit: TRANSACTION_PAGE_SIZE, sort: 'date_desc' });
+        if (loadMore && transactionsCursor) {
+            params.set('cursor', transactionsCursor);
+        }
+        
+        const response = await fetch(`/api/transactions?${params}`, {
             credentials: 'include'
         });
         
         if (response.ok) {
-            transactions = await response.json();
+            const data = await response.json();
+            transactions = loadMore ? transactions.concat(data.transactions) : data.transactions;
+            transactionsCursor = data.next_cursor;
             displayTransactions();
         }
     } catch (error) {
@@ -463,10 +593,8 @@ function displayTransactions() {
         return;
     }
     
-    // Sort transactions by date (newest first)
-    const sortedTransactions = [...transactions].sort((a, b) => new Date(b.date) - new Date(a.date));
-    
-    container.innerHTML = sortedTransactions.map(transaction => `
+    // Transactions arrive sorted by date (newest first)
+    container.innerHTML = transactions.map(transaction => `
         <div class="transaction-item">
             <div class="item-details">
                 <h4>${transaction.description}</h4>
@@ -482,7 +610,9 @@ function displayTransactions() {
                 </div>
             </div>
         </div>
-    `).join('');
+    `).join('') + (transactionsCursor
+        ? '<button class="btn btn-secondary" onclick="loadTransactions(true)">Load more</button>'
+        : '');
 }
 
 async function deleteTransaction(id) {
@@ -498,9 +628,9 @@ async function deleteTransaction(id) {
         
         if (response.ok) {
             showNotification('Transaction deleted successfully!', 'success');
-            await loadTransactions();
-            await updateSummary();
-            await loadReports();
+            if (!liveConnected) {
+                await loadUserData();
+            }
         } else {
             showNotification('Failed to delete transaction', 'error');
         }
@@ -545,7 +675,9 @@ async function handleAddBudget(e) {
             showNotification('Budget created successfully!', 'success');
             document.getElementById('budget-form').reset();
             document.getElementById('budget-month').value = new Date().toISOString().slice(0, 7);
-            await loadBudgets();
+            if (!liveConnected) {
+                await loadBudgets();
+            }
         } else {
             showNotification(data.message || 'Failed to create budget', 'error');
         }
@@ -558,12 +690,13 @@ async function handleAddBudget(e) {
 
 async function loadBudgets() {
     try {
-        const response = await fetch('/api/budgets', {
+        const response = await fetch('/api/budgets/status', {
             credentials: 'include'
         });
         
         if (response.ok) {
-            budgets = await response.json();
+            const data = await response.json();
+            budgets = data.budgets;
             displayBudgets();
         }
     } catch (error) {
@@ -581,8 +714,8 @@ function displayBudgets() {
     }
     
     container.innerHTML = budgets.map(budget => {
-        const spent = calculateSpentAmount(budget.category, budget.month);
-        const percentage = budget.limit > 0 ? (spent / budget.limit) * 100 : 0;
+        const spent = budget.spent;
+        const percentage = budget.percent_used;
         const isOverBudget = percentage > 100;
         
         return `
@@ -610,14 +743,6 @@ function displayBudgets() {
     }).join('');
 }
 
-function calculateSpentAmount(category, month) {
-    return transactions
-        .filter(t => t.type === 'expense' && 
-                    t.category === category && 
-                    t.date.startsWith(month))
-        .reduce((sum, t) => sum + t.amount, 0);
-}
-
 async function deleteBudget(id) {
     if (!confirm('Are you sure you want to delete this budget?')) {
         return;
@@ -631,7 +756,9 @@ async function deleteBudget(id) {
         
         if (response.ok) {
             showNotification('Budget deleted successfully!', 'success');
-            await loadBudgets();
+            if (!liveConnected) {
+                await loadBudgets();
+            }
         } else {
             showNotification('Failed to delete budget', 'error');
         }
@@ -641,29 +768,17 @@ async function deleteBudget(id) {
 }
 
 // Summary and statistics
-async function updateSummary() {
-    try {
-        const response = await fetch('/api/summary', {
-            credentials: 'include'
-        });
-        
-        if (response.ok) {
-            const data = await response.json();
-            
-            document.getElementById('total-income').textContent = `$${data.income.toFixed(2)}`;
-            document.getElementById('total-expenses').textContent = `$${data.expenses.toFixed(2)}`;
-            document.getElementById('balance').textContent = `$${data.balance.toFixed(2)}`;
-            
-            // Update balance color based on positive/negative
-            const balanceElement = document.getElementById('balance');
-            if (data.balance >= 0) {
-                balanceElement.style.color = '#28a745';
-            } else {
-                balanceElement.style.color = '#dc3545';
-            }
-        }
-    } catch (error) {
-        showNotification('Failed to update summary', 'error');
+function displaySummary(summary) {
+    document.getElementById('total-income').textContent = `$${summary.income.toFixed(2)}`;
+    document.getElementById('total-expenses').textContent = `$${summary.expenses.toFixed(2)}`;
+    document.getElementById('balance').textContent = `$${summary.balance.toFixed(2)}`;
+    
+    // Update balance color based on positive/negative
+    const balanceElement = document.getElementById('balance');
+    if (summary.balance >= 0) {
+        balanceElement.style.color = '#28a745';
+    } else {
+        balanceElement.style.color = '#dc3545';
     }
 }
 
@@ -683,10 +798,20 @@ async function loadReports() {
     }
 }
 
+// Chart.js will not draw on a canvas that already holds a chart, so replace the old one
+function drawChart(canvasId, config) {
+    const canvas = document.getElementById(canvasId);
+    const existing = Chart.getChart(canvas);
+    if (existing) {
+        existing.destroy();
+    }
+    return new Chart(canvas, config);
+}
+
 function renderCharts(reportData) {
     // Income vs Expense Chart
-    const incomeExpenseChart = new Chart(
-        document.getElementById('income-expense-chart'), 
+    const incomeExpenseChart = drawChart(
+        'income-expense-chart',
         {
             type: 'doughnut',
             data: {
@@ -719,8 +844,8 @@ function renderCharts(reportData) {
     const categories = Object.keys(reportData.categories);
     const categorySpending = categories.map(cat => reportData.categories[cat]);
     
-    const categoryChart = new Chart(
-        document.getElementById('category-chart'), 
+    const categoryChart = drawChart(
+        'category-chart',
         {
             type: 'bar',
             data: {
@@ -766,8 +891,8 @@ function renderCharts(reportData) {
     const incomeData = months.map(month => reportData.monthly_trend[month].income);
     const expensesData = months.map(month => reportData.monthly_trend[month].expenses);
     
-    const trendChart = new Chart(
-        document.getElementById('trend-chart'), 
+    const trendChart = drawChart(
+        'trend-chart',
         {
             type: 'line',
             data: {
@@ -830,21 +955,10 @@ async function getAdvice() {
     setLoading(button, true);
     
     try {
-        const response = await fetch('/api/financial-advice', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ query }),
-            credentials: 'include'
-        });
-        
-        const data = await response.json();
-        
-        if (data.success) {
-            displayAdvice(data.advice);
-        } else {
-            showNotification(data.message || 'Failed to get advice', 'error');
+        // Stream tokens as they arrive; fall back to a polled job if streaming is unavailable
+        const streamed = window.ReadableStream ? await streamAdvice(query) : false;
+        if (!streamed) {
+            await getAdviceFromJob(query);
         }
     } catch (error) {
         showNotification('Failed to get advice', 'error');
@@ -853,6 +967,109 @@ async function getAdvice() {
     }
 }
 
+async function streamAdvice(query) {
+    const response = await fetch('/api/financial-advice/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ query }),
+        credentials: 'include'
+    });
+    
+    if (!response.ok || !response.body) {
+        return false;
+    }
+    
+    const adviceText = startAdviceDisplay();
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop();
+        
+        for (const frame of frames) {
+            const event = parseSSEFrame(frame);
+            if (event.type === 'token') {
+                adviceText.textContent += event.data.text;
+            } else if (event.type === 'error') {
+                showNotification(event.data.message || 'Failed to get advice', 'error');
+            }
+        }
+    }
+    return true;
+}
+
+function parseSSEFrame(frame) {
+    let type = 'message';
+    let data = '';
+    
+    frame.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            type = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            data += line.slice(5).trim();
+        }
+    });
+    
+    return { type, data: data ? JSON.parse(data) : {} };
+}
+
+async function getAdviceFromJob(query) {
+    const response = await fetch('/api/financial-advice/jobs', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ query }),
+        credentials: 'include'
+    });
+    
+    const data = await response.json();
+    
+    if (!data.success) {
+        showNotification(data.message || 'Failed to get advice', 'error');
+        return;
+    }
+    
+    const job = data.status === 'done' ? data : await pollAdviceJob(data.job_id);
+    if (job && job.status === 'done') {
+        displayAdvice(job.advice);
+    } else {
+        showNotification((job && job.error) || 'Failed to get advice', 'error');
+    }
+}
+
+// Poll a background advice job until it finishes or we give up
+async function pollAdviceJob(jobId, intervalMs = 1000, timeoutMs = 60000) {
+    const deadline = Date.now() + timeoutMs;
+    
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+        
+        const response = await fetch(`/api/financial-advice/jobs/${jobId}`, {
+            credentials: 'include'
+        });
+        if (!response.ok) {
+            return null;
+        }
+        
+        const job = await response.json();
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+    }
+    return null;
+}
+
 function displayAdvice(advice) {
     const container = document.getElementById('advice-response');
     container.innerHTML = `
@@ -862,6 +1079,14 @@ function displayAdvice(advice) {
     container.classList.add('show');
 }
 
+// Prepare the advice panel for streamed text and return the element to append to
+function startAdviceDisplay() {
+    const container = document.getElementById('advice-response');
+    container.innerHTML = '<h4>💡 Financial Advice</h4><p></p>';
+    container.classList.add('show');
+    return container.querySelector('p');
+}
+
 // Tab management
 function showTab(tabName) {
     // Hide all tab contents
@@ -0,0 +1,2012 @@
+import os
+import re
+import json
+import heapq
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+import unicodedata
+from datetime import datetime, timedelta
+from cache import UserCache
+from changes import ChangeFeed
+import money
+import segments
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Database location (overridable for deployments and local runs)
+DB_FILE = os.getenv('DATABASE_PATH', os.path.join('data', 'financial.db'))
+
+# Per-user data (transactions, budgets, totals, journal) lives in SHARD_COUNT shard databases
+# chosen by a hash of the email, so writers for different users rarely share a file lock and a
+# damaged shard only affects its own users. Accounts, sessions and queues stay in DB_FILE.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '16'))
+SHARD_DIR = os.getenv('SHARD_DIR', os.path.join(os.path.dirname(DB_FILE), 'shards'))
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+# Journal compaction policy
+JOURNAL_RETENTION_DAYS = int(os.getenv('JOURNAL_RETENTION_DAYS', '7'))
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+
+_journal_lock = threading.Lock()
+_events_since_compaction = 0
+# Compaction runs on a background thread (see ensure_compactor), never on the writing request
+_compactor = None
+_compactor_lock = threading.Lock()
+_compaction_due = threading.Event()
+_compactor_stopping = threading.Event()
+
+# Archival policy: whole calendar years older than the last ARCHIVE_KEEP_YEARS (the current year
+# included) are moved into compressed segments by archive_transactions()
+ARCHIVE_KEEP_YEARS = int(os.getenv('ARCHIVE_KEEP_YEARS', '2'))
+
+# Per-process read cache of user transactions and budgets
+user_cache = UserCache(max_users=int(os.getenv('USER_CACHE_SIZE', '256')))
+# Decoded archive segments, keyed by (user, year) and validated by the segment's revision, so
+# they survive the user's everyday writes
+segment_cache = UserCache(max_users=int(os.getenv('SEGMENT_CACHE_SIZE', '32')))
+change_feed = ChangeFeed()
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    [
+        """CREATE TABLE IF NOT EXISTS users (
+            email TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            phone TEXT,
+            password TEXT,
+            created_at TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS transactions (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            type TEXT,
+            amount REAL NOT NULL,
+            category TEXT,
+            description TEXT,
+            date TEXT,
+            PRIMARY KEY (user_email, id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS budgets (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            category TEXT,
+            limit_amount REAL NOT NULL,
+            month TEXT,
+            PRIMARY KEY (user_email, id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS otp (
+            email TEXT PRIMARY KEY,
+            otp TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            phone TEXT
+        )""",
+    ],
+    [
+        # Bumped on every write so caches in any worker can detect stale data
+        """CREATE TABLE IF NOT EXISTS user_versions (
+            user_email TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )""",
+    ],
+    [
+        # Running totals maintained as deltas on every transaction write
+        """CREATE TABLE IF NOT EXISTS monthly_totals (
+            user_email TEXT NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, month, type)
+        )""",
+        """CREATE TABLE IF NOT EXISTS category_totals (
+            user_email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, category)
+        )""",
+        """INSERT OR REPLACE INTO monthly_totals (user_email, month, type, total, count)
+            SELECT user_email, COALESCE(substr(date, 1, 7), ''), COALESCE(type, ''), SUM(amount), COUNT(*)
+            FROM transactions GROUP BY 1, 2, 3""",
+        """INSERT OR REPLACE INTO category_totals (user_email, category, total, count)
+            SELECT user_email, COALESCE(category, ''), SUM(amount), COUNT(*)
+            FROM transactions WHERE type = 'expense' GROUP BY 1, 2""",
+    ],
+    [
+        # Ids are never reused, even after the newest row is deleted
+        """CREATE TABLE IF NOT EXISTS id_counters (
+            user_email TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY (user_email, kind)
+        )""",
+        """INSERT OR REPLACE INTO id_counters (user_email, kind, last_id)
+            SELECT user_email, 'transactions', MAX(id) FROM transactions GROUP BY user_email""",
+        """INSERT OR REPLACE INTO id_counters (user_email, kind, last_id)
+            SELECT user_email, 'budgets', MAX(id) FROM budgets GROUP BY user_email""",
+        # Append-only journal of transaction mutations, compacted by compact_journal()
+        """CREATE TABLE IF NOT EXISTS transaction_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            event TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            payload TEXT,
+            created_at TEXT NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_transaction_events_user ON transaction_events (user_email, seq)',
+        'CREATE INDEX IF NOT EXISTS idx_transaction_events_created ON transaction_events (created_at)',
+    ],
+    [
+        # Keyset pagination indexes for the filtered transaction listing
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (user_email, date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (user_email, category, date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions (user_email, amount, id)',
+    ],
+    [
+        """CREATE TABLE IF NOT EXISTS advice_jobs (
+            id TEXT PRIMARY KEY,
+            user_email TEXT NOT NULL,
+            status TEXT NOT NULL,
+            advice TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_advice_jobs_created ON advice_jobs (created_at)',
+    ],
+    [
+        # Durable queue of outgoing email, drained by mailer's background worker
+        """CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)',
+    ],
+    [
+        # Expiry index for the OTP sweeper and per-email send counters for rate limiting
+        'CREATE INDEX IF NOT EXISTS idx_otp_expires ON otp (expires_at)',
+        """CREATE TABLE IF NOT EXISTS otp_requests (
+            email TEXT PRIMARY KEY,
+            window_start REAL NOT NULL,
+            count INTEGER NOT NULL,
+            last_sent REAL NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_otp_requests_window ON otp_requests (window_start)',
+    ],
+    [
+        # Expense per (category, month), so each budget's spend is a single lookup
+        """CREATE TABLE IF NOT EXISTS category_month_spend (
+            user_email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            month TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, category, month)
+        )""",
+        """INSERT OR REPLACE INTO category_month_spend (user_email, category, month, total, count)
+            SELECT user_email, COALESCE(category, ''), COALESCE(substr(date, 1, 7), ''), SUM(amount), COUNT(*)
+            FROM transactions WHERE type = 'expense' GROUP BY 1, 2, 3""",
+    ],
+    [
+        # Server-side sessions keyed by a hash of the cookie's session id
+        """CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_email TEXT,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_email)',
+    ],
+    [
+        # Budget changes share the journal; transaction_id holds the id of whichever record changed
+        "ALTER TABLE transaction_events ADD COLUMN entity TEXT NOT NULL DEFAULT 'transaction'",
+    ],
+    [
+        # The per-user tables above now live in the shards; these settings pin the layout
+        """CREATE TABLE IF NOT EXISTS storage_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )""",
+    ],
+    [
+        # Failed emails are kept for inspection, but not the one-time codes in their bodies
+        "UPDATE email_outbox SET body = '' WHERE status = 'failed'",
+    ],
+]
+
+# Schema of each shard database: the per-user tables from MIGRATIONS in their current form
+SHARD_MIGRATIONS = [
+    [
+        """CREATE TABLE IF NOT EXISTS transactions (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            type TEXT,
+            amount REAL NOT NULL,
+            category TEXT,
+            description TEXT,
+            date TEXT,
+            PRIMARY KEY (user_email, id)
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (user_email, date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (user_email, category, date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions (user_email, amount, id)',
+        """CREATE TABLE IF NOT EXISTS budgets (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            category TEXT,
+            limit_amount REAL NOT NULL,
+            month TEXT,
+            PRIMARY KEY (user_email, id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS user_versions (
+            user_email TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS monthly_totals (
+            user_email TEXT NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, month, type)
+        )""",
+        """CREATE TABLE IF NOT EXISTS category_totals (
+            user_email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, category)
+        )""",
+        """CREATE TABLE IF NOT EXISTS category_month_spend (
+            user_email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            month TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, category, month)
+        )""",
+        """CREATE TABLE IF NOT EXISTS id_counters (
+            user_email TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            PRIMARY KEY (user_email, kind)
+        )""",
+        """CREATE TABLE IF NOT EXISTS transaction_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            event TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            payload TEXT,
+            created_at TEXT NOT NULL,
+            entity TEXT NOT NULL DEFAULT 'transaction'
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_transaction_events_user ON transaction_events (user_email, seq)',
+        'CREATE INDEX IF NOT EXISTS idx_transaction_events_created ON transaction_events (created_at)',
+        # Users whose rows were moved here from the single-file layout by migrate_to_shards()
+        'CREATE TABLE IF NOT EXISTS migrated_users (user_email TEXT PRIMARY KEY)',
+    ],
+    [
+        # Recurring transaction and budget templates. next_due is the first occurrence not yet
+        # materialized (NULL once the rule has ended); the index is the scheduler's due queue.
+        """CREATE TABLE IF NOT EXISTS recurring_rules (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            template TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            unit TEXT NOT NULL,
+            interval INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT,
+            next_due TEXT,
+            occurrences INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (user_email, id)
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_recurring_rules_due ON recurring_rules (next_due, user_email)',
+    ],
+    [
+        # Per-user inverted index over description and category terms, kept in step with every
+        # transaction insert and delete. Clustered by user and term, so a lookup or prefix range
+        # reads only that user's postings.
+        """CREATE TABLE IF NOT EXISTS search_postings (
+            user_email TEXT NOT NULL,
+            term TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            weight INTEGER NOT NULL,
+            PRIMARY KEY (user_email, term, transaction_id)
+        ) WITHOUT ROWID""",
+        # Each user's vocabulary with document frequencies, for ranking and typo candidates
+        """CREATE TABLE IF NOT EXISTS search_terms (
+            user_email TEXT NOT NULL,
+            term TEXT NOT NULL,
+            doc_count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, term)
+        ) WITHOUT ROWID""",
+        # Users whose existing rows still have to be indexed; drained on their first search
+        'CREATE TABLE IF NOT EXISTS search_backfill (user_email TEXT PRIMARY KEY)',
+        'INSERT OR IGNORE INTO search_backfill (user_email) SELECT DISTINCT user_email FROM transactions',
+    ],
+    [
+        # Old transactions moved out of the transactions table, one compressed segment per user
+        # and year (see segments.py). The running totals keep counting them; the columns beside
+        # the payload let a query rule a segment out without decoding it. revision is a random
+        # tag replaced on every rewrite, so a year archived again after being emptied never
+        # matches what a worker cached earlier.
+        """CREATE TABLE IF NOT EXISTS transaction_segments (
+            user_email TEXT NOT NULL,
+            year TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            min_amount REAL NOT NULL,
+            max_amount REAL NOT NULL,
+            payload BLOB NOT NULL,
+            revision INTEGER NOT NULL,
+            PRIMARY KEY (user_email, year)
+        )""",
+    ],
+    [
+        # Money becomes fixed-point: amounts, limits and totals are integers in the currency's
+        # minor unit (see money.py). SQLite cannot change a column's type, so each table is
+        # rebuilt; existing totals are rounded, which is exact while their drift is under half
+        # a minor unit (rebuild-aggregates recomputes them outright).
+        """CREATE TABLE transactions_fixed (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            type TEXT,
+            amount_minor INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            category TEXT,
+            description TEXT,
+            date TEXT,
+            PRIMARY KEY (user_email, id)
+        )""",
+        f"""INSERT INTO transactions_fixed
+            SELECT user_email, id, type, CAST(ROUND(amount * {money.scale()}) AS INTEGER), '{money.CURRENCY}',
+                   category, description, date
+            FROM transactions""",
+        'DROP TABLE transactions',
+        'ALTER TABLE transactions_fixed RENAME TO transactions',
+        'CREATE INDEX idx_transactions_date ON transactions (user_email, date, id)',
+        'CREATE INDEX idx_transactions_category ON transactions (user_email, category, date, id)',
+        'CREATE INDEX idx_transactions_amount ON transactions (user_email, amount_minor, id)',
+        """CREATE TABLE budgets_fixed (
+            user_email TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            category TEXT,
+            limit_minor INTEGER NOT NULL,
+            month TEXT,
+            PRIMARY KEY (user_email, id)
+        )""",
+        f"""INSERT INTO budgets_fixed
+            SELECT user_email, id, category, CAST(ROUND(limit_amount * {money.scale()}) AS INTEGER), month
+            FROM budgets""",
+        'DROP TABLE budgets',
+        'ALTER TABLE budgets_fixed RENAME TO budgets',
+        """CREATE TABLE monthly_totals_fixed (
+            user_email TEXT NOT NULL,
+            month TEXT NOT NULL,
+            type TEXT NOT NULL,
+            total_minor INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, month, type)
+        )""",
+        f"""INSERT INTO monthly_totals_fixed
+            SELECT user_email, month, type, CAST(ROUND(total * {money.scale()}) AS INTEGER), count
+            FROM monthly_totals""",
+        'DROP TABLE monthly_totals',
+        'ALTER TABLE monthly_totals_fixed RENAME TO monthly_totals',
+        """CREATE TABLE category_totals_fixed (
+            user_email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total_minor INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, category)
+        )""",
+        f"""INSERT INTO category_totals_fixed
+            SELECT user_email, category, CAST(ROUND(total * {money.scale()}) AS INTEGER), count
+            FROM category_totals""",
+        'DROP TABLE category_totals',
+        'ALTER TABLE category_totals_fixed RENAME TO category_totals',
+        """CREATE TABLE category_month_spend_fixed (
+            user_email TEXT NOT NULL,
+            category TEXT NOT NULL,
+            month TEXT NOT NULL,
+            total_minor INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, category, month)
+        )""",
+        f"""INSERT INTO category_month_spend_fixed
+            SELECT user_email, category, month, CAST(ROUND(total * {money.scale()}) AS INTEGER), count
+            FROM category_month_spend""",
+        'DROP TABLE category_month_spend',
+        'ALTER TABLE category_month_spend_fixed RENAME TO category_month_spend',
+        # Segment payloads are re-encoded as they are next rewritten; segments.decode reads both
+        """CREATE TABLE transaction_segments_fixed (
+            user_email TEXT NOT NULL,
+            year TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            min_amount_minor INTEGER NOT NULL,
+            max_amount_minor INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            revision INTEGER NOT NULL,
+            PRIMARY KEY (user_email, year)
+        )""",
+        f"""INSERT INTO transaction_segments_fixed
+            SELECT user_email, year, row_count, first_date, last_date, min_id, max_id,
+                   CAST(ROUND(min_amount * {money.scale()}) AS INTEGER), CAST(ROUND(max_amount * {money.scale()}) AS INTEGER),
+                   payload, revision
+            FROM transaction_segments""",
+        'DROP TABLE transaction_segments',
+        'ALTER TABLE transaction_segments_fixed RENAME TO transaction_segments',
+    ],
+    [
+        # Users whose rows were imported by migrate_from_json(), so a second run skips them.
+        # Users who already have rows got them from the one-time import at first start.
+        'CREATE TABLE IF NOT EXISTS json_imported_users (user_email TEXT PRIMARY KEY)',
+        'INSERT OR IGNORE INTO json_imported_users (user_email) '
+        'SELECT user_email FROM transactions UNION SELECT user_email FROM budgets',
+    ],
+]
+
+# Tables moved into the shards, in copy order
+SHARDED_TABLES = [
+    'transactions', 'budgets', 'user_versions', 'monthly_totals', 'category_totals',
+    'category_month_spend', 'id_counters', 'transaction_events',
+]
+
+def _apply_migrations(conn, migrations):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(migrations):
+        return
+
+    # Take the write lock before re-reading the version so concurrent workers migrate once
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number in range(version, len(migrations)):
+            for statement in migrations[number]:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number + 1}')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def _connect(path, migrations):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+
+    with _schema_lock:
+        if path not in _schema_ready:
+            _apply_migrations(conn, migrations)
+            _schema_ready.add(path)
+    return conn
+
+def _get_connection(path, migrations):
+    # One connection per thread and file; sqlite3 connections must not be shared across threads
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _connect(path, migrations)
+    return conn
+
+def get_db():
+    return _get_connection(DB_FILE, MIGRATIONS)
+
+def shard_for(user_email):
+    digest = hashlib.sha256(user_email.encode()).digest()
+    return int.from_bytes(digest[:4], 'big') % SHARD_COUNT
+
+def shard_path(shard):
+    return os.path.join(SHARD_DIR, f'shard-{shard:03d}.db')
+
+def get_shard_db(user_email):
+    return _get_connection(shard_path(shard_for(user_email)), SHARD_MIGRATIONS)
+
+def _shard_connections():
+    # Every shard that exists on disk; shards are created lazily on a user's first write
+    for shard in range(SHARD_COUNT):
+        path = shard_path(shard)
+        if os.path.exists(path):
+            yield shard, _get_connection(path, SHARD_MIGRATIONS)
+
+class _WriteTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+        self._timed = None
+
+    def __enter__(self):
+        # Waiting for the write lock counts as write time too
+        self._timed = metrics.timed('storage_write')
+        self._timed.__enter__()
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self._timed.__exit__(None, None, None)
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                try:
+                    self.conn.execute('COMMIT')
+                except BaseException:
+                    # A failed COMMIT (SQLITE_BUSY, I/O error) can leave the transaction open, and
+                    # the next write on this thread's connection would fail or join it
+                    if self.conn.in_transaction:
+                        self.conn.execute('ROLLBACK')
+                    raise
+            else:
+                self.conn.execute('ROLLBACK')
+        finally:
+            self._timed.__exit__(None, None, None)
+        return False
+
+def write_transaction(conn=None):
+    return _WriteTransaction(conn or get_db())
+
+def init_db():
+    conn = get_db()
+    with write_transaction(conn):
+        row = conn.execute("SELECT value FROM storage_meta WHERE key = 'shard_count'").fetchone()
+        if row is None:
+            conn.execute("INSERT INTO storage_meta (key, value) VALUES ('shard_count', ?)", (str(SHARD_COUNT),))
+        elif int(row['value']) != SHARD_COUNT:
+            raise RuntimeError(
+                f"SHARD_COUNT is {SHARD_COUNT} but {DB_FILE} was laid out with {row['value']} shards; "
+                f"restore the original SHARD_COUNT"
+            )
+    migrate_to_shards()
+
+def close_db():
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+def checkpoint():
+    # Copy committed WAL pages into the database files and truncate the WALs
+    get_db().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    for _, conn in _shard_connections():
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+# Data versions
+def _bump_version(conn, user_email):
+    conn.execute(
+        'INSERT INTO user_versions (user_email, version) VALUES (?, 1) '
+        'ON CONFLICT(user_email) DO UPDATE SET version = version + 1',
+        (user_email,)
+    )
+
+@metrics.timed('storage_read')
+def get_data_version(user_email):
+    row = get_shard_db(user_email).execute('SELECT version FROM user_versions WHERE user_email = ?', (user_email,)).fetchone()
+    return row[0] if row else 0
+
+def cache_stats():
+    return user_cache.stats()
+
+# Id allocation
+def _allocate_id(conn, user_email, kind):
+    conn.execute(
+        'INSERT INTO id_counters (user_email, kind, last_id) VALUES (?, ?, 1) '
+        'ON CONFLICT(user_email, kind) DO UPDATE SET last_id = last_id + 1',
+        (user_email, kind)
+    )
+    return conn.execute(
+        'SELECT last_id FROM id_counters WHERE user_email = ? AND kind = ?', (user_email, kind)
+    ).fetchone()[0]
+
+def _reserve_id(conn, user_email, kind, wanted_id):
+    # Keep an imported id unless it is already taken, and never let the counter fall behind it
+    if wanted_id is not None:
+        taken = conn.execute(
+            f'SELECT 1 FROM {kind} WHERE user_email = ? AND id = ?', (user_email, wanted_id)
+        ).fetchone()
+        if not taken:
+            conn.execute(
+                'INSERT INTO id_counters (user_email, kind, last_id) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_email, kind) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)',
+                (user_email, kind, wanted_id)
+            )
+            return wanted_id
+    return _allocate_id(conn, user_email, kind)
+
+# Journal
+def _append_event(conn, user_email, event, record, entity='transaction'):
+    conn.execute(
+        'INSERT INTO transaction_events (user_email, entity, event, transaction_id, payload, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (user_email, entity, event, record['id'], json.dumps(record, separators=(',', ':')),
+         datetime.now().isoformat())
+    )
+
+def _note_events_appended(count=1):
+    # Wakes the compactor; processes without one (CLI commands) leave it to compact-journal
+    global _events_since_compaction
+    with _journal_lock:
+        _events_since_compaction += count
+        due = _events_since_compaction >= JOURNAL_COMPACT_EVERY
+        if due:
+            _events_since_compaction = 0
+    if due:
+        _compaction_due.set()
+
+def _run_compactor():
+    while True:
+        _compaction_due.wait()
+        _compaction_due.clear()
+        if _compactor_stopping.is_set():
+            return
+        try:
+            compact_journal()
+        except Exception as e:
+            logger.error(f"Journal compaction failed: {e}")
+
+def ensure_compactor():
+    global _compactor
+    if _compactor is not None and _compactor.is_alive():
+        return
+    with _compactor_lock:
+        if _compactor is None or not _compactor.is_alive():
+            _compactor_stopping.clear()
+            _compactor = threading.Thread(target=_run_compactor, name='journal-compactor', daemon=True)
+            _compactor.start()
+
+def stop_compactor(timeout=10):
+    _compactor_stopping.set()
+    _compaction_due.set()
+    if _compactor is not None:
+        _compactor.join(timeout)
+
+@metrics.timed('storage_read')
+def get_events(user_email, after_seq=0, limit=500):
+    rows = get_shard_db(user_email).execute(
+        'SELECT seq, entity, event, transaction_id, payload, created_at FROM transaction_events '
+        'WHERE user_email = ? AND seq > ? ORDER BY seq LIMIT ?',
+        (user_email, after_seq, limit)
+    ).fetchall()
+    return [{
+        'seq': row['seq'],
+        'entity': row['entity'],
+        'event': row['event'],
+        'id': row['transaction_id'],
+        'record': json.loads(row['payload']) if row['payload'] else None,
+        'created_at': row['created_at']
+    } for row in rows]
+
+@metrics.timed('storage_read')
+def latest_event_seq(user_email):
+    row = get_shard_db(user_email).execute(
+        'SELECT MAX(seq) FROM transaction_events WHERE user_email = ?', (user_email,)
+    ).fetchone()
+    return row[0] or 0
+
+@metrics.timed('storage_read')
+def events_compacted_after(user_email, after_seq):
+    # True when compaction may have removed events newer than after_seq, so replay would miss changes.
+    # Sequence numbers are per shard, which is fine: each user's events all live in one shard.
+    conn = get_shard_db(user_email)
+    oldest = conn.execute('SELECT MIN(seq) FROM transaction_events').fetchone()[0]
+    if oldest is not None:
+        return oldest > after_seq + 1
+    issued = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transaction_events'").fetchone()
+    return issued is not None and issued[0] > after_seq
+
+def compact_journal(retention_days=None):
+    # The transactions table is the snapshot; only recent events are kept for replay
+    if retention_days is None:
+        retention_days = JOURNAL_RETENTION_DAYS
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+
+    removed = 0
+    for _, conn in _shard_connections():
+        with write_transaction(conn):
+            removed += conn.execute('DELETE FROM transaction_events WHERE created_at < ?', (cutoff,)).rowcount
+    checkpoint()
+    logger.info(f"Compacted journal: removed {removed} events older than {cutoff}")
+    return removed
+
+# Users
+def _user_from_row(row):
+    return {
+        'name': row['name'],
+        'email': row['email'],
+        'phone': row['phone'],
+        'password': row['password'],
+        'created_at': row['created_at']
+    }
+
+@metrics.timed('storage_read')
+def get_user(email):
+    row = get_db().execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+    return _user_from_row(row) if row else None
+
+def create_user(user):
+    try:
+        with write_transaction() as conn:
+            conn.execute(
+                'INSERT INTO users (email, name, phone, password, created_at) VALUES (?, ?, ?, ?, ?)',
+                (user['email'], user['name'], user.get('phone'), user.get('password'), user.get('created_at'))
+            )
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def update_user_password(email, password_hash):
+    with write_transaction() as conn:
+        cursor = conn.execute('UPDATE users SET password = ? WHERE email = ?', (password_hash, email))
+    return cursor.rowcount > 0
+
+# Transactions
+def _transaction_from_row(row):
+    return {
+        'id': row['id'],
+        'type': row['type'],
+        'amount': money.to_major(row['amount_minor'], row['currency']),
+        'category': row['category'],
+        'description': row['description'],
+        'date': row['date']
+    }
+
+# Cached lists are shared between requests and must be treated as read-only
+@metrics.timed('storage_read')
+def get_transactions(user_email):
+    # Read the version first so a concurrent write can only make the cache entry look stale
+    version = get_data_version(user_email)
+    transactions = user_cache.get(user_email, 'transactions', version)
+    if transactions is not None:
+        return transactions
+
+    conn = get_shard_db(user_email)
+    rows = conn.execute('SELECT * FROM transactions WHERE user_email = ? ORDER BY id', (user_email,)).fetchall()
+    transactions = [_transaction_from_row(row) for row in rows]
+    # The full list is the whole history, archived years included
+    archived = list(_iter_archived(conn, user_email))
+    if archived:
+        transactions = sorted(archived + transactions, key=lambda t: t['id'])
+    user_cache.put(user_email, 'transactions', version, transactions)
+    return transactions
+
+# Sort orders for query_transactions: (column, direction)
+TRANSACTION_SORTS = {
+    'date_desc': ('date', 'DESC'),
+    'date_asc': ('date', 'ASC'),
+    'amount_desc': ('amount', 'DESC'),
+    'amount_asc': ('amount', 'ASC'),
+}
+# Where a sort or filter field lives in the transactions table
+SORT_COLUMNS = {'date': 'date', 'amount': 'amount_minor'}
+
+@metrics.timed('storage_read')
+def query_transactions(user_email, filters=None, sort='date_desc', limit=50, after=None):
+    # Keyset pagination: 'after' is the (sort value, id) of the last row of the previous page
+    filters = filters or {}
+    column, direction = TRANSACTION_SORTS[sort]
+    clauses = ['user_email = ?']
+    params = [user_email]
+
+    if filters.get('start_date'):
+        clauses.append('date >= ?')
+        params.append(filters['start_date'])
+    if filters.get('end_date'):
+        clauses.append('date <= ?')
+        params.append(filters['end_date'])
+    if filters.get('type'):
+        clauses.append('type = ?')
+        params.append(filters['type'])
+    if filters.get('category'):
+        clauses.append('category = ?')
+        params.append(filters['category'])
+    if filters.get('min_amount') is not None:
+        clauses.append('amount_minor >= ?')
+        params.append(money.to_minor(filters['min_amount'], rounding=money.ROUND_CEILING))
+    if filters.get('max_amount') is not None:
+        clauses.append('amount_minor <= ?')
+        params.append(money.to_minor(filters['max_amount'], rounding=money.ROUND_FLOOR))
+    if filters.get('search'):
+        escaped = filters['search'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("description LIKE ? ESCAPE '\\'")
+        params.append(f'%{escaped}%')
+
+    sql_column = SORT_COLUMNS[column]
+    key = None
+    if after is not None:
+        # Cursors carry the amount as the API shows it
+        key = (money.to_minor(after[0]) if column == 'amount' else after[0], after[1])
+
+    conn = get_shard_db(user_email)
+    rows = []
+    for clause, clause_params in _keyset_parts(sql_column, direction, key, nullable=column == 'date'):
+        sql = (f"SELECT * FROM transactions WHERE {' AND '.join(clauses + [clause] if clause else clauses)} "
+               f"ORDER BY {sql_column} {direction}, id {direction} LIMIT ?")
+        rows.extend(conn.execute(sql, params + clause_params + [limit + 1 - len(rows)]).fetchall())
+        if len(rows) > limit:
+            break
+    page = [_transaction_from_row(row) for row in rows]
+    archived = _archived_page(conn, user_email, filters, column, direction, limit, after, page)
+    if archived:
+        page = sorted(page + archived, key=_sort_key(column), reverse=direction == 'DESC')[:limit + 1]
+
+    next_key = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_key = (last[column], last['id'])
+    return page, next_key
+
+def _keyset_parts(sql_column, direction, key, nullable):
+    # query_transactions' keyset condition as [(clause, params)], queried in order until the
+    # page fills. A row comparison with NULL is never true, so NULL values (sorted first, the
+    # way SQLite orders them) are paged by id in a part of their own; an OR in one query would
+    # stop SQLite from seeking the index to the cursor.
+    comparison = '<' if direction == 'DESC' else '>'
+    if key is None:
+        after_values = [(f'{sql_column} IS NOT NULL' if nullable else None, [])]
+        after_nulls = [(f'{sql_column} IS NULL', [])] if nullable else []
+    elif key[0] is not None:
+        after_values = [(f'({sql_column}, id) {comparison} (?, ?)', list(key))]
+        # Descending, the NULLs are still to come; ascending, they were all on earlier pages
+        after_nulls = [(f'{sql_column} IS NULL', [])] if nullable and direction == 'DESC' else []
+    else:
+        after_values = [] if direction == 'DESC' else [(f'{sql_column} IS NOT NULL', [])]
+        after_nulls = [(f'{sql_column} IS NULL AND id {comparison} ?', [key[1]])]
+    if direction == 'DESC':
+        return after_values + after_nulls
+    return after_nulls + after_values
+
+def _sort_key(column):
+    # (column, id) with NULLs first, the way SQLite orders them
+    return lambda t: (t[column] is not None, t[column], t['id'])
+
+def _archived_filter(filters, column, direction, after):
+    # query_transactions' WHERE clause for archived rows, as one predicate built from only the
+    # conditions in play; None when every row matches
+    checks = []
+    if filters.get('start_date'):
+        checks.append(lambda t, v=filters['start_date']: t['date'] >= v)
+    if filters.get('end_date'):
+        checks.append(lambda t, v=filters['end_date']: t['date'] <= v)
+    if filters.get('type'):
+        checks.append(lambda t, v=filters['type']: t['type'] == v)
+    if filters.get('category'):
+        checks.append(lambda t, v=filters['category']: t['category'] == v)
+    if filters.get('min_amount') is not None:
+        checks.append(lambda t, v=filters['min_amount']: t['amount'] >= v)
+    if filters.get('max_amount') is not None:
+        checks.append(lambda t, v=filters['max_amount']: t['amount'] <= v)
+    if filters.get('search'):
+        checks.append(lambda t, v=filters['search'].lower(): v in (t['description'] or '').lower())
+    if after is not None:
+        # Compared the way rows are sorted, so a cursor left on a NULL date still works
+        key = _sort_key(column)
+        bound = (after[0] is not None, after[0], after[1])
+        if direction == 'DESC':
+            checks.append(lambda t: key(t) < bound)
+        else:
+            checks.append(lambda t: key(t) > bound)
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    return lambda t: all(check(t) for check in checks)
+
+def _archived_page(conn, user_email, filters, column, direction, limit, after, hot_rows):
+    # Archived rows that belong on the page. Segments are ruled out from their date and amount
+    # ranges first, so a recent page (the dashboard's) never decodes one.
+    meta = _segment_meta(conn, user_email)
+    if not meta:
+        return []
+    low, high = ('first_date', 'last_date') if column == 'date' else ('min_amount_minor', 'max_amount_minor')
+    descending = direction == 'DESC'
+    # An archived row has to sort after the cursor and, once the live rows fill the page,
+    # ahead of the last of them. Archived rows always have a date, so a NULL bound (NULLs sort
+    # first) either rules out every segment or none.
+    first, last = None, None
+    if after is not None:
+        if after[0] is None and descending:
+            return []
+        first = after[0]
+    if len(hot_rows) > limit:
+        if hot_rows[limit][column] is None and not descending:
+            return []
+        last = hot_rows[limit][column]
+    if column == 'amount':
+        first = None if first is None else money.to_minor(first)
+        last = None if last is None else money.to_minor(last)
+    min_amount = filters.get('min_amount')
+    max_amount = filters.get('max_amount')
+
+    matches = []
+    predicate = _archived_filter(filters, column, direction, after)
+    for segment in meta:
+        if filters.get('start_date') and segment['last_date'] < filters['start_date']:
+            continue
+        if filters.get('end_date') and segment['first_date'] > filters['end_date']:
+            continue
+        if min_amount is not None and segment['max_amount_minor'] < money.to_minor(min_amount, rounding=money.ROUND_CEILING):
+            continue
+        if max_amount is not None and segment['min_amount_minor'] > money.to_minor(max_amount, rounding=money.ROUND_FLOOR):
+            continue
+        if descending and ((first is not None and segment[low] > first) or (last is not None and segment[high] < last)):
+            continue
+        if not descending and ((first is not None and segment[high] < first) or (last is not None and segment[low] > last)):
+            continue
+        rows = _segment_rows(conn, user_email, segment)
+        matches.extend(rows if predicate is None else filter(predicate, rows))
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    return pick(limit + 1, matches, key=_sort_key(column))
+
+def _insert_transaction(conn, user_email, transaction):
+    next_id = _allocate_id(conn, user_email, 'transactions')
+    amount_minor = money.to_minor(transaction['amount'])
+    transaction = dict(transaction, id=next_id, amount=money.to_major(amount_minor))
+    conn.execute(
+        'INSERT INTO transactions (user_email, id, type, amount_minor, currency, category, description, date) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (user_email, next_id, transaction.get('type'), amount_minor, money.CURRENCY,
+         transaction.get('category'), transaction.get('description'), transaction.get('date'))
+    )
+    _apply_aggregate_delta(conn, user_email, transaction, 1)
+    _index_transaction(conn, user_email, transaction, 1)
+    _append_event(conn, user_email, 'add', transaction)
+    return transaction
+
+def add_transaction(user_email, transaction):
+    with write_transaction(get_shard_db(user_email)) as conn:
+        transaction = _insert_transaction(conn, user_email, transaction)
+        _bump_version(conn, user_email)
+    user_cache.invalidate(user_email)
+    change_feed.publish(user_email)
+    _note_events_appended()
+    return transaction
+
+def add_transactions(user_email, transactions):
+    # Batch insert: one write transaction and one version bump for the whole batch
+    if not transactions:
+        return []
+    with write_transaction(get_shard_db(user_email)) as conn:
+        stored = [_insert_transaction(conn, user_email, t) for t in transactions]
+        _bump_version(conn, user_email)
+    user_cache.invalidate(user_email)
+    change_feed.publish(user_email)
+    _note_events_appended(len(stored))
+    return stored
+
+@metrics.timed('storage_read')
+def fetch_transaction_columns(user_email, include_archived=False):
+    # (date, type, amount in minor units, category) tuples
+    cursor = get_shard_db(user_email).cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        'SELECT date, type, amount_minor, category FROM transactions WHERE user_email = ?', (user_email,)
+    ).fetchall()
+    if include_archived:
+        for (payload,) in cursor.execute(
+            'SELECT payload FROM transaction_segments WHERE user_email = ? ORDER BY year', (user_email,)
+        ).fetchall():
+            rows.extend(segments.columns(payload))
+    return rows
+
+def iter_transactions(user_email, batch_size=500):
+    # Archived years first, a segment at a time, then the live rows in id order without
+    # holding a read transaction open between batches
+    conn = get_shard_db(user_email)
+    yield from _iter_archived(conn, user_email)
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT * FROM transactions WHERE user_email = ? AND id > ? ORDER BY id LIMIT ?',
+            (user_email, last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield _transaction_from_row(row)
+        last_id = rows[-1]['id']
+
+@metrics.timed('storage_read')
+def labeled_transactions(user_email):
+    # (journal seq, [(type, category, description)]) for rows that have a category, read from one
+    # snapshot: replaying the journal after seq then applies exactly the writes the rows miss
+    conn = get_shard_db(user_email)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute('BEGIN')
+    try:
+        issued = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transaction_events'").fetchone()
+        rows = cursor.execute(
+            "SELECT type, category, description FROM transactions "
+            "WHERE user_email = ? AND category IS NOT NULL AND category != ''",
+            (user_email,)
+        ).fetchall()
+        rows.extend((t['type'], t['category'], t['description'])
+                    for t in _iter_archived(conn, user_email) if t['category'])
+    finally:
+        cursor.execute('COMMIT')
+    return (issued[0] if issued else 0), rows
+
+def delete_transaction(user_email, transaction_id):
+    with write_transaction(get_shard_db(user_email)) as conn:
+        row = conn.execute(
+            'SELECT * FROM transactions WHERE user_email = ? AND id = ?', (user_email, transaction_id)
+        ).fetchone()
+        if row is not None:
+            transaction = _transaction_from_row(row)
+            conn.execute('DELETE FROM transactions WHERE user_email = ? AND id = ?', (user_email, transaction_id))
+        else:
+            transaction = _delete_archived(conn, user_email, transaction_id)
+            if transaction is None:
+                return False
+
+        _apply_aggregate_delta(conn, user_email, transaction, -1)
+        _index_transaction(conn, user_email, transaction, -1)
+        _append_event(conn, user_email, 'delete', transaction)
+        _bump_version(conn, user_email)
+    user_cache.invalidate(user_email)
+    change_feed.publish(user_email)
+    _note_events_appended()
+    return True
+
+# Archive
+ARCHIVABLE_DATE = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+SEGMENT_SUMMARY_COLUMNS = ('row_count', 'first_date', 'last_date', 'min_id', 'max_id', 'min_amount_minor', 'max_amount_minor')
+
+def _segment_meta(conn, user_email):
+    return conn.execute(
+        f"SELECT year, revision, {', '.join(SEGMENT_SUMMARY_COLUMNS)} FROM transaction_segments "
+        f"WHERE user_email = ? ORDER BY year",
+        (user_email,)
+    ).fetchall()
+
+def _read_segment(conn, user_email, year):
+    row = conn.execute(
+        'SELECT payload FROM transaction_segments WHERE user_email = ? AND year = ?', (user_email, year)
+    ).fetchone()
+    return segments.decode(row[0]) if row else []
+
+def _segment_rows(conn, user_email, segment):
+    # segment is a _segment_meta() row; cached rows are shared and must be treated as read-only
+    key = (user_email, segment['year'])
+    transactions = segment_cache.get(key, 'rows', segment['revision'])
+    if transactions is None:
+        transactions = _read_segment(conn, user_email, segment['year'])
+        segment_cache.put(key, 'rows', segment['revision'], transactions)
+    return transactions
+
+def _iter_archived(conn, user_email):
+    # Every archived transaction, oldest year first, through segment_cache so the full-history
+    # paths do not decode every segment again after each write; the rows are read-only
+    for segment in _segment_meta(conn, user_email):
+        yield from _segment_rows(conn, user_email, segment)
+
+def _write_segment(conn, user_email, year, transactions):
+    if not transactions:
+        conn.execute('DELETE FROM transaction_segments WHERE user_email = ? AND year = ?', (user_email, year))
+        return
+    transactions = sorted(transactions, key=lambda t: (t['date'], t['id']))
+    summary = segments.summarize(transactions)
+    conn.execute(
+        f"INSERT OR REPLACE INTO transaction_segments (user_email, year, {', '.join(SEGMENT_SUMMARY_COLUMNS)}, "
+        f"payload, revision) VALUES (?, ?, {', '.join('?' for _ in SEGMENT_SUMMARY_COLUMNS)}, ?, ?)",
+        [user_email, year] + [summary[column] for column in SEGMENT_SUMMARY_COLUMNS]
+        + [segments.encode(transactions), int.from_bytes(os.urandom(7), 'big')]
+    )
+
+def _delete_archived(conn, user_email, transaction_id):
+    # Rewrites the segment holding the transaction; returns the removed transaction or None
+    for (year,) in conn.execute(
+        'SELECT year FROM transaction_segments WHERE user_email = ? AND min_id <= ? AND max_id >= ?',
+        (user_email, transaction_id, transaction_id)
+    ).fetchall():
+        transactions = _read_segment(conn, user_email, year)
+        for i, transaction in enumerate(transactions):
+            if transaction['id'] == transaction_id:
+                _write_segment(conn, user_email, year, transactions[:i] + transactions[i + 1:])
+                return transaction
+    return None
+
+@metrics.timed('storage_read')
+def archived_through(user_email):
+    # Date of the newest archived transaction, or None when nothing is archived
+    return get_shard_db(user_email).execute(
+        'SELECT MAX(last_date) FROM transaction_segments WHERE user_email = ?', (user_email,)
+    ).fetchone()[0]
+
+def archive_cutoff(keep_years=None, today=None):
+    # First day that stays live: January 1st, keep_years - 1 years before this one
+    if keep_years is None:
+        keep_years = ARCHIVE_KEEP_YEARS
+    year = (today or datetime.now()).year - max(keep_years, 1) + 1
+    return f'{year:04d}-01-01'
+
+def archive_transactions(before, user_email=None):
+    # Move rows dated before `before` (YYYY-MM-DD) into their year's segment; returns the number
+    # moved. Totals, search postings and ids are left alone: the rows only change where they live.
+    if user_email is not None:
+        targets = [(get_shard_db(user_email), [user_email])]
+    else:
+        targets = [(conn, [row[0] for row in conn.execute(
+                        'SELECT DISTINCT user_email FROM transactions WHERE date < ?', (before,))])
+                   for _, conn in _shard_connections()]
+
+    moved = 0
+    for conn, emails in targets:
+        for email in emails:
+            with write_transaction(conn):
+                rows = conn.execute(
+                    'SELECT * FROM transactions WHERE user_email = ? AND date < ? AND date GLOB ?',
+                    (email, before, ARCHIVABLE_DATE)
+                ).fetchall()
+                by_year = {}
+                for row in rows:
+                    by_year.setdefault(row['date'][:4], []).append(_transaction_from_row(row))
+                for year, transactions in by_year.items():
+                    _write_segment(conn, email, year, _read_segment(conn, email, year) + transactions)
+                conn.executemany(
+                    'DELETE FROM transactions WHERE user_email = ? AND id = ?', [(email, row['id']) for row in rows]
+                )
+                if rows:
+                    _bump_version(conn, email)
+            user_cache.invalidate(email)
+            moved += len(rows)
+    return moved
+
+# Search index
+SEARCH_TOKEN = re.compile(r'\w+')
+MAX_TERM_LENGTH = 40
+# Category matches rank above the same word in a description
+CATEGORY_WEIGHT = 2
+
+def search_tokens(text):
+    # Lower-cased words with accents folded, so "Café" and "cafe" are the same term
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in SEARCH_TOKEN.findall(text) if len(token) <= MAX_TERM_LENGTH]
+
+def _search_weights(transaction):
+    weights = {}
+    for token in search_tokens(transaction.get('description')):
+        weights[token] = weights.get(token, 0) + 1
+    for token in search_tokens(transaction.get('category')):
+        weights[token] = weights.get(token, 0) + CATEGORY_WEIGHT
+    return weights
+
+def _index_transaction(conn, user_email, transaction, sign):
+    # sign is 1 to add the transaction's terms and -1 to remove them
+    weights = _search_weights(transaction)
+    if not weights:
+        return
+    if sign > 0:
+        conn.executemany(
+            'INSERT OR REPLACE INTO search_postings (user_email, term, transaction_id, weight) VALUES (?, ?, ?, ?)',
+            [(user_email, term, transaction['id'], weight) for term, weight in weights.items()]
+        )
+        conn.executemany(
+            'INSERT INTO search_terms (user_email, term, doc_count) VALUES (?, ?, 1) '
+            'ON CONFLICT (user_email, term) DO UPDATE SET doc_count = doc_count + 1',
+            [(user_email, term) for term in weights]
+        )
+    else:
+        conn.executemany(
+            'DELETE FROM search_postings WHERE user_email = ? AND term = ? AND transaction_id = ?',
+            [(user_email, term, transaction['id']) for term in weights]
+        )
+        conn.executemany(
+            'UPDATE search_terms SET doc_count = doc_count - 1 WHERE user_email = ? AND term = ?',
+            [(user_email, term) for term in weights]
+        )
+        conn.executemany(
+            'DELETE FROM search_terms WHERE user_email = ? AND term = ? AND doc_count <= 0',
+            [(user_email, term) for term in weights]
+        )
+
+def ensure_search_index(user_email):
+    # Index rows written before the search index existed (or copied in by a migration)
+    conn = get_shard_db(user_email)
+    if not conn.execute('SELECT 1 FROM search_backfill WHERE user_email = ?', (user_email,)).fetchone():
+        return False
+    with write_transaction(conn):
+        if not conn.execute('SELECT 1 FROM search_backfill WHERE user_email = ?', (user_email,)).fetchone():
+            return False
+        _rebuild_user_search(conn, user_email)
+        conn.execute('DELETE FROM search_backfill WHERE user_email = ?', (user_email,))
+    return True
+
+def _rebuild_user_search(conn, user_email):
+    conn.execute('DELETE FROM search_postings WHERE user_email = ?', (user_email,))
+    conn.execute('DELETE FROM search_terms WHERE user_email = ?', (user_email,))
+    for row in conn.execute(
+        'SELECT id, category, description FROM transactions WHERE user_email = ?', (user_email,)
+    ).fetchall():
+        _index_transaction(conn, user_email, dict(row), 1)
+    for transaction in _iter_archived(conn, user_email):
+        _index_transaction(conn, user_email, transaction, 1)
+
+def rebuild_search_index(user_email=None):
+    # Returns the number of users reindexed
+    if user_email is not None:
+        targets = [(get_shard_db(user_email), [user_email])]
+    else:
+        targets = [(conn, [row[0] for row in conn.execute(
+                        'SELECT user_email FROM transactions UNION SELECT user_email FROM transaction_segments')])
+                   for _, conn in _shard_connections()]
+    rebuilt = 0
+    for conn, emails in targets:
+        for email in emails:
+            with write_transaction(conn):
+                _rebuild_user_search(conn, email)
+                conn.execute('DELETE FROM search_backfill WHERE user_email = ?', (email,))
+            rebuilt += 1
+    return rebuilt
+
+@metrics.timed('storage_read')
+def search_vocabulary(user_email, prefix, limit=None):
+    # (term, doc_count) for the user's terms starting with prefix, most frequent first
+    sql = ('SELECT term, doc_count FROM search_terms WHERE user_email = ? AND term >= ? AND term < ? '
+           'ORDER BY doc_count DESC, term')
+    params = [user_email, prefix, prefix + '\U0010ffff']
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return [(row[0], row[1]) for row in get_shard_db(user_email).execute(sql, params)]
+
+@metrics.timed('storage_read')
+def search_postings(user_email, term):
+    # (transaction_id, weight) for every transaction containing the term, as plain tuples
+    # since a common term can have a posting for most of the user's rows
+    cursor = get_shard_db(user_email).cursor()
+    cursor.row_factory = None
+    return cursor.execute(
+        'SELECT transaction_id, weight FROM search_postings WHERE user_email = ? AND term = ?', (user_email, term)
+    ).fetchall()
+
+@metrics.timed('storage_read')
+def count_transactions(user_email):
+    row = get_shard_db(user_email).execute(
+        'SELECT SUM(count) FROM monthly_totals WHERE user_email = ?', (user_email,)
+    ).fetchone()
+    return row[0] or 0
+
+@metrics.timed('storage_read')
+def get_transactions_by_ids(user_email, transaction_ids):
+    # Rows in the order of transaction_ids; ids that no longer exist are skipped
+    if not transaction_ids:
+        return []
+    conn = get_shard_db(user_email)
+    placeholders = ', '.join('?' for _ in transaction_ids)
+    rows = conn.execute(
+        f'SELECT * FROM transactions WHERE user_email = ? AND id IN ({placeholders})',
+        [user_email] + list(transaction_ids)
+    ).fetchall()
+    by_id = {row['id']: _transaction_from_row(row) for row in rows}
+
+    # Ids not among the live rows may be archived; only segments whose id range covers one are read
+    missing = set(transaction_ids) - set(by_id)
+    if missing:
+        for segment in _segment_meta(conn, user_email):
+            if any(segment['min_id'] <= i <= segment['max_id'] for i in missing):
+                for t in _segment_rows(conn, user_email, segment):
+                    if t['id'] in missing:
+                        by_id[t['id']] = t
+    return [by_id[i] for i in transaction_ids if i in by_id]
+
+# Aggregates
+def _apply_aggregate_delta(conn, user_email, transaction, sign):
+    month = (transaction.get('date') or '')[:7]
+    kind = transaction.get('type') or ''
+    amount = money.to_minor(transaction['amount']) * sign
+
+    conn.execute(
+        'INSERT INTO monthly_totals (user_email, month, type, total_minor, count) VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT(user_email, month, type) DO UPDATE SET total_minor = total_minor + excluded.total_minor, '
+        'count = count + excluded.count',
+        (user_email, month, kind, amount, sign)
+    )
+    conn.execute(
+        'DELETE FROM monthly_totals WHERE user_email = ? AND month = ? AND type = ? AND count <= 0',
+        (user_email, month, kind)
+    )
+
+    if kind == 'expense':
+        category = transaction.get('category') or ''
+        conn.execute(
+            'INSERT INTO category_totals (user_email, category, total_minor, count) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(user_email, category) DO UPDATE SET total_minor = total_minor + excluded.total_minor, '
+            'count = count + excluded.count',
+            (user_email, category, amount, sign)
+        )
+        conn.execute(
+            'DELETE FROM category_totals WHERE user_email = ? AND category = ? AND count <= 0',
+            (user_email, category)
+        )
+        conn.execute(
+            'INSERT INTO category_month_spend (user_email, category, month, total_minor, count) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(user_email, category, month) DO UPDATE SET total_minor = total_minor + excluded.total_minor, '
+            'count = count + excluded.count',
+            (user_email, category, month, amount, sign)
+        )
+        conn.execute(
+            'DELETE FROM category_month_spend WHERE user_email = ? AND category = ? AND month = ? AND count <= 0',
+            (user_email, category, month)
+        )
+
+@metrics.timed('storage_read')
+def get_aggregates(user_email):
+    version = get_data_version(user_email)
+    aggregates = user_cache.get(user_email, 'aggregates', version)
+    if aggregates is not None:
+        return aggregates
+
+    # Summed in minor units, so every total is exact; converted once at the end
+    conn = get_shard_db(user_email)
+    income = expenses = 0
+    transaction_count = 0
+    monthly = {}
+    for row in conn.execute(
+        'SELECT month, type, total_minor, count FROM monthly_totals WHERE user_email = ? ORDER BY month', (user_email,)
+    ):
+        transaction_count += row['count']
+        # Monthly trends count every non-income row as spending, the totals only 'expense' rows
+        month = monthly.setdefault(row['month'], {'income': 0, 'expenses': 0})
+        if row['type'] == 'income':
+            income += row['total_minor']
+            month['income'] += row['total_minor']
+        else:
+            month['expenses'] += row['total_minor']
+            if row['type'] == 'expense':
+                expenses += row['total_minor']
+
+    categories = {
+        row['category']: money.to_major(row['total_minor'])
+        for row in conn.execute(
+            'SELECT category, total_minor FROM category_totals WHERE user_email = ? ORDER BY category', (user_email,)
+        )
+    }
+
+    aggregates = {
+        'income': money.to_major(income),
+        'expenses': money.to_major(expenses),
+        'balance': money.to_major(income - expenses),
+        'transaction_count': transaction_count,
+        'categories': categories,
+        'monthly': {
+            key: {'income': money.to_major(month['income']), 'expenses': money.to_major(month['expenses'])}
+            for key, month in monthly.items()
+        }
+    }
+    user_cache.put(user_email, 'aggregates', version, aggregates)
+    return aggregates
+
+def _snapshot_aggregates(conn, user_email):
+    monthly = conn.execute(
+        'SELECT month, type, total_minor, count FROM monthly_totals WHERE user_email = ? ORDER BY 1, 2',
+        (user_email,)
+    ).fetchall()
+    categories = conn.execute(
+        'SELECT category, total_minor, count FROM category_totals WHERE user_email = ? ORDER BY 1',
+        (user_email,)
+    ).fetchall()
+    category_months = conn.execute(
+        'SELECT category, month, total_minor, count FROM category_month_spend WHERE user_email = ? ORDER BY 1, 2',
+        (user_email,)
+    ).fetchall()
+    return [tuple(r) for r in monthly], [tuple(r) for r in categories], [tuple(r) for r in category_months]
+
+def _rebuild_user_aggregates(conn, user_email):
+    conn.execute('DELETE FROM monthly_totals WHERE user_email = ?', (user_email,))
+    conn.execute('DELETE FROM category_totals WHERE user_email = ?', (user_email,))
+    conn.execute('DELETE FROM category_month_spend WHERE user_email = ?', (user_email,))
+    conn.execute(
+        "INSERT INTO monthly_totals (user_email, month, type, total_minor, count) "
+        "SELECT user_email, COALESCE(substr(date, 1, 7), ''), COALESCE(type, ''), SUM(amount_minor), COUNT(*) "
+        "FROM transactions WHERE user_email = ? GROUP BY 1, 2, 3",
+        (user_email,)
+    )
+    conn.execute(
+        "INSERT INTO category_totals (user_email, category, total_minor, count) "
+        "SELECT user_email, COALESCE(category, ''), SUM(amount_minor), COUNT(*) "
+        "FROM transactions WHERE user_email = ? AND type = 'expense' GROUP BY 1, 2",
+        (user_email,)
+    )
+    conn.execute(
+        "INSERT INTO category_month_spend (user_email, category, month, total_minor, count) "
+        "SELECT user_email, COALESCE(category, ''), COALESCE(substr(date, 1, 7), ''), SUM(amount_minor), COUNT(*) "
+        "FROM transactions WHERE user_email = ? AND type = 'expense' GROUP BY 1, 2, 3",
+        (user_email,)
+    )
+    for transaction in _iter_archived(conn, user_email):
+        _apply_aggregate_delta(conn, user_email, transaction, 1)
+
+def rebuild_aggregates(user_email=None):
+    # Recompute running totals from raw transactions; returns the users whose totals had drifted
+    if user_email:
+        targets = [(get_shard_db(user_email), user_email)]
+    else:
+        targets = [
+            (conn, row[0])
+            for _, conn in _shard_connections()
+            for row in conn.execute(
+                'SELECT user_email FROM transactions UNION SELECT user_email FROM monthly_totals '
+                'UNION SELECT user_email FROM category_totals'
+            ).fetchall()
+        ]
+
+    drifted = []
+    for conn, email in targets:
+        with write_transaction(conn):
+            before = _snapshot_aggregates(conn, email)
+            _rebuild_user_aggregates(conn, email)
+            if _snapshot_aggregates(conn, email) != before:
+                drifted.append(email)
+                _bump_version(conn, email)
+        user_cache.invalidate(email)
+    return drifted
+
+# Budgets
+def _budget_from_row(row):
+    return {
+        'id': row['id'],
+        'category': row['category'],
+        'limit': money.to_major(row['limit_minor']),
+        'month': row['month']
+    }
+
+@metrics.timed('storage_read')
+def get_budgets(user_email):
+    version = get_data_version(user_email)
+    budgets = user_cache.get(user_email, 'budgets', version)
+    if budgets is not None:
+        return budgets
+
+    rows = get_shard_db(user_email).execute(
+        'SELECT * FROM budgets WHERE user_email = ? ORDER BY id', (user_email,)
+    ).fetchall()
+    budgets = [_budget_from_row(row) for row in rows]
+    user_cache.put(user_email, 'budgets', version, budgets)
+    return budgets
+
+@metrics.timed('storage_read')
+def get_budget_status(user_email):
+    version = get_data_version(user_email)
+    status = user_cache.get(user_email, 'budget_status', version)
+    if status is not None:
+        return status
+
+    rows = get_shard_db(user_email).execute(
+        'SELECT b.*, COALESCE(s.total_minor, 0) AS spent_minor FROM budgets b '
+        'LEFT JOIN category_month_spend s ON s.user_email = b.user_email '
+        "AND s.category = COALESCE(b.category, '') AND s.month = COALESCE(b.month, '') "
+        'WHERE b.user_email = ? ORDER BY b.id',
+        (user_email,)
+    ).fetchall()
+
+    status = []
+    for row in rows:
+        budget = _budget_from_row(row)
+        limit, spent = row['limit_minor'], row['spent_minor']
+        budget.update({
+            'spent': money.to_major(spent),
+            'remaining': money.to_major(limit - spent),
+            'percent_used': (spent / limit) * 100 if limit > 0 else 0
+        })
+        status.append(budget)
+    user_cache.put(user_email, 'budget_status', version, status)
+    return status
+
+def _insert_budget(conn, user_email, budget):
+    next_id = _allocate_id(conn, user_email, 'budgets')
+    limit_minor = money.to_minor(budget['limit'])
+    budget = dict(budget, id=next_id, limit=money.to_major(limit_minor))
+    conn.execute(
+        'INSERT INTO budgets (user_email, id, category, limit_minor, month) VALUES (?, ?, ?, ?, ?)',
+        (user_email, next_id, budget.get('category'), limit_minor, budget.get('month'))
+    )
+    _append_event(conn, user_email, 'add', budget, entity='budget')
+    return budget
+
+def add_budget(user_email, budget):
+    with write_transaction(get_shard_db(user_email)) as conn:
+        budget = _insert_budget(conn, user_email, budget)
+        _bump_version(conn, user_email)
+    user_cache.invalidate(user_email)
+    change_feed.publish(user_email)
+    _note_events_appended()
+    return budget
+
+def delete_budget(user_email, budget_id):
+    with write_transaction(get_shard_db(user_email)) as conn:
+        row = conn.execute(
+            'SELECT * FROM budgets WHERE user_email = ? AND id = ?', (user_email, budget_id)
+        ).fetchone()
+        if row is None:
+            return False
+
+        conn.execute('DELETE FROM budgets WHERE user_email = ? AND id = ?', (user_email, budget_id))
+        _append_event(conn, user_email, 'delete', _budget_from_row(row), entity='budget')
+        _bump_version(conn, user_email)
+    user_cache.invalidate(user_email)
+    change_feed.publish(user_email)
+    _note_events_appended()
+    return True
+
+# Recurring templates
+def _recurring_from_row(row):
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'template': json.loads(row['template']),
+        'frequency': row['frequency'],
+        'unit': row['unit'],
+        'interval': row['interval'],
+        'start_date': row['start_date'],
+        'end_date': row['end_date'],
+        'next_due': row['next_due'],
+        'occurrences': row['occurrences'],
+        'created_at': row['created_at']
+    }
+
+def add_recurring_rule(user_email, rule):
+    with write_transaction(get_shard_db(user_email)) as conn:
+        next_id = _allocate_id(conn, user_email, 'recurring')
+        rule = dict(rule, id=next_id, next_due=rule['start_date'], occurrences=0,
+                    created_at=datetime.now().isoformat())
+        conn.execute(
+            'INSERT INTO recurring_rules (user_email, id, kind, template, frequency, unit, interval, '
+            'start_date, end_date, next_due, occurrences, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (user_email, next_id, rule['kind'], json.dumps(rule['template']), rule['frequency'], rule['unit'],
+             rule['interval'], rule['start_date'], rule.get('end_date'), rule['next_due'], 0, rule['created_at'])
+        )
+    return rule
+
+@metrics.timed('storage_read')
+def get_recurring_rules(user_email):
+    rows = get_shard_db(user_email).execute(
+        'SELECT * FROM recurring_rules WHERE user_email = ? ORDER BY id', (user_email,)
+    ).fetchall()
+    return [_recurring_from_row(row) for row in rows]
+
+@metrics.timed('storage_read')
+def get_recurring_rule(user_email, rule_id):
+    row = get_shard_db(user_email).execute(
+        'SELECT * FROM recurring_rules WHERE user_email = ? AND id = ?', (user_email, rule_id)
+    ).fetchone()
+    return _recurring_from_row(row) if row else None
+
+def delete_recurring_rule(user_email, rule_id):
+    # Occurrences already materialized stay; they are ordinary transactions and budgets
+    with write_transaction(get_shard_db(user_email)) as conn:
+        cursor = conn.execute('DELETE FROM recurring_rules WHERE user_email = ? AND id = ?', (user_email, rule_id))
+    return cursor.rowcount > 0
+
+@metrics.timed('storage_read')
+def due_recurring_users(today):
+    users = set()
+    for _, conn in _shard_connections():
+        users.update(row[0] for row in conn.execute(
+            'SELECT DISTINCT user_email FROM recurring_rules WHERE next_due <= ?', (today,)
+        ))
+    return sorted(users)
+
+@metrics.timed('storage_read')
+def next_recurring_due():
+    # Earliest pending occurrence over all shards, or None
+    earliest = None
+    for _, conn in _shard_connections():
+        row = conn.execute('SELECT MIN(next_due) FROM recurring_rules').fetchone()
+        if row[0] is not None and (earliest is None or row[0] < earliest):
+            earliest = row[0]
+    return earliest
+
+def _budget_carry_over(conn, user_email, category, month):
+    # Unspent part of the category's latest budget in the month before `month`, in minor units
+    year, number = int(month[:4]), int(month[5:7])
+    previous = f"{year - 1:04d}-12" if number == 1 else f"{year:04d}-{number - 1:02d}"
+    # IS, as in _materialize_budget, so a budget without a category also finds last month's
+    budget = conn.execute(
+        'SELECT limit_minor FROM budgets WHERE user_email = ? AND category IS ? AND month = ? ORDER BY id DESC LIMIT 1',
+        (user_email, category, previous)
+    ).fetchone()
+    if budget is None:
+        return 0
+    # Spend is indexed under '' for no category, the same key get_budget_status joins on
+    spent = conn.execute(
+        'SELECT total_minor FROM category_month_spend WHERE user_email = ? AND category = ? AND month = ?',
+        (user_email, category or '', previous)
+    ).fetchone()
+    return max(budget[0] - (spent[0] if spent else 0), 0)
+
+def _materialize_budget(conn, user_email, template, due):
+    # One budget per category and month: a budget entered by hand for that month wins
+    month = due[:7]
+    if conn.execute(
+        'SELECT 1 FROM budgets WHERE user_email = ? AND category IS ? AND month = ?',
+        (user_email, template.get('category'), month)
+    ).fetchone():
+        return None
+    limit = money.to_minor(template['limit'])
+    if template.get('rollover'):
+        limit += _budget_carry_over(conn, user_email, template.get('category'), month)
+    return _insert_budget(conn, user_email, {'category': template.get('category'), 'limit': money.to_major(limit), 'month': month})
+
+def materialize_recurring(user_email, today, occurrence_date, max_per_rule):
+    # Creates every occurrence due by `today` for all of the user's rules in one write, and
+    # advances next_due in the same transaction: a crash rolls both back, and a second worker
+    # waiting on the write lock finds nothing left to do. Returns the number of records created.
+    # occurrence_date(rule, n) gives the date of the rule's n-th occurrence (0-based).
+    with write_transaction(get_shard_db(user_email)) as conn:
+        rows = conn.execute(
+            'SELECT * FROM recurring_rules WHERE user_email = ? AND next_due <= ? ORDER BY next_due, id',
+            (user_email, today)
+        ).fetchall()
+        created = 0
+        for row in rows:
+            rule = _recurring_from_row(row)
+            n, due, made = rule['occurrences'], rule['next_due'], 0
+            while due is not None and due <= today and made < max_per_rule:
+                if rule['kind'] == 'transaction':
+                    _insert_transaction(conn, user_email, dict(rule['template'], date=due))
+                    created += 1
+                elif _materialize_budget(conn, user_email, rule['template'], due) is not None:
+                    created += 1
+                made += 1
+                n += 1
+                due = occurrence_date(rule, n)
+                if rule['end_date'] and due > rule['end_date']:
+                    due = None
+            conn.execute(
+                'UPDATE recurring_rules SET next_due = ?, occurrences = ? WHERE user_email = ? AND id = ?',
+                (due, n, user_email, rule['id'])
+            )
+        if created:
+            _bump_version(conn, user_email)
+    if created:
+        user_cache.invalidate(user_email)
+        change_feed.publish(user_email)
+        _note_events_appended(created)
+    return created
+
+# OTP
+@metrics.timed('storage_read')
+def get_otp(email):
+    row = get_db().execute('SELECT * FROM otp WHERE email = ?', (email,)).fetchone()
+    if not row:
+        return None
+    return {'otp': row['otp'], 'expires_at': row['expires_at'], 'phone': row['phone']}
+
+def issue_otp(email, otp_entry, window_seconds, max_per_window, min_interval_seconds):
+    # Store a new OTP unless the email is over its send budget; returns seconds to wait (0 when issued)
+    now = time.time()
+    with write_transaction() as conn:
+        row = conn.execute('SELECT * FROM otp_requests WHERE email = ?', (email,)).fetchone()
+        if row is not None and now - row['window_start'] < window_seconds:
+            if now - row['last_sent'] < min_interval_seconds:
+                return min_interval_seconds - (now - row['last_sent'])
+            if row['count'] >= max_per_window:
+                return window_seconds - (now - row['window_start'])
+            conn.execute(
+                'UPDATE otp_requests SET count = count + 1, last_sent = ? WHERE email = ?', (now, email)
+            )
+        else:
+            conn.execute(
+                'INSERT OR REPLACE INTO otp_requests (email, window_start, count, last_sent) VALUES (?, ?, 1, ?)',
+                (email, now, now)
+            )
+
+        conn.execute(
+            'INSERT OR REPLACE INTO otp (email, otp, expires_at, phone) VALUES (?, ?, ?, ?)',
+            (email, otp_entry['otp'], otp_entry['expires_at'], otp_entry.get('phone'))
+        )
+    return 0
+
+def sweep_expired_otps(window_seconds):
+    # Range deletes over the expiry indexes, so the cost is proportional to what has expired
+    with write_transaction() as conn:
+        expired = conn.execute('DELETE FROM otp WHERE expires_at < ?', (datetime.now().isoformat(),)).rowcount
+        conn.execute('DELETE FROM otp_requests WHERE window_start < ?', (time.time() - window_seconds,))
+    return expired
+
+def delete_otp(email):
+    with write_transaction() as conn:
+        conn.execute('DELETE FROM otp WHERE email = ?', (email,))
+
+# Sessions
+@metrics.timed('storage_read')
+def load_session(session_id):
+    row = get_db().execute(
+        'SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?', (session_id, time.time())
+    ).fetchone()
+    if not row:
+        return None
+    return json.loads(row['data']), row['expires_at']
+
+def save_session(session_id, user_email, data, expires_at):
+    with write_transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (id, user_email, data, expires_at) VALUES (?, ?, ?, ?)',
+            (session_id, user_email, json.dumps(data, separators=(',', ':')), expires_at)
+        )
+
+def touch_session(session_id, expires_at):
+    with write_transaction() as conn:
+        conn.execute('UPDATE sessions SET expires_at = ? WHERE id = ?', (expires_at, session_id))
+
+def delete_session(session_id):
+    with write_transaction() as conn:
+        conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+def delete_user_sessions(user_email):
+    with write_transaction() as conn:
+        cursor = conn.execute('DELETE FROM sessions WHERE user_email = ?', (user_email,))
+    return cursor.rowcount
+
+def delete_expired_sessions():
+    with write_transaction() as conn:
+        cursor = conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),))
+    return cursor.rowcount
+
+# Advice jobs
+def create_advice_job(job_id, user_email, status='queued', advice=None):
+    now = datetime.now().isoformat()
+    with write_transaction() as conn:
+        conn.execute(
+            'INSERT INTO advice_jobs (id, user_email, status, advice, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (job_id, user_email, status, advice, now, now)
+        )
+
+def update_advice_job(job_id, status, advice=None, error=None):
+    with write_transaction() as conn:
+        conn.execute(
+            'UPDATE advice_jobs SET status = ?, advice = COALESCE(?, advice), error = ?, updated_at = ? WHERE id = ?',
+            (status, advice, error, datetime.now().isoformat(), job_id)
+        )
+
+@metrics.timed('storage_read')
+def get_advice_job(user_email, job_id):
+    row = get_db().execute(
+        'SELECT * FROM advice_jobs WHERE id = ? AND user_email = ?', (job_id, user_email)
+    ).fetchone()
+    if not row:
+        return None
+    return {
+        'job_id': row['id'],
+        'status': row['status'],
+        'advice': row['advice'],
+        'error': row['error'],
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at']
+    }
+
+def delete_advice_jobs_before(cutoff):
+    with write_transaction() as conn:
+        cursor = conn.execute('DELETE FROM advice_jobs WHERE created_at < ?', (cutoff,))
+    return cursor.rowcount
+
+# Email outbox
+def enqueue_email(recipient, subject, body):
+    with write_transaction() as conn:
+        cursor = conn.execute(
+            'INSERT INTO email_outbox (recipient, subject, body, status, next_attempt_at, created_at) '
+            "VALUES (?, ?, ?, 'pending', ?, ?)",
+            (recipient, subject, body, time.time(), datetime.now().isoformat())
+        )
+    return cursor.lastrowid
+
+def claim_outbox_messages(limit, lease_seconds):
+    # Claimed rows are leased; if the claiming process dies they become due again when the lease ends
+    now = time.time()
+    with write_transaction() as conn:
+        rows = conn.execute(
+            "SELECT * FROM email_outbox WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? "
+            'ORDER BY next_attempt_at LIMIT ?',
+            (now, limit)
+        ).fetchall()
+        for row in rows:
+            conn.execute(
+                "UPDATE email_outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                (now + lease_seconds, row['id'])
+            )
+    return [{
+        'id': row['id'],
+        'recipient': row['recipient'],
+        'subject': row['subject'],
+        'body': row['body'],
+        'attempts': row['attempts']
+    } for row in rows]
+
+def complete_outbox_message(message_id):
+    with write_transaction() as conn:
+        conn.execute('DELETE FROM email_outbox WHERE id = ?', (message_id,))
+
+def retry_outbox_message(message_id, attempts, delay_seconds, error):
+    with write_transaction() as conn:
+        conn.execute(
+            "UPDATE email_outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay_seconds, error, message_id)
+        )
+
+def fail_outbox_message(message_id, attempts, error):
+    # The body is cleared: it may hold a still-valid OTP and will never be sent
+    with write_transaction() as conn:
+        conn.execute(
+            "UPDATE email_outbox SET status = 'failed', body = '', attempts = ?, last_error = ? WHERE id = ?",
+            (attempts, error, message_id)
+        )
+
+@metrics.timed('storage_read')
+def pending_outbox_count():
+    return get_db().execute(
+        "SELECT COUNT(*) FROM email_outbox WHERE status IN ('pending', 'sending')"
+    ).fetchone()[0]
+
+# Money columns of the single-file layout, which held floats in major units
+LEGACY_MONEY_COLUMNS = {'amount': 'amount_minor', 'limit_amount': 'limit_minor', 'total': 'total_minor'}
+
+def _fixed_point_rows(columns, rows):
+    # (columns, rows) with legacy money columns converted to the shards' minor units
+    money_columns = [i for i, column in enumerate(columns) if column in LEGACY_MONEY_COLUMNS]
+    if not money_columns:
+        return list(columns), [tuple(row) for row in rows]
+    converted = []
+    for row in rows:
+        values = list(row)
+        for i in money_columns:
+            values[i] = money.to_minor(values[i])
+        converted.append(values)
+    columns = [LEGACY_MONEY_COLUMNS.get(column, column) for column in columns]
+    if 'amount_minor' in columns:
+        columns.append('currency')
+        for values in converted:
+            values.append(money.CURRENCY)
+    return columns, [tuple(values) for values in converted]
+
+# One-shot move of per-user rows from the single-file layout into the shards
+def migrate_to_shards():
+    # Safe to re-run and to run from several workers at once: a user is copied only if the shard
+    # has no migrated_users marker for them, and the source rows are deleted after the copy commits
+    conn = get_db()
+    emails = [row[0] for row in conn.execute(
+        ' UNION '.join(f'SELECT user_email FROM {table}' for table in SHARDED_TABLES)
+    ).fetchall()]
+
+    moved = 0
+    for email in emails:
+        shard = get_shard_db(email)
+        with write_transaction(shard):
+            if not shard.execute('SELECT 1 FROM migrated_users WHERE user_email = ?', (email,)).fetchone():
+                for table in SHARDED_TABLES:
+                    rows = conn.execute(f'SELECT * FROM {table} WHERE user_email = ?', (email,)).fetchall()
+                    if rows:
+                        columns, rows = _fixed_point_rows(rows[0].keys(), rows)
+                        shard.executemany(
+                            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                            f"VALUES ({', '.join('?' for _ in columns)})",
+                            rows
+                        )
+                shard.execute('INSERT INTO migrated_users (user_email) VALUES (?)', (email,))
+                shard.execute('INSERT OR IGNORE INTO search_backfill (user_email) VALUES (?)', (email,))
+                moved += 1
+        with write_transaction(conn):
+            for table in SHARDED_TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE user_email = ?', (email,))
+        user_cache.invalidate(email)
+
+    if moved:
+        logger.info(f"Moved {moved} users from {DB_FILE} into {SHARD_COUNT} shards under {SHARD_DIR}")
+    return moved
+
+def check_shards():
+    # Integrity check per shard, so a damaged file can be restored without touching the others
+    results = {}
+    for shard, conn in _shard_connections():
+        try:
+            results[shard] = conn.execute('PRAGMA quick_check').fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            results[shard] = str(e)
+    return results
+
+# One-shot migration from the legacy data/*.json files
+def _load_json(file_path):
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading {file_path}: {e}")
+        return {}
+
+def migrate_from_json(users_file, transactions_file, budgets_file, otp_file, only_if_empty=False):
+    users = _load_json(users_file)
+    all_transactions = _load_json(transactions_file)
+    all_budgets = _load_json(budgets_file)
+    otp_data = _load_json(otp_file)
+
+    counts = {'users': 0, 'transactions': 0, 'budgets': 0, 'otp': 0, 'skipped_users': 0}
+    with write_transaction() as conn:
+        # Checked under the write lock so workers starting together import only once
+        if only_if_empty and conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            return None
+
+        for email, user in users.items():
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO users (email, name, phone, password, created_at) VALUES (?, ?, ?, ?, ?)',
+                (email, user.get('name', ''), user.get('phone'), user.get('password'), user.get('created_at'))
+            )
+            counts['users'] += cursor.rowcount
+
+        for email, entry in otp_data.items():
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO otp (email, otp, expires_at, phone) VALUES (?, ?, ?, ?)',
+                (email, entry['otp'], entry['expires_at'], entry.get('phone'))
+            )
+            counts['otp'] += cursor.rowcount
+
+        # Each user's rows go to their shard in one transaction on that shard, together with the
+        # marker that keeps a re-run from importing them twice
+        for email in set(all_transactions) | set(all_budgets):
+            with write_transaction(get_shard_db(email)) as shard:
+                if shard.execute('SELECT 1 FROM json_imported_users WHERE user_email = ?', (email,)).fetchone():
+                    counts['skipped_users'] += 1
+                    continue
+                shard.execute('INSERT INTO json_imported_users (user_email) VALUES (?)', (email,))
+                # The old len()+1 id scheme could hand out the same id twice; renumber clashes
+                for t in all_transactions.get(email, []):
+                    transaction_id = _reserve_id(shard, email, 'transactions', t.get('id'))
+                    shard.execute(
+                        'INSERT INTO transactions (user_email, id, type, amount_minor, currency, category, description, date) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (email, transaction_id, t.get('type'), money.to_minor(t['amount']), money.CURRENCY,
+                         t.get('category'), t.get('description'), t.get('date'))
+                    )
+                    counts['transactions'] += 1
+
+                for b in all_budgets.get(email, []):
+                    budget_id = _reserve_id(shard, email, 'budgets', b.get('id'))
+                    shard.execute(
+                        'INSERT INTO budgets (user_email, id, category, limit_minor, month) VALUES (?, ?, ?, ?, ?)',
+                        (email, budget_id, b.get('category'), money.to_minor(b['limit']), b.get('month'))
+                    )
+                    counts['budgets'] += 1
+
+                _rebuild_user_aggregates(shard, email)
+                shard.execute('INSERT OR IGNORE INTO search_backfill (user_email) VALUES (?)', (email,))
+                _bump_version(shard, email)
+
+    user_cache.clear()
+    logger.info(f"Migrated JSON data into {DB_FILE}: {counts}")
+    return counts
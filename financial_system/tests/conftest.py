@@ -0,0 +1,34 @@
+import os
+import sys
+import uuid
+import tempfile
+import pytest
+
+# The app modules read their settings from the environment at import time, so the scratch
+# database is chosen before any of them is imported. Tests share it and keep apart by using
+# a fresh user each.
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+WORKDIR = tempfile.mkdtemp(prefix='financial-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(WORKDIR, 'data', 'financial.db')
+os.environ.setdefault('SESSION_BACKEND', 'sqlite')
+# Run from the scratch directory so nothing picks up the real data/*.json files
+os.chdir(WORKDIR)
+
+import storage
+
+storage.init_db()
+
+@pytest.fixture
+def user_email():
+    return f'{uuid.uuid4().hex}@example.com'
+
+@pytest.fixture
+def client(user_email):
+    import app as app_module
+    client = app_module.app.test_client()
+    response = client.post('/api/register', json={
+        'email': user_email, 'password': 'secret1', 'name': 'Test', 'phone': '5550000000'
+    })
+    assert response.status_code == 200
+    return client
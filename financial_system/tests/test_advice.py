@@ -0,0 +1,74 @@
+import json
+import time
+import threading
+import pytest
+import advisor
+import app as app_module
+import groq_stub
+
+@pytest.fixture
+def groq(monkeypatch):
+    server = groq_stub.run(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(advisor, 'GROQ_API_URL', f'http://127.0.0.1:{server.server_address[1]}/openai/v1/chat/completions')
+    monkeypatch.setattr(advisor, 'GROQ_API_KEY', 'stub')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def poll(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/financial-advice/jobs/{job_id}').get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'advice job {job_id} did not finish')
+
+def test_advice_job_runs_in_the_background_and_is_cached(client, groq):
+    response = client.post('/api/financial-advice/jobs', json={'query': 'How do I save for a car?'})
+    assert response.status_code == 202
+    job = poll(client, response.get_json()['job_id'])
+    assert job['status'] == 'done'
+    assert job['advice'].startswith('Stub advice for: How do I save for a car?')
+
+    # Same question, same finances: answered from the cache without a new job run
+    cached = client.post('/api/financial-advice/jobs', json={'query': 'how do i save for a car'})
+    assert cached.status_code == 200
+    assert cached.get_json()['advice'] == job['advice']
+
+def test_advice_job_validation(client, groq):
+    assert client.post('/api/financial-advice/jobs', json={'query': '  '}).status_code == 400
+    assert client.get('/api/financial-advice/jobs/missing').status_code == 404
+
+def events(body):
+    frames = [frame for frame in body.decode().split('\n\n') if frame]
+    parsed = []
+    for frame in frames:
+        fields = dict(line.split(': ', 1) for line in frame.split('\n'))
+        parsed.append((fields['event'], json.loads(fields['data'])))
+    return parsed
+
+def test_advice_streams_tokens(client, groq):
+    response = client.post('/api/financial-advice/stream', json={'query': 'Should I pay off my card?'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    received = events(response.get_data())
+    text = ''.join(data['text'] for event, data in received if event == 'token')
+    assert text.startswith('Stub advice for: Should I pay off my card?')
+    assert received[-1][0] == 'done' and received[-1][1]['cached'] is False
+
+    # The finished stream was cached, so the job endpoint answers at once
+    job = client.post('/api/financial-advice/jobs', json={'query': 'Should I pay off my card?'})
+    assert job.status_code == 200 and job.get_json()['advice'] == text
+
+def test_advice_streams_are_capped(client, groq, monkeypatch):
+    monkeypatch.setattr(app_module, '_advice_stream_slots', threading.BoundedSemaphore(1))
+    first = client.post('/api/financial-advice/stream', json={'query': 'One'}, buffered=False)
+    busy = client.post('/api/financial-advice/stream', json={'query': 'Two'})
+    assert busy.status_code == 503
+    first.close()
+    again = client.post('/api/financial-advice/stream', json={'query': 'Three'})
+    assert again.status_code == 200
+    again.close()
@@ -0,0 +1,97 @@
+import base64
+import gzip
+import json
+
+def cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+def add(client, **fields):
+    transaction = dict({'type': 'expense', 'amount': 1, 'category': 'food', 'description': 'lunch'}, **fields)
+    return client.post('/api/transactions', json=transaction)
+
+def walk(client, path, params):
+    seen, params = [], dict(params)
+    while True:
+        page = client.get(path, query_string=params).get_json()
+        assert page['success']
+        seen.extend(t['id'] for t in page['transactions'])
+        if not page['next_cursor']:
+            return seen
+        params['cursor'] = page['next_cursor']
+
+def test_crafted_cursors_are_rejected(client):
+    add(client, date='2026-01-01')
+    for value in [['date_desc', [1], 2], ['date_desc', '2026-01-01', 'x'], ['date_desc', '2026-01-01', True],
+                  ['amount_desc', '10', 2], ['date_desc', '2026-01-01', 2 ** 63], 'junk', {}]:
+        sort = value[0] if isinstance(value, list) else 'date_desc'
+        response = client.get('/api/transactions', query_string={'sort': sort, 'cursor': cursor(value)})
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
+    response = client.get('/api/transactions', query_string={'cursor': 'not base64!'})
+    assert response.status_code == 400
+
+def test_transaction_dates(client):
+    assert add(client, date='2026-02-30').status_code == 400
+    assert add(client, date='26-1-1').status_code == 400
+    created = add(client, date=None)
+    assert created.status_code == 201
+    assert created.get_json()['date']
+
+def test_paging_through_the_api(client):
+    for i in range(9):
+        add(client, description=f'coffee {i}', date=f'2026-01-0{1 + i}')
+    ids = walk(client, '/api/transactions', {'sort': 'date_asc', 'limit': 2})
+    assert ids == sorted(ids) and len(ids) == 9
+
+def test_report_periods_are_bounded(client):
+    for query in ['periods=0', 'periods=20001', 'periods=10000000000000000000', 'window=10000000000000000000']:
+        response = client.get(f'/api/reports?{query}')
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
+    assert client.get('/api/reports?periods=20000&granularity=year').status_code == 200
+
+def test_dashboard_revalidates_with_its_etag(client):
+    add(client, date='2026-01-01')
+    first = client.get('/api/dashboard')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.get_json()['summary']['transaction_count'] == 1
+
+    unchanged = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.get_data() == b''
+
+    # Any write moves the data version, so the old tag no longer matches
+    add(client, date='2026-01-02')
+    changed = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['summary']['transaction_count'] == 2
+
+def test_dashboard_is_compressed_when_large(client):
+    for i in range(40):
+        add(client, description=f'groceries at the corner shop {i}', date='2026-01-01')
+    plain = client.get('/api/dashboard')
+    compressed = client.get('/api/dashboard', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+
+def test_search_pages_and_rejects_crafted_cursors(client):
+    for i in range(9):
+        add(client, description=f'coffee {i}', date=f'2026-01-0{1 + i}')
+    add(client, description='rent', category='housing', date='2026-01-01')
+    ids = walk(client, '/api/transactions/search', {'q': 'coffee', 'limit': 2})
+    assert len(ids) == 9 and len(set(ids)) == 9
+    # Typos still match
+    assert client.get('/api/transactions/search', query_string={'q': 'cofee'}).get_json()['total'] == 9
+    response = client.get('/api/transactions/search', query_string={'q': 'coffee', 'cursor': cursor(['relevance', 'x', 1])})
+    assert response.status_code == 400
+
+def test_summary_is_exact(client):
+    for amount in [0.1, 0.2] * 50:
+        assert add(client, amount=amount, date='2026-01-01').status_code == 201
+    summary = client.get('/api/summary').get_json()
+    assert summary['expenses'] == 15.0
+    assert summary['balance'] == -15.0
+    report = client.get('/api/reports', query_string={'granularity': 'year', 'periods': 1, 'end': '2026-12-31'}).get_json()
+    assert (report['expenses'], report['categories'], report['series'][0]['net']) == (15.0, {'food': 15.0}, -15.0)
@@ -0,0 +1,74 @@
+import hashlib
+import pytest
+import mailer
+import otp_store
+import passwords
+import storage
+
+@pytest.fixture
+def outbox(monkeypatch):
+    # Queue OTP emails without starting the SMTP worker
+    monkeypatch.setattr(mailer, 'ensure_worker', lambda: None)
+
+def forgot(client, email):
+    return client.post('/api/forgot-password', json={'email': email})
+
+def test_otp_requests_are_rate_limited(client, user_email, outbox, monkeypatch):
+    assert forgot(client, user_email).status_code == 200
+    resend = forgot(client, user_email)
+    assert resend.status_code == 429
+    assert 0 < int(resend.headers['Retry-After']) <= otp_store.OTP_RESEND_SECONDS + 1
+
+    monkeypatch.setattr(otp_store, 'OTP_RESEND_SECONDS', 0)
+    for _ in range(otp_store.OTP_MAX_PER_WINDOW - 1):
+        assert forgot(client, user_email).status_code == 200
+    over = forgot(client, user_email)
+    assert over.status_code == 429
+    assert int(over.headers['Retry-After']) > otp_store.OTP_RESEND_SECONDS + 1
+
+def test_otp_resets_the_password(client, user_email, outbox):
+    assert forgot(client, user_email).status_code == 200
+    otp = storage.get_otp(user_email)['otp']
+    reset = {'email': user_email, 'new_password': 'changed1'}
+    assert client.post('/api/verify-otp', json=dict(reset, otp='wrong')).status_code == 400
+    assert client.post('/api/verify-otp', json=dict(reset, otp=otp)).status_code == 200
+    assert storage.get_otp(user_email) is None
+    assert client.post('/api/login', json={'email': user_email, 'password': 'changed1'}).status_code == 200
+
+def session_cookie(client):
+    return client.get_cookie('session').value
+
+def test_logout_revokes_the_session(client):
+    sid = session_cookie(client)
+    assert client.get('/api/summary').status_code == 200
+    assert client.post('/api/logout').status_code == 200
+    # Replaying the old cookie does not bring the session back
+    client.set_cookie('session', sid)
+    assert client.get('/api/summary').status_code == 401
+
+def test_revoking_a_user_ends_every_session(client, user_email):
+    other = client.application.test_client()
+    assert other.post('/api/login', json={'email': user_email, 'password': 'secret1'}).status_code == 200
+    assert session_cookie(other) != session_cookie(client)
+    client.application.session_interface.revoke_user(user_email)
+    assert client.get('/api/summary').status_code == 401
+    assert other.get('/api/summary').status_code == 401
+
+def login(client, user_email, password='secret1'):
+    return client.post('/api/login', json={'email': user_email, 'password': password})
+
+def test_login_rehashes_legacy_and_outdated_hashes(client, user_email, monkeypatch):
+    assert storage.get_user(user_email)['password'].startswith(f'scrypt${passwords.SCRYPT_N}$')
+
+    storage.update_user_password(user_email, hashlib.sha256(b'secret1').hexdigest())
+    assert login(client, user_email).status_code == 200
+    upgraded = storage.get_user(user_email)['password']
+    assert upgraded.startswith(f'scrypt${passwords.SCRYPT_N}$')
+
+    # Unchanged settings leave the hash alone; a new cost factor replaces it at the next login
+    assert login(client, user_email).status_code == 200
+    assert storage.get_user(user_email)['password'] == upgraded
+    monkeypatch.setattr(passwords, 'SCRYPT_N', 1024)
+    assert login(client, user_email).status_code == 200
+    assert storage.get_user(user_email)['password'].startswith('scrypt$1024$8$1$')
+    assert login(client, user_email, 'wrong').status_code == 401
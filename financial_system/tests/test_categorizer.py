@@ -0,0 +1,29 @@
+import categorizer
+import storage
+
+def state(model):
+    return (model.examples, model.category_counts, model.type_counts, model.feature_totals, model.feature_counts)
+
+def add(user_email, descriptions, category):
+    return storage.add_transactions(user_email, [
+        {'type': 'expense', 'amount': 4.5, 'category': category, 'description': description, 'date': '2026-01-05'}
+        for description in descriptions
+    ])
+
+def test_journal_catch_up_matches_retraining(user_email):
+    add(user_email, ['Tesco Metro', 'Tesco groceries', 'Aldi'] * 4, 'groceries')
+    model = categorizer.get_model(user_email)
+    rows = add(user_email, ['Costa coffee', 'Pret coffee'] * 3, 'coffee')
+    storage.delete_transaction(user_email, rows[0]['id'])
+    assert categorizer.get_model(user_email) is model
+    assert state(model) == state(categorizer._train(user_email))
+    assert model.suggest('costa coffee', 'expense') == 'coffee'
+
+def test_compacted_journal_forces_retraining(user_email):
+    add(user_email, ['Tesco Metro'] * 12, 'groceries')
+    model = categorizer.get_model(user_email)
+    add(user_email, ['Shell fuel'] * 12, 'fuel')
+    storage.compact_journal(retention_days=-1)
+    refreshed = categorizer.get_model(user_email)
+    assert refreshed is not model
+    assert state(refreshed) == state(categorizer._train(user_email))
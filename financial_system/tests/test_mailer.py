@@ -0,0 +1,25 @@
+import mailer
+import storage
+
+class Unreachable:
+    def send(self, recipient, message):
+        raise OSError('connection refused')
+
+    def close(self):
+        pass
+
+def outbox_row(message_id):
+    row = storage.get_db().execute('SELECT status, attempts, body FROM email_outbox WHERE id = ?', (message_id,)).fetchone()
+    return tuple(row)
+
+def test_failed_otp_email_drops_its_body(monkeypatch):
+    monkeypatch.setattr(mailer, 'OUTBOX_MAX_ATTEMPTS', 2)
+    message_id = storage.enqueue_email('otp@example.com', mailer.OTP_SUBJECT, mailer.OTP_BODY.format(otp='482913'))
+
+    assert mailer.drain_outbox(Unreachable()) == 0
+    status, attempts, body = outbox_row(message_id)
+    assert (status, attempts) == ('pending', 1) and '482913' in body
+
+    storage.get_db().execute('UPDATE email_outbox SET next_attempt_at = 0 WHERE id = ?', (message_id,))
+    assert mailer.drain_outbox(Unreachable()) == 0
+    assert outbox_row(message_id) == ('failed', 2, '')
@@ -0,0 +1,35 @@
+import time
+import app as app_module
+import metrics
+
+def in_flight():
+    return metrics._gauges.get(metrics._key('financial_http_requests_in_flight', {}), 0)
+
+def duration(route):
+    histogram = metrics._histograms.get(metrics._key('financial_http_request_duration_seconds',
+                                                     {'route': route, 'method': 'GET'}))
+    return (0, 0.0) if histogram is None else (sum(histogram[:-1]), histogram[-1])
+
+def test_streams_are_timed_until_the_body_is_closed(client):
+    count, seconds = duration('/api/live')
+    before = in_flight()
+    response = client.get('/api/live', buffered=False)
+    assert response.status_code == 200
+    # Flask has torn the request down, but the stream is still open
+    assert in_flight() == before + 1
+    assert duration('/api/live') == (count, seconds)
+
+    time.sleep(0.05)
+    response.close()
+    assert in_flight() == before
+    new_count, new_seconds = duration('/api/live')
+    assert new_count == count + 1
+    assert new_seconds - seconds >= 0.05
+
+def test_metrics_need_the_token(client, monkeypatch):
+    assert client.get('/metrics').status_code == 401
+    monkeypatch.setattr(app_module, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+    assert response.status_code == 200
+    assert 'financial_http_requests_total{' in response.get_data(as_text=True)
@@ -0,0 +1,36 @@
+import pytest
+import money
+
+@pytest.mark.parametrize('value, minor', [
+    (0.1, 10), ('0.2', 20), (12, 1200), ('19.999', 2000), (0.005, 1), (-0.005, -1), (' 7.5 ', 750),
+])
+def test_to_minor_rounds_half_away_from_zero(value, minor):
+    assert money.to_minor(value) == minor
+
+def test_range_filters_round_inward():
+    assert money.to_minor('10.001', rounding=money.ROUND_CEILING) == 1001
+    assert money.to_minor('10.009', rounding=money.ROUND_FLOOR) == 1000
+
+@pytest.mark.parametrize('value', [True, None, 'abc', 'NaN', 'inf', float('nan'), float('inf'), [1]])
+def test_to_minor_rejects_non_numbers(value):
+    with pytest.raises(ValueError):
+        money.to_minor(value)
+
+def test_to_minor_rejects_amounts_over_the_limit():
+    limit = money.MAX_MINOR // money.scale()
+    assert money.to_minor(limit) == money.MAX_MINOR
+    with pytest.raises(ValueError):
+        money.to_minor(limit + 1)
+    with pytest.raises(ValueError):
+        money.to_minor('1e400')
+
+def test_minor_units_follow_the_currency():
+    assert money.to_minor('1234.5', 'JPY') == 1235
+    assert money.to_minor('1.2345', 'KWD') == 1235
+    assert money.to_major(1235, 'JPY') == 1235.0
+    assert money.to_major(1235, 'KWD') == 1.235
+
+def test_round_trip_is_the_decimal_that_was_written():
+    for text in ['0.01', '0.1', '0.3', '19.99', '1234567.89', '-42.42']:
+        assert money.to_major(money.to_minor(text)) == float(text)
+    assert money.to_major(money.to_minor(0.1) + money.to_minor(0.2)) == 0.3
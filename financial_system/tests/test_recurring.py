@@ -0,0 +1,43 @@
+import pytest
+import app as app_module
+import recurring
+import storage
+
+def add_rule(user_email, **data):
+    return storage.add_recurring_rule(user_email, app_module.build_recurring_rule(data))
+
+def test_monthly_occurrences_clamp_to_the_end_of_the_month():
+    rule = {'start_date': '2024-01-31', 'unit': 'month', 'interval': 1}
+    assert [recurring.occurrence_date(rule, n) for n in range(5)] == [
+        '2024-01-31', '2024-02-29', '2024-03-31', '2024-04-30', '2024-05-31'
+    ]
+    quarterly = {'start_date': '2023-11-30', 'unit': 'month', 'interval': 3}
+    assert recurring.occurrence_date(quarterly, 1) == '2024-02-29'
+
+def test_each_occurrence_is_created_once(user_email):
+    add_rule(user_email, frequency='monthly', start_date='2024-01-31', type='expense', amount=950,
+             category='rent', description='Rent')
+    assert recurring.materialize_user(user_email, '2024-04-30') == 4
+    assert recurring.materialize_user(user_email, '2024-04-30') == 0
+    assert recurring.materialize_user(user_email, '2024-05-30') == 0
+    assert recurring.materialize_user(user_email, '2024-05-31') == 1
+    assert sorted(t['date'] for t in storage.get_transactions(user_email)) == [
+        '2024-01-31', '2024-02-29', '2024-03-31', '2024-04-30', '2024-05-31'
+    ]
+    assert storage.get_recurring_rules(user_email)[0]['next_due'] == '2024-06-30'
+
+def test_end_date_stops_the_rule(user_email):
+    add_rule(user_email, frequency='custom', unit='week', interval=2, start_date='2024-01-01',
+             end_date='2024-01-29', type='income', amount=10, category='pay')
+    assert recurring.materialize_user(user_email, '2024-12-31') == 3
+    assert storage.get_recurring_rules(user_email)[0]['next_due'] is None
+
+@pytest.mark.parametrize('category', ['food', None])
+def test_budget_rollover_carries_unspent_limit(user_email, category):
+    add_rule(user_email, kind='budget', frequency='monthly', start_date='2024-01-01', category=category,
+             limit=100, rollover=True)
+    assert recurring.materialize_user(user_email, '2024-01-15') == 1
+    storage.add_transaction(user_email, {'type': 'expense', 'amount': 30.25, 'category': category,
+                                         'description': None, 'date': '2024-01-20'})
+    assert recurring.materialize_user(user_email, '2024-02-01') == 1
+    assert [(b['month'], b['limit']) for b in storage.get_budgets(user_email)] == [('2024-01', 100.0), ('2024-02', 169.75)]
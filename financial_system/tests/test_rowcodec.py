@@ -0,0 +1,34 @@
+import pytest
+import rowcodec
+
+def transaction(i, **fields):
+    return dict({
+        'id': i, 'type': 'expense', 'amount': 12.5, 'category': 'food',
+        'description': f'Purchase {i}', 'date': '2023-06-06'
+    }, **fields)
+
+@pytest.mark.parametrize('rows', [
+    [],
+    [transaction(1)],
+    [transaction(1, type=None, category=None, description=None, date=None)],
+    [transaction(1, description='café ☕ \ud800'), transaction(2, type='', amount=-0.01)],
+    [transaction(2 ** 40, amount=9e12), transaction(3, amount=0.01)],
+])
+def test_rowcodec_round_trip(rows):
+    assert rowcodec.decode(rowcodec.encode(rows)) == rows
+
+def test_descriptions_are_dictionary_encoded_only_when_they_repeat():
+    repeated = [transaction(i, description=['Rent', 'Coffee', None][i % 3]) for i in range(30)]
+    unique = [transaction(i) for i in range(30)]
+    for rows in (repeated, unique):
+        assert rowcodec.decode(rowcodec.encode(rows)) == rows
+    header = rowcodec.HEADER
+    assert header.unpack_from(rowcodec.encode(repeated))[4] == 1
+    assert header.unpack_from(rowcodec.encode(unique))[4] == 0
+
+def test_columns_keep_minor_units_and_currency():
+    payload = rowcodec.encode([transaction(1, amount=0.1), transaction(2, amount=0.2)], currency='USD')
+    data = rowcodec.columns(payload)
+    assert data['amount'] == (10, 20)
+    assert data['id'] == (1, 2)
+    assert data['currency'] == 'USD'
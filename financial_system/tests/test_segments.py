@@ -0,0 +1,29 @@
+import json
+import zlib
+import segments
+
+def transaction(i, **fields):
+    return dict({
+        'id': i, 'type': 'expense', 'amount': 12.5, 'category': 'food',
+        'description': f'Purchase {i}', 'date': '2023-06-06'
+    }, **fields)
+
+def test_segments_round_trip_and_columns():
+    rows = [transaction(i, date=f'2023-01-{1 + i % 28:02d}', amount=i / 100) for i in range(1, 200)]
+    payload = segments.encode(rows)
+    assert segments.decode(payload) == rows
+    assert segments.columns(payload) == [(t['date'], t['type'], i, t['category']) for i, t in enumerate(rows, start=1)]
+
+def test_legacy_json_segments_still_decode():
+    rows = [transaction(1, amount=0.1), transaction(2, amount=19.99)]
+    fields = ('id', 'type', 'amount', 'category', 'description', 'date')
+    payload = zlib.compress(json.dumps([[t[field] for field in fields] for t in rows]).encode())
+    assert segments.decode(payload) == rows
+    assert [amount for _, _, amount, _ in segments.columns(payload)] == [10, 1999]
+
+def test_summarize_uses_minor_units():
+    rows = [transaction(5, amount=3.5, date='2023-02-01'), transaction(2, amount=0.25, date='2023-01-09')]
+    assert segments.summarize(rows) == {
+        'row_count': 2, 'first_date': '2023-01-09', 'last_date': '2023-02-01',
+        'min_id': 2, 'max_id': 5, 'min_amount_minor': 25, 'max_amount_minor': 350
+    }
@@ -0,0 +1,183 @@
+import json
+import random
+import sqlite3
+import pytest
+import storage
+
+def test_failed_commit_rolls_back(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'fk.db', isolation_level=None)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('CREATE TABLE parent (id INTEGER PRIMARY KEY)')
+    conn.execute('CREATE TABLE child (parent_id INTEGER REFERENCES parent (id) DEFERRABLE INITIALLY DEFERRED)')
+    # A deferred foreign key is only checked by COMMIT, which then fails and leaves the transaction open
+    with pytest.raises(sqlite3.IntegrityError):
+        with storage.write_transaction(conn):
+            conn.execute('INSERT INTO child (parent_id) VALUES (1)')
+    assert not conn.in_transaction
+    with storage.write_transaction(conn):
+        conn.execute('INSERT INTO parent (id) VALUES (1)')
+    assert conn.execute('SELECT COUNT(*) FROM child').fetchone()[0] == 0
+
+def test_migrate_from_json_is_idempotent(tmp_path, user_email):
+    files = {
+        'users': {user_email: {'name': 'Legacy', 'phone': '5550000000', 'password': 'x', 'created_at': '2024-01-01'}},
+        'transactions': {user_email: [
+            {'id': 1, 'type': 'expense', 'amount': 0.1, 'category': 'food', 'description': 'a', 'date': '2024-01-02'},
+            {'id': 1, 'type': 'expense', 'amount': 0.2, 'category': 'food', 'description': 'b', 'date': '2024-01-03'},
+        ]},
+        'budgets': {user_email: [{'id': 1, 'category': 'food', 'limit': 10.5, 'month': '2024-01'}]},
+        'otp': {},
+    }
+    paths = []
+    for name, data in files.items():
+        path = tmp_path / f'{name}.json'
+        path.write_text(json.dumps(data))
+        paths.append(str(path))
+
+    first = storage.migrate_from_json(*paths)
+    second = storage.migrate_from_json(*paths)
+    assert (first['transactions'], first['budgets']) == (2, 1)
+    assert (second['transactions'], second['budgets'], second['skipped_users']) == (0, 0, 1)
+    assert sorted(t['id'] for t in storage.get_transactions(user_email)) == [1, 2]
+    assert storage.get_aggregates(user_email)['expenses'] == 0.3
+    assert [b['limit'] for b in storage.get_budgets(user_email)] == [10.5]
+
+def seed(user_email, count=120, null_dates=True):
+    rng = random.Random(7)
+    rows = []
+    for i in range(count):
+        rows.append({
+            'type': 'income' if i % 5 == 0 else 'expense',
+            'amount': rng.choice([0.1, 0.2, 3.5, 19.99, 250]),
+            'category': rng.choice(['food', 'rent', 'fun']),
+            'description': f'item {i}',
+            'date': None if null_dates and i % 17 == 0 else f'20{19 + i % 7}-{1 + i % 12:02d}-{1 + i % 28:02d}'
+        })
+    return storage.add_transactions(user_email, rows)
+
+def expected_order(rows, sort):
+    column, direction = storage.TRANSACTION_SORTS[sort]
+    # SQLite's order: NULLs first ascending, last descending
+    ordered = sorted(rows, key=lambda t: (t[column] is not None, t[column], t['id']))
+    return [t['id'] for t in (ordered[::-1] if direction == 'DESC' else ordered)]
+
+def walk(user_email, sort, limit, filters=None):
+    ids, after = [], None
+    while True:
+        page, after = storage.query_transactions(user_email, filters, sort, limit, after)
+        ids.extend(t['id'] for t in page)
+        if after is None:
+            return ids
+
+@pytest.mark.parametrize('archived', [False, True])
+@pytest.mark.parametrize('sort', list(storage.TRANSACTION_SORTS))
+def test_cursor_pages_cover_every_row_once(user_email, sort, archived):
+    rows = seed(user_email)
+    if archived:
+        assert storage.archive_transactions('2023-01-01', user_email) > 0
+    for limit in (1, 2, 7, 50):
+        assert walk(user_email, sort, limit) == expected_order(rows, sort)
+    food = [t for t in rows if t['category'] == 'food']
+    assert walk(user_email, sort, 3, {'category': 'food'}) == expected_order(food, sort)
+
+def test_migrate_to_shards_moves_each_user_once(user_email):
+    conn = storage.get_db()
+    with storage.write_transaction(conn):
+        conn.execute(
+            'INSERT INTO transactions (user_email, id, type, amount, category, description, date) VALUES '
+            "(?, 1, 'expense', 0.1, 'f', 'a', '2026-01-02'), (?, 2, 'expense', 0.2, 'f', 'b', '2026-01-03')",
+            (user_email, user_email)
+        )
+        conn.execute("INSERT INTO budgets (user_email, id, category, limit_amount, month) VALUES (?, 1, 'f', 10.5, '2026-01')",
+                     (user_email,))
+        conn.execute("INSERT INTO category_totals (user_email, category, total, count) VALUES (?, 'f', 0.30000000000000004, 2)",
+                     (user_email,))
+        conn.execute("INSERT INTO category_month_spend (user_email, category, month, total, count) "
+                     "VALUES (?, 'f', '2026-01', 0.30000000000000004, 2)", (user_email,))
+    assert storage.migrate_to_shards() >= 1
+    assert storage.migrate_to_shards() == 0
+    assert [t['amount'] for t in storage.get_transactions(user_email)] == [0.1, 0.2]
+    assert storage.get_aggregates(user_email)['categories'] == {'f': 0.3}
+    assert storage.get_budget_status(user_email)[0]['remaining'] == 10.2
+    assert conn.execute('SELECT COUNT(*) FROM transactions WHERE user_email = ?', (user_email,)).fetchone()[0] == 0
+
+def test_archiving_keeps_reads_and_totals(user_email):
+    rows = seed(user_email, null_dates=False)
+    before = (storage.get_transactions(user_email), storage.get_aggregates(user_email),
+              list(storage.iter_transactions(user_email)))
+    moved = storage.archive_transactions('2023-01-01', user_email)
+    assert moved == sum(t['date'] < '2023-01-01' for t in rows)
+    assert storage.archived_through(user_email) < '2023-01-01'
+    assert storage.get_transactions(user_email) == before[0]
+    assert storage.get_aggregates(user_email) == before[1]
+    assert sorted(storage.iter_transactions(user_email), key=lambda t: t['id']) == sorted(before[2], key=lambda t: t['id'])
+    assert storage.rebuild_aggregates(user_email) == []
+
+def test_deleting_an_archived_transaction(user_email):
+    rows = seed(user_email, null_dates=False)
+    storage.archive_transactions('2023-01-01', user_email)
+    old = next(t for t in rows if t['date'] < '2023-01-01')
+    assert storage.delete_transaction(user_email, old['id'])
+    assert old['id'] not in [t['id'] for t in storage.get_transactions(user_email)]
+    assert storage.get_aggregates(user_email)['transaction_count'] == len(rows) - 1
+    assert storage.rebuild_aggregates(user_email) == []
+
+def test_archived_segments_are_decoded_once(user_email, monkeypatch):
+    seed(user_email, null_dates=False)
+    storage.archive_transactions('2023-01-01', user_email)
+    decoded = []
+    decode = storage.segments.decode
+    monkeypatch.setattr(storage.segments, 'decode', lambda payload: decoded.append(1) or decode(payload))
+
+    storage.get_transactions(user_email)
+    first = len(decoded)
+    assert 0 < first <= 4
+    # Writes to live rows do not invalidate the archived years
+    for i in range(3):
+        storage.add_transaction(user_email, {'type': 'expense', 'amount': 1, 'category': 'food',
+                                             'description': f'new {i}', 'date': '2026-02-01'})
+        storage.get_transactions(user_email)
+        list(storage.iter_transactions(user_email))
+        walk(user_email, 'amount_desc', 25)
+    assert len(decoded) == first
+
+def test_totals_are_exact(user_email):
+    storage.add_transactions(user_email, [
+        {'type': 'expense', 'amount': amount, 'category': 'x', 'description': None, 'date': '2026-01-01'}
+        for amount in [0.1, 0.2] * 500
+    ])
+    aggregates = storage.get_aggregates(user_email)
+    assert aggregates['expenses'] == 150.0
+    assert aggregates['balance'] == -150.0
+    assert aggregates['categories'] == {'x': 150.0}
+
+def test_migrate_to_shards_writes_minor_units(user_email):
+    conn = storage.get_db()
+    with storage.write_transaction(conn):
+        conn.execute("INSERT INTO transactions (user_email, id, type, amount, category, description, date) "
+                     "VALUES (?, 1, 'expense', 0.1, 'f', 'a', '2026-01-02'), (?, 2, 'expense', 19.99, 'f', 'b', '2026-01-03')",
+                     (user_email, user_email))
+    assert storage.migrate_to_shards() >= 1
+    rows = storage.get_shard_db(user_email).execute(
+        'SELECT amount_minor, currency FROM transactions WHERE user_email = ? ORDER BY id', (user_email,)
+    ).fetchall()
+    assert [tuple(row) for row in rows] == [(10, 'USD'), (1999, 'USD')]
+
+def test_fixed_point_shard_migration(tmp_path):
+    fixed = next(i for i, statements in enumerate(storage.SHARD_MIGRATIONS)
+                 if any('transactions_fixed' in statement for statement in statements))
+    conn = sqlite3.connect(tmp_path / 'shard.db', isolation_level=None)
+    storage._apply_migrations(conn, storage.SHARD_MIGRATIONS[:fixed])
+    conn.execute("INSERT INTO transactions (user_email, id, type, amount, category, description, date) "
+                 "VALUES ('m@x.com', 1, 'expense', 19.99, 'f', 'a', '2026-01-02')")
+    conn.execute("INSERT INTO budgets (user_email, id, category, limit_amount, month) VALUES ('m@x.com', 1, 'f', 0.3, '2026-01')")
+    conn.execute("INSERT INTO monthly_totals (user_email, month, type, total, count) "
+                 "VALUES ('m@x.com', '2026-01', 'expense', 0.30000000000000004, 2)")
+
+    storage._apply_migrations(conn, storage.SHARD_MIGRATIONS)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(storage.SHARD_MIGRATIONS)
+    assert conn.execute('SELECT amount_minor, currency FROM transactions').fetchall() == [(1999, 'USD')]
+    assert conn.execute('SELECT limit_minor FROM budgets').fetchall() == [(30,)]
+    assert conn.execute('SELECT total_minor FROM monthly_totals').fetchall() == [(30,)]
+    # Users with rows at this point came from the first-start import, so migrate-json skips them
+    assert conn.execute('SELECT user_email FROM json_imported_users').fetchall() == [('m@x.com',)]